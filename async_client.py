@@ -0,0 +1,602 @@
+import asyncio
+import logging
+import itertools
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from codec import CODECS, JSON_CODEC
+from keyindex import scan_request
+from protocol import HEADER, HEADER_SIZE, MAX_FRAME_SIZE, RECV_BUFFER_SIZE, ProtocolError, encode_frame, enable_nodelay
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class AsyncKVConnection:
+    # One TCP connection shared by any number of coroutines. Requests are
+    # tagged with an id and answered through a future that the reader task
+    # resolves when the matching response arrives. Frames queued during one
+    # event loop iteration go out in a single write, so concurrent callers
+    # pipeline without coordinating.
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.codec = JSON_CODEC
+        self.closed = False
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._out = bytearray()
+        self._flush_scheduled = False
+        self._loop = asyncio.get_running_loop()
+        self._reader_task = self._loop.create_task(self._read_loop())
+
+    @classmethod
+    async def open(cls, host: str, port: int, codec: str = 'binary',
+                   timeout: Optional[float] = None) -> 'AsyncKVConnection':
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec!r}; expected one of {list(CODECS)}")
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            enable_nodelay(sock)
+        connection = cls(reader, writer)
+        if codec != JSON_CODEC.name:
+            try:
+                await asyncio.wait_for(connection.negotiate([codec, JSON_CODEC.name]), timeout)
+            except BaseException:
+                connection.close()
+                raise
+        return connection
+
+    async def negotiate(self, codecs: List[str]):
+        # Called before any other request is sent, so no frame in the old
+        # codec can still be on its way back once the answer is in.
+        response = await self.send({'operation': 'hello', 'codecs': codecs})
+        if response.get('success') and response.get('codec') in CODECS:
+            self.codec = CODECS[response['codec']]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    def send(self, request: dict, timeout: Optional[float] = None) -> asyncio.Future:
+        # The deadline is a timer on the request's own future rather than a
+        # wait_for() wrapper, which would cost a task per request.
+        if self.closed:
+            raise ConnectionError("Connection closed")
+        request_id = next(self._ids)
+        frame = encode_frame(dict(request, id=request_id), self.codec)
+        future = self._loop.create_future()
+        self._pending[request_id] = future
+        if timeout is not None:
+            self._timers[request_id] = self._loop.call_later(timeout, self._expire, request_id, timeout)
+        self._out += frame
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+        return future
+
+    def _expire(self, request_id: int, timeout: float):
+        # The response, if it still arrives, is dropped.
+        self._timers.pop(request_id, None)
+        future = self._pending.pop(request_id, None)
+        if future is not None and not future.done():
+            future.set_exception(asyncio.TimeoutError(f"Request timed out after {timeout}s"))
+
+    def _flush(self):
+        self._flush_scheduled = False
+        if self._out and not self.closed:
+            self.writer.write(bytes(self._out))
+            self._out.clear()
+
+    async def _read_loop(self):
+        buffer = bytearray()
+        error: Exception = ConnectionError("Connection closed by server")
+        try:
+            while True:
+                data = await self.reader.read(RECV_BUFFER_SIZE)
+                if not data:
+                    if buffer:
+                        error = ProtocolError("Connection closed mid-frame")
+                    break
+                buffer += data
+                offset = 0
+                while len(buffer) - offset >= HEADER_SIZE:
+                    (length,) = HEADER.unpack_from(buffer, offset)
+                    if length > MAX_FRAME_SIZE:
+                        raise ProtocolError(f"Frame of {length} bytes exceeds limit of {MAX_FRAME_SIZE}")
+                    end = offset + HEADER_SIZE + length
+                    if len(buffer) < end:
+                        break
+                    message = self.codec.decode(bytes(buffer[offset + HEADER_SIZE:end]))
+                    offset = end
+                    request_id = message.pop('id', None)
+                    future = self._pending.pop(request_id, None)
+                    if self._timers:
+                        timer = self._timers.pop(request_id, None)
+                        if timer is not None:
+                            timer.cancel()
+                    if future is not None and not future.done():
+                        future.set_result(message)
+                if offset:
+                    del buffer[:offset]
+        except asyncio.CancelledError:
+            error = ConnectionError("Connection closed")
+        except (OSError, ProtocolError, ValueError) as e:
+            error = e
+        self._fail(error)
+
+    def _fail(self, error: Exception):
+        self.closed = True
+        pending, self._pending = self._pending, {}
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.writer.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._reader_task.cancel()
+            self.writer.close()
+
+
+class AsyncKVStoreClient:
+    # asyncio counterpart of KVStoreClient. Coroutines share a few persistent
+    # connections, each request going to the one with the fewest requests in
+    # flight. Every request has its own deadline: a request that times out
+    # fails on its own while the others on that connection carry on.
+    def __init__(self, host: str = 'localhost', port: int = 5555, connections: int = 2,
+                 timeout: Optional[float] = None, connect_timeout: Optional[float] = 5.0,
+                 codec: str = 'binary'):
+        if connections < 1:
+            raise ValueError("connections must be at least 1")
+        self.host = host
+        self.port = port
+        self.size = connections
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.codec = codec
+        self._connections: List[Optional[AsyncKVConnection]] = [None] * connections
+        self._connecting: Dict[int, asyncio.Future] = {}
+        # Blocking acquires are answered only once the lock is handed over and
+        # the server answers a connection's requests in order, so they wait
+        # on connections of their own rather than stall everyone else's.
+        self._blocking_idle: List[AsyncKVConnection] = []
+        self._stats = {'requests': 0, 'timeouts': 0, 'reconnects': 0, 'errors': 0}
+        logger.info(f"AsyncKVStoreClient initialized for {host}:{port}")
+
+    async def __aenter__(self) -> 'AsyncKVStoreClient':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _slot(self, index: int) -> AsyncKVConnection:
+        connection = self._connections[index]
+        if connection is not None and not connection.closed:
+            return connection
+        # Concurrent callers that find the slot empty share one connect.
+        connecting = self._connecting.get(index)
+        if connecting is None:
+            connecting = asyncio.ensure_future(self._open())
+            self._connecting[index] = connecting
+            try:
+                connection = await connecting
+            finally:
+                del self._connecting[index]
+            if self._connections[index] is not None:
+                self._stats['reconnects'] += 1
+            self._connections[index] = connection
+            return connection
+        return await asyncio.shield(connecting)
+
+    async def _open(self) -> AsyncKVConnection:
+        return await AsyncKVConnection.open(self.host, self.port, self.codec, self.connect_timeout)
+
+    async def _connection(self) -> AsyncKVConnection:
+        best = None
+        for index, connection in enumerate(self._connections):
+            if connection is None or connection.closed:
+                return await self._slot(index)
+            if best is None or connection.in_flight < best.in_flight:
+                best = connection
+        return best
+
+    async def _send_requests(self, requests: List[dict], timeout: Optional[float] = None) -> List[dict]:
+        # The requests go out together on one connection and share a deadline.
+        if timeout is None:
+            timeout = self.timeout
+        self._stats['requests'] += len(requests)
+        try:
+            connection = await self._connection()
+            futures = [connection.send(request, timeout) for request in requests]
+            if len(futures) == 1:
+                return [await futures[0]]
+            return await asyncio.gather(*futures)
+        except asyncio.TimeoutError as e:
+            self._stats['timeouts'] += 1
+            logger.error(f"Request failed: {e or 'timed out'}")
+            return [{'success': False, 'error': 'Request timed out'} for _ in requests]
+        except ConnectionRefusedError:
+            self._stats['errors'] += 1
+            logger.error(f"Connection refused to {self.host}:{self.port}")
+            return [{'success': False, 'error': 'Connection refused'} for _ in requests]
+        except Exception as e:
+            self._stats['errors'] += 1
+            logger.error(f"Request failed: {e}")
+            return [{'success': False, 'error': str(e)} for _ in requests]
+
+    async def _send_request(self, request: dict, timeout: Optional[float] = None) -> dict:
+        return (await self._send_requests([request], timeout))[0]
+
+    async def _send_blocking(self, request: dict, wait: float) -> dict:
+        # Runs the request on a connection of its own; the request deadline is
+        # extended by the time the server may legitimately wait.
+        self._stats['requests'] += 1
+        timeout = self.timeout + wait if self.timeout is not None else None
+        try:
+            connection = None
+            while self._blocking_idle and connection is None:
+                connection = self._blocking_idle.pop()
+                if connection.closed:
+                    connection = None
+            if connection is None:
+                connection = await self._open()
+        except Exception as e:
+            self._stats['errors'] += 1
+            logger.error(f"Request failed: {e}")
+            return {'success': False, 'error': str(e)}
+        try:
+            response = await connection.send(request, timeout)
+        except asyncio.TimeoutError as e:
+            self._stats['timeouts'] += 1
+            connection.close()
+            logger.error(f"Request failed: {e}")
+            return {'success': False, 'error': 'Request timed out'}
+        except Exception as e:
+            self._stats['errors'] += 1
+            connection.close()
+            logger.error(f"Request failed: {e}")
+            return {'success': False, 'error': str(e)}
+        if len(self._blocking_idle) < self.size:
+            self._blocking_idle.append(connection)
+        else:
+            connection.close()
+        return response
+
+    def client_stats(self) -> Dict[str, int]:
+        stats = dict(self._stats)
+        open_connections = [c for c in self._connections if c is not None and not c.closed]
+        stats['connections'] = len(open_connections)
+        stats['in_flight'] = sum(c.in_flight for c in open_connections)
+        stats['blocking_idle'] = len(self._blocking_idle)
+        return stats
+
+    async def close(self):
+        connections = [c for c in self._connections if c is not None] + self._blocking_idle
+        self._connections = [None] * self.size
+        self._blocking_idle = []
+        for connection in connections:
+            connection.close()
+        for connection in connections:
+            try:
+                await connection.writer.wait_closed()
+            except (OSError, ConnectionError):
+                pass
+
+    def pipeline(self) -> 'AsyncPipeline':
+        return AsyncPipeline(self)
+
+    async def get(self, key: str, timeout: Optional[float] = None) -> Optional[Any]:
+        response = await self._send_request({'operation': 'get', 'key': key}, timeout)
+        if response.get('success'):
+            return response.get('value')
+        logger.error(f"GET failed: {response.get('error')}")
+        return None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None, token: Optional[int] = None,
+                  timeout: Optional[float] = None) -> bool:
+        return await self.set_with_version(key, value, ttl, token, timeout) is not None
+
+    async def set_with_version(self, key: str, value: Any, ttl: Optional[float] = None,
+                               token: Optional[int] = None, timeout: Optional[float] = None) -> Optional[int]:
+        request = {'operation': 'set', 'key': key, 'value': value}
+        if ttl is not None:
+            request['ttl'] = ttl
+        if token is not None:
+            request['token'] = token
+        response = await self._send_request(request, timeout)
+        if response.get('success'):
+            return response.get('version')
+        logger.error(f"SET failed: {response.get('error')}")
+        return None
+
+    async def get_with_version(self, key: str, timeout: Optional[float] = None) -> Tuple[Optional[Any], int]:
+        response = await self._send_request({'operation': 'get_with_version', 'key': key}, timeout)
+        if response.get('success'):
+            return response.get('value'), response.get('version', 0)
+        logger.error(f"GET_WITH_VERSION failed: {response.get('error')}")
+        return None, 0
+
+    async def cas(self, key: str, expected_version: int, value: Any, ttl: Optional[float] = None,
+                  token: Optional[int] = None, timeout: Optional[float] = None) -> Tuple[bool, int]:
+        request = {'operation': 'cas', 'key': key, 'expected_version': expected_version, 'value': value}
+        if ttl is not None:
+            request['ttl'] = ttl
+        if token is not None:
+            request['token'] = token
+        response = await self._send_request(request, timeout)
+        if 'error' in response:
+            logger.error(f"CAS failed: {response.get('error')}")
+        return response.get('success', False), response.get('version', 0)
+
+    async def delete(self, key: str, token: Optional[int] = None, timeout: Optional[float] = None) -> bool:
+        request = {'operation': 'delete', 'key': key}
+        if token is not None:
+            request['token'] = token
+        response = await self._send_request(request, timeout)
+        success = response.get('success', False)
+        if not success:
+            logger.error(f"DELETE failed: {response.get('error')}")
+        return success
+
+    async def mget(self, keys: List[str], timeout: Optional[float] = None) -> Dict[str, Any]:
+        response = await self._send_request({'operation': 'mget', 'keys': list(keys)}, timeout)
+        if response.get('success'):
+            return response.get('values', {})
+        logger.error(f"MGET failed: {response.get('error')}")
+        return {}
+
+    async def mset(self, items: Dict[str, Any], ttl: Optional[float] = None,
+                   timeout: Optional[float] = None) -> bool:
+        request = {'operation': 'mset', 'items': dict(items)}
+        if ttl is not None:
+            request['ttl'] = ttl
+        response = await self._send_request(request, timeout)
+        success = response.get('success', False)
+        if not success:
+            logger.error(f"MSET failed: {response.get('error')}")
+        return success
+
+    async def mdelete(self, keys: List[str], timeout: Optional[float] = None) -> int:
+        response = await self._send_request({'operation': 'mdelete', 'keys': list(keys)}, timeout)
+        if response.get('success'):
+            return response.get('deleted', 0)
+        logger.error(f"MDELETE failed: {response.get('error')}")
+        return 0
+
+    async def expire(self, key: str, ttl: Optional[float], timeout: Optional[float] = None) -> bool:
+        response = await self._send_request({'operation': 'expire', 'key': key, 'ttl': ttl}, timeout)
+        if 'error' in response:
+            logger.error(f"EXPIRE failed: {response.get('error')}")
+        return response.get('success', False)
+
+    async def ttl(self, key: str, timeout: Optional[float] = None) -> Optional[float]:
+        response = await self._send_request({'operation': 'ttl', 'key': key}, timeout)
+        if response.get('success'):
+            return response.get('ttl')
+        return None
+
+    async def acquire_lock(self, key: str, owner: str, lease_duration: float = 30.0,
+                           wait: Optional[float] = None, shared: bool = False,
+                           timeout: Optional[float] = None) -> Optional[int]:
+        # wait is the server-side lock wait (KVStoreClient's acquire_lock
+        # timeout); timeout bounds the request itself, as for every operation.
+        # Returns the fencing token, or None if the lock was not acquired.
+        request = {'operation': 'acquire_lock', 'key': key, 'owner': owner,
+                   'lease_duration': lease_duration}
+        if shared:
+            request['shared'] = True
+        if wait:
+            request['timeout'] = wait
+            response = await self._send_blocking(request, wait)
+        else:
+            response = await self._send_request(request, timeout)
+        if response.get('success'):
+            return response.get('token')
+        mode = 'shared' if shared else 'exclusive'
+        logger.warning(f"LOCK FAILED key='{key}' owner='{owner}' mode={mode}")
+        return None
+
+    async def release_lock(self, key: str, owner: str, timeout: Optional[float] = None) -> bool:
+        response = await self._send_request({'operation': 'release_lock', 'key': key, 'owner': owner},
+                                            timeout)
+        success = response.get('success', False)
+        if not success:
+            logger.warning(f"UNLOCK FAILED key='{key}' owner='{owner}'")
+        return success
+
+    async def acquire_locks(self, keys: List[str], owner: str, lease_duration: float = 30.0,
+                            timeout: Optional[float] = None) -> Optional[int]:
+        acquired = await self.acquire_locks_with_new(keys, owner, lease_duration, timeout)
+        return acquired[0] if acquired is not None else None
+
+    async def acquire_locks_with_new(self, keys: List[str], owner: str, lease_duration: float = 30.0,
+                                     timeout: Optional[float] = None) -> Optional[Tuple[int, List[str]]]:
+        request = {'operation': 'acquire_locks', 'keys': list(keys), 'owner': owner,
+                   'lease_duration': lease_duration}
+        response = await self._send_request(request, timeout)
+        if response.get('success'):
+            return response.get('token'), response.get('acquired', request['keys'])
+        logger.warning(f"LOCKS FAILED keys={len(request['keys'])} owner='{owner}'")
+        return None
+
+    async def release_locks(self, keys: List[str], owner: str, timeout: Optional[float] = None) -> int:
+        request = {'operation': 'release_locks', 'keys': list(keys), 'owner': owner}
+        response = await self._send_request(request, timeout)
+        if response.get('success'):
+            return response.get('released', 0)
+        logger.warning(f"UNLOCK FAILED keys={len(request['keys'])} owner='{owner}'")
+        return 0
+
+    async def renew_lease(self, key: str, owner: str, lease_duration: float = 30.0,
+                          timeout: Optional[float] = None) -> bool:
+        request = {'operation': 'renew_lease', 'key': key, 'owner': owner,
+                   'lease_duration': lease_duration}
+        response = await self._send_request(request, timeout)
+        success = response.get('success', False)
+        if not success:
+            logger.warning(f"RENEW FAILED key='{key}' owner='{owner}'")
+        return success
+
+    async def renew_leases(self, owner: str, keys: Optional[List[str]] = None, lease_duration: float = 30.0,
+                           timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        request = {'operation': 'renew_leases', 'owner': owner, 'lease_duration': lease_duration}
+        if keys is not None:
+            request['keys'] = list(keys)
+        response = await self._send_request(request, timeout)
+        if response.get('success'):
+            return {'renewed': response.get('renewed', 0), 'lost': response.get('lost') or []}
+        logger.warning(f"RENEW LEASES FAILED owner='{owner}': {response.get('error')}")
+        return None
+
+    async def is_locked(self, key: str, timeout: Optional[float] = None) -> bool:
+        response = await self._send_request({'operation': 'is_locked', 'key': key}, timeout)
+        if response.get('success'):
+            return response.get('locked', False)
+        return False
+
+    async def get_lock_info(self, key: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        response = await self._send_request({'operation': 'get_lock_info', 'key': key}, timeout)
+        if response.get('success'):
+            return response.get('lock_info')
+        return None
+
+    async def scan(self, prefix: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                   limit: int = 100, cursor: Optional[str] = None, values: bool = False,
+                   timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        request = scan_request('scan', prefix=prefix, start=start, end=end, limit=limit, cursor=cursor,
+                               values=values or None)
+        response = await self._send_request(request, timeout)
+        if response.get('success'):
+            field = 'items' if values else 'keys'
+            return {field: response[field], 'cursor': response.get('cursor')}
+        return None
+
+    async def list_locks(self, prefix: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None,
+                         timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        response = await self._send_request(scan_request('list_locks', prefix=prefix, limit=limit,
+                                                         cursor=cursor), timeout)
+        if response.get('success'):
+            return {'locks': response['locks'], 'cursor': response.get('cursor')}
+        return None
+
+    async def cleanup_expired_locks(self, timeout: Optional[float] = None) -> int:
+        response = await self._send_request({'operation': 'cleanup_expired_locks'}, timeout)
+        if response.get('success'):
+            return response.get('cleaned', 0)
+        return 0
+
+    async def snapshot(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        response = await self._send_request({'operation': 'snapshot'}, timeout)
+        if response.get('success'):
+            return response.get('snapshot')
+        logger.error(f"SNAPSHOT failed: {response.get('error')}")
+        return None
+
+    async def reaper_stats(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        response = await self._send_request({'operation': 'reaper_stats'}, timeout)
+        if response.get('success'):
+            return response.get('reaper')
+        return None
+
+    async def stats(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        response = await self._send_request({'operation': 'stats'}, timeout)
+        if response.get('success'):
+            return response.get('stats')
+        return None
+
+    async def memory(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        response = await self._send_request({'operation': 'memory'}, timeout)
+        if response.get('success'):
+            return response.get('memory')
+        return None
+
+
+class AsyncPipeline:
+    def __init__(self, client: AsyncKVStoreClient):
+        self._client = client
+        self._requests: List[dict] = []
+        self._results: List[Callable[[dict], Any]] = []
+
+    def _queue(self, request: dict, result: Callable[[dict], Any]) -> 'AsyncPipeline':
+        self._requests.append(request)
+        self._results.append(result)
+        return self
+
+    def get(self, key: str) -> 'AsyncPipeline':
+        return self._queue({'operation': 'get', 'key': key},
+                           lambda r: r.get('value') if r.get('success') else None)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None,
+            token: Optional[int] = None) -> 'AsyncPipeline':
+        request = {'operation': 'set', 'key': key, 'value': value}
+        if ttl is not None:
+            request['ttl'] = ttl
+        if token is not None:
+            request['token'] = token
+        return self._queue(request, lambda r: r.get('success', False))
+
+    def set_with_version(self, key: str, value: Any, ttl: Optional[float] = None,
+                         token: Optional[int] = None) -> 'AsyncPipeline':
+        request = {'operation': 'set', 'key': key, 'value': value}
+        if ttl is not None:
+            request['ttl'] = ttl
+        if token is not None:
+            request['token'] = token
+        return self._queue(request, lambda r: r.get('version') if r.get('success') else None)
+
+    def get_with_version(self, key: str) -> 'AsyncPipeline':
+        return self._queue({'operation': 'get_with_version', 'key': key},
+                           lambda r: (r.get('value'), r.get('version', 0)) if r.get('success') else (None, 0))
+
+    def cas(self, key: str, expected_version: int, value: Any, ttl: Optional[float] = None,
+            token: Optional[int] = None) -> 'AsyncPipeline':
+        request = {'operation': 'cas', 'key': key, 'expected_version': expected_version, 'value': value}
+        if ttl is not None:
+            request['ttl'] = ttl
+        if token is not None:
+            request['token'] = token
+        return self._queue(request, lambda r: (r.get('success', False), r.get('version', 0)))
+
+    def delete(self, key: str, token: Optional[int] = None) -> 'AsyncPipeline':
+        request = {'operation': 'delete', 'key': key}
+        if token is not None:
+            request['token'] = token
+        return self._queue(request, lambda r: r.get('success', False))
+
+    def acquire_lock(self, key: str, owner: str, lease_duration: float = 30.0,
+                     shared: bool = False) -> 'AsyncPipeline':
+        request = {'operation': 'acquire_lock', 'key': key, 'owner': owner,
+                   'lease_duration': lease_duration}
+        if shared:
+            request['shared'] = True
+        return self._queue(request, lambda r: r.get('token') if r.get('success') else None)
+
+    def release_lock(self, key: str, owner: str) -> 'AsyncPipeline':
+        return self._queue({'operation': 'release_lock', 'key': key, 'owner': owner},
+                           lambda r: r.get('success', False))
+
+    def renew_lease(self, key: str, owner: str, lease_duration: float = 30.0) -> 'AsyncPipeline':
+        return self._queue({'operation': 'renew_lease', 'key': key, 'owner': owner,
+                            'lease_duration': lease_duration},
+                           lambda r: r.get('success', False))
+
+    def is_locked(self, key: str) -> 'AsyncPipeline':
+        return self._queue({'operation': 'is_locked', 'key': key},
+                           lambda r: r.get('locked', False) if r.get('success') else False)
+
+    def get_lock_info(self, key: str) -> 'AsyncPipeline':
+        return self._queue({'operation': 'get_lock_info', 'key': key},
+                           lambda r: r.get('lock_info') if r.get('success') else None)
+
+    async def execute(self, timeout: Optional[float] = None) -> List[Any]:
+        if not self._requests:
+            return []
+        requests, results = self._requests, self._results
+        self._requests, self._results = [], []
+        responses = await self._client._send_requests(requests, timeout)
+        return [result(response) for result, response in zip(results, responses)]
@@ -0,0 +1,318 @@
+import time
+import asyncio
+import logging
+from typing import List, Optional, Set
+from kv_store import LockWaiter
+from protocol import HEADER, HEADER_SIZE, MAX_FRAME_SIZE, encode_frame, enable_nodelay
+from server import ClientSession, KVStoreServer, PendingResponse, TOO_MANY_CONNECTIONS, WATCH_HEARTBEAT, WatchStream
+from wal import WALError
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def raise_open_file_limit():
+    # Every connection is a file descriptor; lift the soft limit to the hard
+    # limit so the event loop can actually hold tens of thousands of sockets.
+    try:
+        import resource
+    except ImportError:
+        return
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            logger.info(f"Raised open file limit from {soft} to {hard}")
+    except (ValueError, OSError) as e:
+        logger.warning(f"Could not raise open file limit: {e}")
+
+
+class AsyncKVStoreServer(KVStoreServer):
+    def __init__(self, host: str = '0.0.0.0', port: int = 5555, backlog: int = 1024,
+                 max_connections: Optional[int] = 10000, read_limit: int = 256 * 1024,
+                 write_buffer_high: int = 256 * 1024, max_inflight: int = 128, **kwargs):
+        super().__init__(host, port, backlog=backlog, max_connections=max_connections, **kwargs)
+        self.read_limit = read_limit
+        self.write_buffer_high = write_buffer_high
+        self.max_inflight = max_inflight
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        addr = writer.get_extra_info('peername')
+        if not self._open_connection():
+            logger.warning(f"Rejecting {addr}: connection limit {self.max_connections} reached")
+            writer.write(encode_frame(TOO_MANY_CONNECTIONS))
+            writer.close()
+            return
+
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            enable_nodelay(sock)
+        # Once this much response data is queued for a slow reader, drain()
+        # suspends the connection and we stop reading its requests.
+        writer.transport.set_write_buffer_limits(high=self.write_buffer_high)
+        logger.info(f"Client connected from {addr}")
+        session = ClientSession(addr)
+
+        # Responses leave in request order through a bounded queue. Reading
+        # pauses once max_inflight responses are waiting, and a response is only
+        # written after the log records it depends on are durable, so pipelined
+        # writes on one connection share fsyncs instead of waiting one by one.
+        responses: asyncio.Queue = asyncio.Queue(maxsize=self.max_inflight)
+        outstanding = [0]
+        # Lock acquires still parked in a wait queue, withdrawn on disconnect.
+        parked: Set[PendingResponse] = set()
+        send_task = asyncio.ensure_future(
+            self._send_responses(writer, responses, outstanding, parked, addr, asyncio.current_task()))
+
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(HEADER_SIZE)
+                except asyncio.IncompleteReadError as e:
+                    if e.partial:
+                        logger.error(f"Protocol error from {addr}: connection closed mid-frame")
+                    break
+
+                (length,) = HEADER.unpack(header)
+                if length > MAX_FRAME_SIZE:
+                    logger.error(f"Protocol error from {addr}: frame of {length} bytes exceeds limit")
+                    break
+                try:
+                    frame = await reader.readexactly(length)
+                except asyncio.IncompleteReadError:
+                    logger.error(f"Protocol error from {addr}: connection closed mid-frame")
+                    break
+
+                with self.deferred_sync() as pending:
+                    response = self.handle_frame(frame, session)
+                if isinstance(response, PendingResponse):
+                    parked.add(response)
+                    outstanding[0] += 1
+                    await responses.put((response, 0))
+                    continue
+                if isinstance(response, WatchStream):
+                    # A watch takes over the connection: anything the client
+                    # sends from now on is discarded until it hangs up.
+                    outstanding[0] += 1
+                    await responses.put((response, 0))
+                    while await reader.read(self.read_limit):
+                        pass
+                    self.watch_hub.unwatch(response.watcher)
+                    break
+                if not pending.lsn and not outstanding[0]:
+                    # Nothing queued ahead and nothing to fsync: skip the hand-off.
+                    writer.write(response)
+                    await writer.drain()
+                    continue
+                outstanding[0] += 1
+                await responses.put((response, pending.lsn))
+
+            # The peer is gone: stop waiting for locks on its behalf, or the
+            # sender would sit on a parked acquire until its timeout.
+            for response in list(parked):
+                response.cancel()
+            await responses.put(None)
+            await send_task
+
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.error(f"Error handling client {addr}: {e}")
+        finally:
+            send_task.cancel()
+            for response in parked:
+                response.cancel()
+            self._close_connection()
+            writer.close()
+            logger.info(f"Client disconnected: {addr}")
+
+    async def _send_responses(self, writer: asyncio.StreamWriter, responses: asyncio.Queue,
+                              outstanding: List[int], parked: Set[PendingResponse], addr,
+                              reader_task: asyncio.Task):
+        try:
+            while True:
+                item = await responses.get()
+                if item is None:
+                    return
+                response, lsn = item
+                if isinstance(response, WatchStream):
+                    await self._stream_watch(writer, response)
+                    # The stream only ends when the client or the server is
+                    # going away; stop reading so the connection closes.
+                    reader_task.cancel()
+                    return
+                if isinstance(response, PendingResponse):
+                    result, lsn = await response.future
+                    parked.discard(response)
+                    self.record_request(response.operation, time.perf_counter() - response.started, result)
+                    response = response.encode(result)
+                if lsn and self.wal.durable_lsn < lsn:
+                    await self.wait_durable_async(lsn)
+                writer.write(response)
+                outstanding[0] -= 1
+                if responses.empty():
+                    await writer.drain()
+        except WALError as e:
+            # Never acknowledge writes that did not reach the log.
+            logger.error(f"Dropping client {addr}: {e}")
+            reader_task.cancel()
+        except ConnectionError:
+            reader_task.cancel()
+
+    async def _stream_watch(self, writer: asyncio.StreamWriter, stream: WatchStream):
+        # The hub's dispatcher thread wakes this coroutine through the loop
+        # once per batch of events.
+        loop = self._loop
+        wake = asyncio.Event()
+        watcher = stream.watcher
+        watcher.notify = lambda: loop.call_soon_threadsafe(wake.set)
+        try:
+            writer.write(stream.encode(stream.ack))
+            while not watcher.closed:
+                wake.clear()
+                events = watcher.drain()
+                if events:
+                    writer.write(stream.encode_events(events))
+                    await writer.drain()
+                if watcher.overflowed:
+                    writer.write(stream.encode(stream.overflow_error()))
+                    await writer.drain()
+                    return
+                if not events:
+                    try:
+                        await asyncio.wait_for(wake.wait(), WATCH_HEARTBEAT)
+                    except asyncio.TimeoutError:
+                        writer.write(stream.heartbeat())
+                        await writer.drain()
+        finally:
+            self.watch_hub.unwatch(watcher)
+
+    def acquire_lock_blocking(self, key: str, owner: str, lease_duration: float, timeout: float,
+                              shared: bool = False):
+        # Parks a callback waiter instead of blocking the event loop. The
+        # response goes out once the lock is handed over or the wait times out.
+        loop = self._loop
+        future = loop.create_future()
+
+        def resolved(waiter: LockWaiter):
+            # Runs on whichever thread granted or refused the lock.
+            loop.call_soon_threadsafe(_resolve, waiter)
+
+        def _resolve(waiter: LockWaiter):
+            if not future.done():
+                future.set_result(({'success': waiter.granted, 'token': waiter.token}, waiter.lsn or 0))
+
+        waiter = self.store.wait_for_lock(key, owner, lease_duration, timeout, resolved, shared)
+        pending = PendingResponse(future, 'acquire_lock')
+        pending.cancel = lambda: self.store.cancel_waiter(waiter)
+        if not waiter.done:
+            asyncio.ensure_future(self._watch_waiter(waiter, future))
+        return pending
+
+    def snapshot_response(self):
+        # Serializing and fsyncing a snapshot takes long on a large store, so
+        # it runs on the default executor while the loop keeps serving.
+        future = self._loop.run_in_executor(None, self._write_snapshot)
+        return PendingResponse(future, 'snapshot')
+
+    def _write_snapshot(self):
+        try:
+            return {'success': True, 'snapshot': self.snapshot()}, 0
+        except Exception as e:
+            logger.error(f"Error processing snapshot: {e}")
+            return {'success': False, 'error': str(e)}, 0
+
+    def wait_for_replication(self, since: int, epoch: Optional[str], limit: int, wait: float):
+        # Parks the replica's long-poll instead of blocking the event loop. It
+        # is answered on the first record appended after since, or after wait.
+        loop = self._loop
+        future = loop.create_future()
+        timer = None
+
+        def finish():
+            if not future.done():
+                if timer is not None:
+                    timer.cancel()
+                future.set_result((self.replication_batch(since, epoch, limit), 0))
+
+        timer = loop.call_later(wait, finish)
+        cancel = self.replication.notify_when(since, lambda: loop.call_soon_threadsafe(finish))
+        pending = PendingResponse(future, 'replicate')
+
+        def withdraw():
+            cancel()
+            timer.cancel()
+        pending.cancel = withdraw
+        return pending
+
+    async def _watch_waiter(self, waiter: LockWaiter, future: asyncio.Future):
+        # Wakes at the waiter's deadline or when the holder's lease falls due,
+        # so a timed-out wait or an expired lease is handled without the reaper.
+        while not future.done():
+            wake_at = self.store.poll_waiter(waiter)
+            if wake_at is None:
+                return
+            try:
+                await asyncio.wait_for(asyncio.shield(future), max(wake_at - time.time(), 0.0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def wait_durable_async(self, lsn: int):
+        # The group-commit flusher resolves the future, so the event loop keeps
+        # serving other connections while this one waits for its fsync.
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def done(error):
+            loop.call_soon_threadsafe(_resolve, error)
+
+        def _resolve(error):
+            if future.done():
+                return
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+        self.wal.when_durable(lsn, done)
+        await future
+
+    async def serve(self):
+        raise_open_file_limit()
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(
+            self.handle_connection,
+            self.host,
+            self.port,
+            backlog=self.backlog,
+            limit=self.read_limit,
+            reuse_address=True
+        )
+        self.running = True
+        self.start_background_tasks()
+        logger.info(f"Async server listening on {self.host}:{self.port} "
+                    f"(backlog={self.backlog}, max_connections={self.max_connections})")
+
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def start(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            logger.info("Server shutting down...")
+        finally:
+            self.running = False
+            self.stop_background_tasks()
+            self.close_storage()
+            logger.info("Server stopped")
+
+    def stop(self):
+        self.running = False
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
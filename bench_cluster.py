@@ -0,0 +1,226 @@
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+from benchmark import free_port, wait_for_port
+from metrics import Histogram
+from sharded_client import HashRing, ShardedKVClient
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+
+
+def quiet():
+    for name in ('client', 'pool', 'sharded_client'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+def start_nodes(count: int, mode: str) -> Tuple[List[subprocess.Popen], List[str]]:
+    servers, endpoints = [], []
+    for _ in range(count):
+        port = free_port()
+        servers.append(subprocess.Popen([sys.executable, SERVER, '--host', '127.0.0.1', '--port', str(port),
+                                         '--mode', mode, '--max-connections', '10000'],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        endpoints.append(f"127.0.0.1:{port}")
+    for endpoint in endpoints:
+        wait_for_port('127.0.0.1', int(endpoint.rsplit(':', 1)[1]))
+    return servers, endpoints
+
+
+def start_workers(count: int, mode: str) -> Tuple[List[subprocess.Popen], List[str]]:
+    # One server running `count` worker processes on consecutive ports.
+    port = free_port_block(count)
+    server = subprocess.Popen([sys.executable, SERVER, '--host', '127.0.0.1', '--port', str(port),
+                               '--mode', mode, '--max-connections', '10000', '--workers', str(count)],
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for index in range(count):
+        wait_for_port('127.0.0.1', port + index)
+    return [server], [f"127.0.0.1:{port}"]
+
+
+def free_port_block(count: int) -> int:
+    while True:
+        port = free_port()
+        if all(port_free(port + index) for index in range(1, count)):
+            return port
+
+
+def port_free(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        try:
+            s.bind(('127.0.0.1', port))
+        except OSError:
+            return False
+    return True
+
+
+def connect(config: Dict[str, Any], endpoints: List[str], **client_options) -> ShardedKVClient:
+    if config['workers']:
+        return ShardedKVClient.for_workers(endpoints[0], codec=config['codec'], **client_options)
+    return ShardedKVClient(endpoints, vnodes=config['vnodes'], codec=config['codec'], **client_options)
+
+
+def stop_nodes(servers: List[subprocess.Popen]):
+    for server in servers:
+        server.terminate()
+    for server in servers:
+        try:
+            server.wait(timeout=10.0)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def worker(client: ShardedKVClient, config: Dict[str, Any], seed: int, measure_from: float,
+           stop_at: float, results: List[Tuple[int, Histogram]]):
+    rng = random.Random(seed)
+    value = 'x' * config['value_size']
+    latency = Histogram()
+    count = 0
+    while True:
+        key = f"key:{rng.randrange(config['keys'])}"
+        started = time.perf_counter()
+        if started >= stop_at:
+            break
+        if rng.random() < config['read_ratio']:
+            client.get(key)
+        else:
+            client.set(key, value)
+        if started >= measure_from:
+            latency.observe(time.perf_counter() - started)
+            count += 1
+    results.append((count, latency))
+
+
+def run_process(config: Dict[str, Any], endpoints: List[str], index: int, start_at: float, queue):
+    quiet()
+    client = connect(config, endpoints, pool_max_size=config['clients'])
+    offset = time.perf_counter() - time.time()
+    measure_from = start_at + offset + config['warmup']
+    stop_at = measure_from + config['duration']
+    results: List[Tuple[int, Histogram]] = []
+    threads = [threading.Thread(target=worker, args=(client, config, index * 1000 + i, measure_from,
+                                                     stop_at, results))
+               for i in range(config['clients'])]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    client.close()
+    latency = Histogram()
+    for _, histogram in results:
+        latency.merge(histogram)
+    queue.put((sum(count for count, _ in results), latency))
+
+
+def run(config: Dict[str, Any], nodes: int) -> Dict[str, float]:
+    launch = start_workers if config['workers'] else start_nodes
+    servers, endpoints = launch(nodes, config['server_mode'])
+    try:
+        loader = connect(config, endpoints)
+        value = 'x' * config['value_size']
+        for start in range(0, config['keys'], 1000):
+            loader.mset({f"key:{i}": value for i in range(start, min(start + 1000, config['keys']))})
+        loader.close()
+
+        queue = multiprocessing.Queue()
+        start_at = time.time() + 0.5
+        processes = [multiprocessing.Process(target=run_process, args=(config, endpoints, i, start_at, queue))
+                     for i in range(config['processes'])]
+        for p in processes:
+            p.start()
+        results = [queue.get() for _ in processes]
+        for p in processes:
+            p.join()
+    finally:
+        stop_nodes(servers)
+
+    latency = Histogram()
+    for _, histogram in results:
+        latency.merge(histogram)
+    return {
+        'ops_per_sec': sum(count for count, _ in results) / config['duration'],
+        'p50_ms': latency.percentile(0.5) * 1000.0,
+        'p99_ms': latency.percentile(0.99) * 1000.0,
+    }
+
+
+def movement(node_counts: List[int], keys: int, vnodes: int):
+    # Fraction of keys that change node when one node joins or leaves, for the
+    # ring and for plain hash-modulo placement, plus how evenly the ring
+    # spreads keys (largest node's share relative to a perfect split).
+    sample = [f"key:{i}" for i in range(keys)]
+    print(f"\n{'nodes':>6} {'ring +1 moved':>14} {'ring -1 moved':>14} {'modulo +1 moved':>16} "
+          f"{'ideal':>7} {'max/mean load':>14}")
+    for count in node_counts:
+        names = [f"node-{i}" for i in range(count + 1)]
+        ring = HashRing(names[:count], vnodes)
+        before = [ring.node_for(key) for key in sample]
+        ring.add_node(names[count])
+        grown = sum(a != ring.node_for(key) for a, key in zip(before, sample)) / keys
+        ring.remove_node(names[count])
+        if count > 1:
+            ring.remove_node(names[0])
+            shrunk = sum(a != ring.node_for(key) for a, key in zip(before, sample)) / keys
+            ring.add_node(names[0])
+        else:
+            shrunk = None
+        modulo = sum(hash_mod(key, count) != hash_mod(key, count + 1) for key in sample) / keys
+        loads: Dict[str, int] = {}
+        for node in before:
+            loads[node] = loads.get(node, 0) + 1
+        balance = max(loads.values()) / (keys / count)
+        shrunk_text = f"{shrunk:.1%}" if shrunk is not None else '-'
+        print(f"{count:>6} {grown:>14.1%} {shrunk_text:>14} {modulo:>16.1%} {1 / (count + 1):>7.1%} "
+              f"{balance:>14.2f}")
+
+
+def hash_mod(key: str, count: int) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big') % count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of the sharded client against local clusters')
+    parser.add_argument('--nodes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--server-mode', choices=['threaded', 'async'], default='threaded')
+    parser.add_argument('--processes', type=int, default=4, help='client processes')
+    parser.add_argument('--clients', type=int, default=8, help='client threads per process')
+    parser.add_argument('--duration', type=float, default=5.0, help='measured seconds per cluster size')
+    parser.add_argument('--warmup', type=float, default=1.0)
+    parser.add_argument('--keys', type=int, default=10000)
+    parser.add_argument('--read-ratio', type=float, default=0.8)
+    parser.add_argument('--value-size', type=int, default=100)
+    parser.add_argument('--vnodes', type=int, default=160)
+    parser.add_argument('--codec', choices=['binary', 'json'], default='binary')
+    parser.add_argument('--workers', action='store_true',
+                        help='run each cluster size as one server with that many --workers instead of separate servers')
+    parser.add_argument('--movement-keys', type=int, default=100000,
+                        help='keys sampled for the rebalancing analysis (0 skips it)')
+    args = parser.parse_args()
+    quiet()
+    logging.getLogger('benchmark').setLevel(logging.WARNING)
+
+    config = vars(args)
+    print(f"{'nodes':>6} {'ops/s':>10} {'speedup':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    baseline = None
+    for nodes in args.nodes:
+        result = run(config, nodes)
+        baseline = baseline or result['ops_per_sec']
+        print(f"{nodes:>6} {result['ops_per_sec']:>10,.0f} {result['ops_per_sec'] / baseline:>7.2f}x "
+              f"{result['p50_ms']:>8.3f} {result['p99_ms']:>8.3f}")
+    if args.movement_keys:
+        movement(args.nodes, args.movement_keys, args.vnodes)
+
+
+if __name__ == "__main__":
+    main()
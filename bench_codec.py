@@ -0,0 +1,46 @@
+import argparse
+import os
+import timeit
+from typing import Dict
+from codec import CODECS
+
+MESSAGES: Dict[str, dict] = {
+    'get request': {'operation': 'get', 'key': 'user:12345', 'id': 42},
+    'get response': {'success': True, 'value': 'hello world', 'id': 42},
+    'set request': {'operation': 'set', 'key': 'user:12345', 'value': 'hello world', 'id': 43},
+    'set 1KB bytes': {'operation': 'set', 'key': 'blob:1', 'value': os.urandom(1024), 'id': 44},
+    'acquire_lock': {'operation': 'acquire_lock', 'key': 'resource:7', 'owner': 'worker-7',
+                     'lease_duration': 10.0, 'id': 45},
+    'lock_info response': {'success': True, 'lock_info': {'owner': 'worker-7', 'acquired_at': 1.7e9,
+                                                          'expires_at': 1.7e9 + 10, 'time_remaining': 9.5,
+                                                          'lease_duration': 10.0, 'token': 1234,
+                                                          'mode': 'exclusive'},
+                           'id': 46},
+    'mget 50 keys': {'operation': 'mget', 'keys': [f"user:{i}" for i in range(50)], 'id': 47},
+}
+
+
+def measure(codec, message: dict, number: int):
+    payload = codec.encode(message)
+    if codec.decode(payload) != message:
+        raise AssertionError(f"{codec.name} does not round-trip {message!r}")
+    encode = timeit.timeit(lambda: codec.encode(message), number=number) / number
+    decode = timeit.timeit(lambda: codec.decode(payload), number=number) / number
+    return len(payload), encode * 1e6, decode * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Wire codec microbenchmark')
+    parser.add_argument('--number', type=int, default=20000, help='iterations per measurement')
+    parser.add_argument('--codecs', nargs='+', default=list(CODECS), choices=list(CODECS))
+    args = parser.parse_args()
+
+    print(f"{'message':<20} {'codec':<8} {'bytes':>7} {'encode us':>10} {'decode us':>10}")
+    for name, message in MESSAGES.items():
+        for codec_name in args.codecs:
+            size, encode, decode = measure(CODECS[codec_name], message, args.number)
+            print(f"{name:<20} {codec_name:<8} {size:>7} {encode:>10.2f} {decode:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
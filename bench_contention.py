@@ -0,0 +1,77 @@
+import argparse
+import logging
+import random
+import threading
+import time
+from typing import List
+from kv_store import DistributedKVStore, ShardedKVStore
+
+
+def worker(store, keys: List[str], ops: int, read_ratio: float, lock_ratio: float,
+           seed: int, barrier: threading.Barrier, results: List[int]):
+    rng = random.Random(seed)
+    owner = f"bench-{seed}"
+    barrier.wait()
+    done = 0
+    for _ in range(ops):
+        key = rng.choice(keys)
+        roll = rng.random()
+        if roll < lock_ratio:
+            if store.acquire_lock(key, owner, 5.0):
+                store.release_lock(key, owner)
+        elif roll < lock_ratio + read_ratio:
+            store.get(key)
+            store.is_locked(key)
+        else:
+            store.set(key, done)
+        done += 1
+    results.append(done)
+
+
+def run(store, threads: int, ops: int, num_keys: int, read_ratio: float, lock_ratio: float) -> float:
+    keys = [f"key:{i}" for i in range(num_keys)]
+    for key in keys:
+        store.set(key, 0)
+
+    barrier = threading.Barrier(threads + 1)
+    results: List[int] = []
+    workers = [
+        threading.Thread(target=worker,
+                         args=(store, keys, ops, read_ratio, lock_ratio, i, barrier, results))
+        for i in range(threads)
+    ]
+    for t in workers:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return sum(results) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Store lock contention benchmark')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=20000, help='operations per thread')
+    parser.add_argument('--keys', type=int, default=10000)
+    parser.add_argument('--read-ratio', type=float, default=0.7)
+    parser.add_argument('--lock-ratio', type=float, default=0.1)
+    parser.add_argument('--log-level', default='WARNING',
+                        help='store log level; DEBUG enables per-operation logging')
+    args = parser.parse_args()
+
+    logging.getLogger('kv_store').setLevel(args.log_level)
+
+    print(f"{'threads':>8} {'global lock ops/s':>18} {f'{args.shards} shards ops/s':>18} {'speedup':>8}")
+    for threads in args.threads:
+        single = run(DistributedKVStore(), threads, args.ops, args.keys,
+                     args.read_ratio, args.lock_ratio)
+        sharded = run(ShardedKVStore(args.shards), threads, args.ops, args.keys,
+                      args.read_ratio, args.lock_ratio)
+        print(f"{threads:>8} {single:>18,.0f} {sharded:>18,.0f} {sharded / single:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+import os
+import sys
+import json
+import time
+import socket
+import random
+import bisect
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+import multiprocessing
+from typing import Any, Dict, List, Optional, Tuple
+from metrics import Histogram
+from pool import ConnectionPool
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Ops in --mix. 'lock' is a lease cycle on one of --lock-keys keys: acquire,
+# hold for --hold-ms, renew with probability --renew-ratio, then release. Each
+# of those calls is timed separately. 'rlock' is the same cycle with a shared
+# lease, so readers only contend with 'lock' writers.
+MIX_OPS = ('get', 'set', 'delete', 'lock', 'rlock')
+DEFAULT_MIX = 'get=70,set=20,delete=5,lock=5'
+
+
+def parse_mix(mix: str) -> List[Tuple[str, float]]:
+    weights = []
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in MIX_OPS:
+            raise ValueError(f"Unknown op {name!r} in mix; expected one of {MIX_OPS}")
+        weights.append((name, float(weight)))
+    total = sum(weight for _, weight in weights)
+    if total <= 0:
+        raise ValueError("Mix weights must add up to more than zero")
+    cumulative = []
+    running = 0.0
+    for name, weight in weights:
+        running += weight / total
+        cumulative.append((name, running))
+    return cumulative
+
+
+class KeyChooser:
+    # Uniform picks any key with equal probability; zipfian ranks keys so that
+    # key i is chosen with probability proportional to 1 / (i + 1) ** s.
+    def __init__(self, num_keys: int, distribution: str, zipf_s: float, rng: random.Random):
+        self.num_keys = num_keys
+        self.distribution = distribution
+        self.rng = rng
+        self._cdf: Optional[List[float]] = None
+        if distribution == 'zipfian':
+            weights = [1.0 / (i + 1) ** zipf_s for i in range(num_keys)]
+            total = sum(weights)
+            running = 0.0
+            self._cdf = []
+            for weight in weights:
+                running += weight / total
+                self._cdf.append(running)
+
+    def next(self) -> int:
+        if self._cdf is None:
+            return self.rng.randrange(self.num_keys)
+        return min(bisect.bisect_left(self._cdf, self.rng.random()), self.num_keys - 1)
+
+
+class OpStats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.ok = 0
+        self.failed = 0
+        self.errors = 0
+
+    def merge(self, other: 'OpStats'):
+        self.latency.merge(other.latency)
+        self.ok += other.ok
+        self.failed += other.failed
+        self.errors += other.errors
+
+
+def client_loop(config: Dict[str, Any], seed: int, start_at: float, measure_from: float,
+                stop_at: float, results: Dict[str, OpStats]):
+    rng = random.Random(seed)
+    pool = ConnectionPool(config['host'], config['port'], max_size=1, timeout=30.0, codec=config['codec'])
+    keys = KeyChooser(config['keys'], config['distribution'], config['zipf_s'], rng)
+    lock_keys = KeyChooser(config['lock_keys'], config['distribution'], config['zipf_s'], rng)
+    mix = parse_mix(config['mix'])
+    value = 'x' * config['value_size']
+    owner = f"bench-{seed}"
+    hold = config['hold_ms'] / 1000.0
+
+    def call(op: str, request: dict) -> bool:
+        started = time.perf_counter()
+        try:
+            response = pool.request_many([request])[0]
+        except Exception:
+            response = {'success': False, 'error': 'connection'}
+        elapsed = time.perf_counter() - started
+        if started >= measure_from:
+            stats = results.get(op)
+            if stats is None:
+                stats = results[op] = OpStats()
+            stats.latency.observe(elapsed)
+            if response.get('success'):
+                stats.ok += 1
+            elif 'error' in response:
+                stats.errors += 1
+            else:
+                stats.failed += 1
+        return bool(response.get('success'))
+
+    while time.perf_counter() < start_at:
+        time.sleep(0.001)
+    try:
+        while time.perf_counter() < stop_at:
+            roll = rng.random()
+            op = next(name for name, bound in mix if roll <= bound)
+            if op in ('lock', 'rlock'):
+                key = f"lock:{lock_keys.next()}"
+                request = {'operation': 'acquire_lock', 'key': key, 'owner': owner,
+                           'lease_duration': config['lease_duration']}
+                if config['lock_timeout']:
+                    request['timeout'] = config['lock_timeout']
+                if op == 'rlock':
+                    request['shared'] = True
+                if call('acquire_lock' if op == 'lock' else 'acquire_shared_lock', request):
+                    if hold:
+                        time.sleep(hold)
+                    if rng.random() < config['renew_ratio']:
+                        call('renew_lease', {'operation': 'renew_lease', 'key': key, 'owner': owner,
+                                             'lease_duration': config['lease_duration']})
+                    call('release_lock', {'operation': 'release_lock', 'key': key, 'owner': owner})
+            elif op == 'get':
+                call('get', {'operation': 'get', 'key': f"key:{keys.next()}"})
+            elif op == 'set':
+                call('set', {'operation': 'set', 'key': f"key:{keys.next()}", 'value': value})
+            else:
+                call('delete', {'operation': 'delete', 'key': f"key:{keys.next()}"})
+    finally:
+        pool.close()
+
+
+def run_process(config: Dict[str, Any], process_index: int, start_at: float) -> Dict[str, OpStats]:
+    # perf_counter is not comparable across processes, so each process turns
+    # the shared wall-clock start time into its own deadlines.
+    offset = time.perf_counter() - time.time()
+    start = start_at + offset
+    measure_from = start + config['warmup']
+    stop_at = measure_from + config['duration']
+
+    per_thread: List[Dict[str, OpStats]] = []
+    threads = []
+    for i in range(config['clients']):
+        results: Dict[str, OpStats] = {}
+        per_thread.append(results)
+        seed = config['seed'] * 1000003 + process_index * 10007 + i
+        threads.append(threading.Thread(target=client_loop, daemon=True,
+                                        args=(config, seed, start, measure_from, stop_at, results)))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    merged: Dict[str, OpStats] = {}
+    for results in per_thread:
+        for op, stats in results.items():
+            merged.setdefault(op, OpStats()).merge(stats)
+    return merged
+
+
+def _process_main(config: Dict[str, Any], process_index: int, start_at: float, queue):
+    logging.getLogger('pool').setLevel(logging.WARNING)
+    queue.put(run_process(config, process_index, start_at))
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(host: str, port: int, timeout: float = 15.0):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1.0).close()
+            return
+        except OSError:
+            if time.time() > deadline:
+                raise RuntimeError(f"Server on {host}:{port} did not come up within {timeout}s")
+            time.sleep(0.05)
+
+
+def start_server(args) -> subprocess.Popen:
+    # The server runs in its own process so client load generation does not
+    # compete with it for the interpreter lock.
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'),
+               '--host', '127.0.0.1', '--port', str(args.port), '--mode', args.server_mode,
+               '--shards', str(args.shards), '--max-connections', str(args.max_connections)]
+    if args.data_dir:
+        command += ['--data-dir', args.data_dir, '--durability', args.durability]
+    if args.writer_preference:
+        command.append('--writer-preference')
+    logger.info(f"Starting server: {' '.join(command)}")
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL,
+                              stderr=None if args.server_logs else subprocess.DEVNULL)
+    try:
+        wait_for_port('127.0.0.1', args.port)
+    except RuntimeError:
+        server.kill()
+        raise
+    return server
+
+
+def preload(config: Dict[str, Any], batch: int = 1000):
+    pool = ConnectionPool(config['host'], config['port'], max_size=1, codec=config['codec'])
+    try:
+        value = 'x' * config['value_size']
+        for start in range(0, config['keys'], batch):
+            items = {f"key:{i}": value for i in range(start, min(start + batch, config['keys']))}
+            pool.request_many([{'operation': 'mset', 'items': items}])
+    finally:
+        pool.close()
+
+
+def fetch_server_stats(config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    pool = ConnectionPool(config['host'], config['port'], max_size=1, codec=config['codec'])
+    try:
+        response = pool.request_many([{'operation': 'stats'}])[0]
+        return response.get('stats') if response.get('success') else None
+    except Exception as e:
+        logger.warning(f"Could not fetch server stats: {e}")
+        return None
+    finally:
+        pool.close()
+
+
+def summarize(results: Dict[str, OpStats], duration: float) -> Dict[str, Any]:
+    ops = {}
+    total = OpStats()
+    for op in sorted(results):
+        stats = results[op]
+        total.merge(stats)
+        ops[op] = _summary(stats, duration)
+    return {'ops': ops, 'total': _summary(total, duration)}
+
+
+def _summary(stats: OpStats, duration: float) -> Dict[str, Any]:
+    latency = stats.latency
+    return {
+        'count': latency.count,
+        'ok': stats.ok,
+        'failed': stats.failed,
+        'errors': stats.errors,
+        'throughput': latency.count / duration,
+        'mean_ms': (latency.total / latency.count * 1000.0) if latency.count else 0.0,
+        'p50_ms': latency.percentile(0.5) * 1000.0,
+        'p99_ms': latency.percentile(0.99) * 1000.0,
+        'p999_ms': latency.percentile(0.999) * 1000.0,
+        'max_ms': latency.max * 1000.0,
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    header = (f"{'op':<14} {'count':>9} {'ops/s':>10} {'failed':>7} {'errors':>7} "
+              f"{'mean ms':>8} {'p50 ms':>8} {'p99 ms':>8} {'p999 ms':>8} {'max ms':>8}")
+    print(header)
+    rows = list(report['results']['ops'].items()) + [('total', report['results']['total'])]
+    for op, s in rows:
+        print(f"{op:<14} {s['count']:>9} {s['throughput']:>10,.0f} {s['failed']:>7} {s['errors']:>7} "
+              f"{s['mean_ms']:>8.3f} {s['p50_ms']:>8.3f} {s['p99_ms']:>8.3f} {s['p999_ms']:>8.3f} "
+              f"{s['max_ms']:>8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load generator for the KV store server')
+    parser.add_argument('--server', choices=['spawn', 'external'], default='spawn',
+                        help='spawn a local server.py process, or drive an already running server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None, help='defaults to a free port when spawning')
+    parser.add_argument('--server-mode', choices=['threaded', 'async'], default='threaded')
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--writer-preference', action='store_true',
+                        help='start the server with --writer-preference')
+    parser.add_argument('--max-connections', type=int, default=10000)
+    parser.add_argument('--data-dir', default=None, help='enable the write-ahead log in this directory')
+    parser.add_argument('--durability', default='batch', choices=['batch', 'interval', 'none'])
+    parser.add_argument('--server-logs', action='store_true', help="show the spawned server's log output")
+
+    parser.add_argument('--processes', type=int, default=1, help='client processes')
+    parser.add_argument('--clients', type=int, default=8, help='client threads per process')
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=1.0, help='unmeasured seconds before measuring')
+    parser.add_argument('--codec', choices=['binary', 'json'], default='binary')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f"weighted op mix over {', '.join(MIX_OPS)} (default {DEFAULT_MIX})")
+    parser.add_argument('--keys', type=int, default=10000, help='size of the data key space')
+    parser.add_argument('--distribution', choices=['uniform', 'zipfian'], default='uniform')
+    parser.add_argument('--zipf-s', type=float, default=0.99, help='zipfian skew exponent')
+    parser.add_argument('--value-size', type=int, default=100, help='bytes per value for set')
+    parser.add_argument('--lock-keys', type=int, default=100,
+                        help='distinct lock keys; fewer keys means more contention')
+    parser.add_argument('--hold-ms', type=float, default=0.0, help='time a lease is held before release')
+    parser.add_argument('--renew-ratio', type=float, default=0.5,
+                        help='fraction of held leases renewed before release')
+    parser.add_argument('--lease-duration', type=float, default=30.0)
+    parser.add_argument('--lock-timeout', type=float, default=0.0,
+                        help='park acquires in the server wait queue for up to this many seconds '
+                             '(0: fail immediately when held)')
+    parser.add_argument('--no-preload', action='store_true', help='skip writing the key space first')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=None, help='write the JSON report to this file')
+    parser.add_argument('--label', default=None, help='free-form label stored in the report')
+    args = parser.parse_args()
+
+    parse_mix(args.mix)
+    logging.getLogger('pool').setLevel(logging.WARNING)
+    if args.port is None:
+        if args.server == 'external':
+            parser.error('--port is required with --server external')
+        args.port = free_port()
+    host = '127.0.0.1' if args.server == 'spawn' else args.host
+
+    config = {
+        'host': host, 'port': args.port, 'clients': args.clients, 'duration': args.duration,
+        'warmup': args.warmup, 'codec': args.codec, 'mix': args.mix, 'keys': args.keys,
+        'distribution': args.distribution, 'zipf_s': args.zipf_s, 'value_size': args.value_size,
+        'lock_keys': args.lock_keys, 'hold_ms': args.hold_ms, 'renew_ratio': args.renew_ratio,
+        'lease_duration': args.lease_duration, 'lock_timeout': args.lock_timeout, 'seed': args.seed,
+    }
+
+    server = start_server(args) if args.server == 'spawn' else None
+    try:
+        if not args.no_preload:
+            preload(config)
+        start_at = time.time() + 0.5
+        if args.processes == 1:
+            results = run_process(config, 0, start_at)
+        else:
+            queue = multiprocessing.Queue()
+            # Each process needs time to start before the shared start time.
+            start_at += 1.0
+            workers = [multiprocessing.Process(target=_process_main, args=(config, i, start_at, queue))
+                       for i in range(args.processes)]
+            for w in workers:
+                w.start()
+            results = {}
+            for _ in workers:
+                for op, stats in queue.get().items():
+                    results.setdefault(op, OpStats()).merge(stats)
+            for w in workers:
+                w.join()
+        server_stats = fetch_server_stats(config)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    report = {
+        'label': args.label,
+        'timestamp': time.time(),
+        'config': dict(config, processes=args.processes, server=args.server,
+                       server_mode=args.server_mode, shards=args.shards,
+                       writer_preference=args.writer_preference,
+                       durability=args.durability if args.data_dir else None),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+        'results': summarize(results, args.duration),
+        'server_stats': server_stats,
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
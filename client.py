@@ -1,89 +1,400 @@
+import time
 import socket
-import json
 import logging
-from typing import Any, Optional, Dict
+import itertools
+import threading
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Dict, Tuple, Union
+from keepalive import LeaseKeepalive
+from keyindex import scan_request
+from near_cache import NearCache
+from pool import ConnectionPool, KVConnection, PoolTimeout
+from protocol import ProtocolError, send_message
+from watch import WatchError
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+Endpoint = Union[str, Tuple[str, int]]
+
+
+def parse_endpoint(endpoint: Endpoint) -> Tuple[str, int]:
+    # Accepts 'host:port' or a (host, port) pair.
+    if isinstance(endpoint, str):
+        host, _, port = endpoint.rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError(f"Endpoint {endpoint!r} is not host:port")
+        return host, int(port)
+    host, port = endpoint
+    return host, int(port)
+
 
 class KVStoreClient:
-    def __init__(self, host: str = 'localhost', port: int = 5555):
+    def __init__(self, host: str = 'localhost', port: int = 5555, timeout: Optional[float] = None,
+                 pool_min_size: int = 0, pool_max_size: int = 8,
+                 pool_timeout: Optional[float] = None, max_idle_time: float = 60.0,
+                 codec: str = 'binary', near_cache_size: int = 0,
+                 near_cache_prefixes: Iterable[str] = ('',), replicas: Iterable[Endpoint] = (),
+                 read_from_primary: bool = True, max_replica_lag: Optional[float] = None,
+                 worker_local: bool = False):
         self.host = host
         self.port = port
+        self.timeout = timeout
+        # Set for a connection to one worker of a --workers server: its scans,
+        # lock listings and prefix watches cover that worker's keys only.
+        self.worker_local = worker_local
+        self.pool = ConnectionPool(host, port, min_size=pool_min_size, max_size=pool_max_size,
+                                   timeout=timeout, checkout_timeout=pool_timeout,
+                                   max_idle_time=max_idle_time, codec=codec)
+        # Reads (get, mget, is_locked, get_lock_info) rotate over the replicas
+        # and, with read_from_primary, the primary. A replica read that fails,
+        # is refused or lags more than max_replica_lag seconds is retried on
+        # the primary. Writes and lock operations always go to the primary.
+        self.replica_pools = [ConnectionPool(replica_host, replica_port, max_size=pool_max_size,
+                                             timeout=timeout, checkout_timeout=pool_timeout,
+                                             max_idle_time=max_idle_time, codec=codec)
+                              for replica_host, replica_port in map(parse_endpoint, replicas)]
+        self._read_pools = list(self.replica_pools)
+        if read_from_primary or not self._read_pools:
+            self._read_pools.append(self.pool)
+        self._read_turn = itertools.count()
+        self.max_replica_lag = max_replica_lag
+        self._read_lock = threading.Lock()
+        self._read_stats = {'replica_reads': 0, 'primary_reads': 0, 'fallbacks': 0}
+        # Optional read cache for get(), invalidated by a watch on the cached
+        # prefixes that runs on its own thread and connection.
+        self.near_cache: Optional[NearCache] = None
+        self._closing = threading.Event()
+        self._invalidation_watch: Optional['Watch'] = None
+        if near_cache_size > 0:
+            self.near_cache = NearCache(near_cache_size, near_cache_prefixes)
+            self._invalidator = threading.Thread(target=self._run_invalidation,
+                                                 name='near-cache-invalidation', daemon=True)
+            self._invalidator.start()
         logger.info(f"KVStoreClient initialized for {host}:{port}")
 
-    def _send_request(self, request: dict) -> dict:
+    def _run_invalidation(self):
+        cache = self.near_cache
+        delay = 0.5
+        while not self._closing.is_set():
+            try:
+                watch = Watch(self, [], list(cache.prefixes), types=['set', 'delete', 'expired', 'evicted'],
+                              values=False,
+                              on_connect=lambda: cache.set_online(True),
+                              on_disconnect=lambda: cache.set_online(False))
+            except (OSError, ConnectionError, ProtocolError, WatchError) as e:
+                logger.warning(f"Near cache invalidation stream unavailable: {e}; retrying in {delay:.1f}s")
+                self._closing.wait(delay)
+                delay = min(delay * 2, 5.0)
+                continue
+            delay = 0.5
+            self._invalidation_watch = watch
+            try:
+                if self._closing.is_set():
+                    break
+                for event in watch:
+                    cache.invalidate(event['key'])
+            except WatchError as e:
+                # The stream could not resume; the cache was flushed when it
+                # dropped, so a fresh watch starts from a clean slate.
+                logger.warning(f"Near cache invalidation stream reset: {e}")
+            finally:
+                cache.set_online(False)
+                watch.close()
+
+    def cache_stats(self) -> Optional[Dict[str, Any]]:
+        return self.near_cache.stats() if self.near_cache is not None else None
+
+    def _send_requests(self, requests: List[dict]) -> List[dict]:
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                sock.connect((self.host, self.port))
-                
-                request_data = json.dumps(request).encode('utf-8')
-                sock.sendall(request_data)
-                
-                response_data = sock.recv(4096)
-                response = json.loads(response_data.decode('utf-8'))
-                
-                return response
-                
+            return self.pool.request_many(requests)
+            
         except ConnectionRefusedError:
             logger.error(f"Connection refused to {self.host}:{self.port}")
-            return {'success': False, 'error': 'Connection refused'}
+            return [{'success': False, 'error': 'Connection refused'} for _ in requests]
+        except PoolTimeout as e:
+            logger.error(f"Request failed: {e}")
+            return [{'success': False, 'error': str(e)} for _ in requests]
         except Exception as e:
             logger.error(f"Request failed: {e}")
-            return {'success': False, 'error': str(e)}
+            return [{'success': False, 'error': str(e)} for _ in requests]
+
+    def _send_request(self, request: dict) -> dict:
+        return self._send_requests([request])[0]
+
+    def _send_read(self, request: dict) -> dict:
+        pools = self._read_pools
+        pool = pools[next(self._read_turn) % len(pools)]
+        if pool is not self.pool:
+            try:
+                response = pool.request_many([request])[0]
+            except Exception as e:
+                logger.warning(f"Replica {pool.host}:{pool.port} read failed: {e}")
+                response = {'success': False, 'error': str(e)}
+            seconds = (response.get('lag') or {}).get('seconds')
+            stale = self.max_replica_lag is not None and (seconds is None or seconds > self.max_replica_lag)
+            with self._read_lock:
+                if response.get('success') and not stale:
+                    self._read_stats['replica_reads'] += 1
+                    return response
+                self._read_stats['fallbacks'] += 1
+        with self._read_lock:
+            self._read_stats['primary_reads'] += 1
+        return self._send_request(request)
+
+    def read_stats(self) -> Dict[str, Any]:
+        with self._read_lock:
+            stats: Dict[str, Any] = dict(self._read_stats)
+        stats['replicas'] = [f"{pool.host}:{pool.port}" for pool in self.replica_pools]
+        return stats
+
+    def pool_stats(self) -> Dict[str, float]:
+        return self.pool.stats()
+
+    def close(self):
+        self._closing.set()
+        if self._invalidation_watch is not None:
+            self._invalidation_watch.close()
+        self.pool.close()
+        for pool in self.replica_pools:
+            pool.close()
+
+    def pipeline(self) -> 'Pipeline':
+        return Pipeline(self)
 
     def get(self, key: str) -> Optional[Any]:
+        cache = self.near_cache
+        token = None
+        if cache is not None and cache.cacheable(key):
+            hit, value = cache.lookup(key)
+            if hit:
+                return value
+            token = cache.begin_fill(key)
+        
+        # Cache fills read from the primary: the invalidation stream follows
+        # the primary, so a lagging replica could hand back a value that was
+        # already invalidated and keep it cached.
         request = {'operation': 'get', 'key': key}
-        response = self._send_request(request)
+        response = self._send_request(request) if token is not None else self._send_read(request)
         
         if response.get('success'):
-            logger.info(f"GET key='{key}' value={response.get('value')}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"GET key='{key}' value={response.get('value')}")
+            if token is not None:
+                cache.complete_fill(key, token, response.get('value'))
             return response.get('value')
         else:
             logger.error(f"GET failed: {response.get('error')}")
+            if token is not None:
+                cache.cancel_fill(key, token)
             return None
 
-    def set(self, key: str, value: Any) -> bool:
+    def _invalidate_local(self, keys: Iterable[str]):
+        # Our own writes are dropped from the cache at once rather than when
+        # the server's invalidation arrives, so this client reads its writes.
+        if self.near_cache is not None:
+            for key in keys:
+                self.near_cache.invalidate(key)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, token: Optional[int] = None) -> bool:
+        # With a ttl (seconds) the key expires; without one any earlier TTL
+        # is cleared. With a fencing token from acquire_lock the write only
+        # goes through while that lease still holds the key.
+        return self.set_with_version(key, value, ttl, token) is not None
+
+    def set_with_version(self, key: str, value: Any, ttl: Optional[float] = None,
+                         token: Optional[int] = None) -> Optional[int]:
+        # As set, returning the version the write created for a following
+        # cas, or None if it failed.
         request = {'operation': 'set', 'key': key, 'value': value}
+        if ttl is not None:
+            request['ttl'] = ttl
+        if token is not None:
+            request['token'] = token
         response = self._send_request(request)
+        self._invalidate_local([key])
         
         success = response.get('success', False)
         if success:
-            logger.info(f"SET key='{key}' value={value}")
-        else:
-            logger.error(f"SET failed: {response.get('error')}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"SET key='{key}' value={value} version={response.get('version')}")
+            return response.get('version')
+        logger.error(f"SET failed: {response.get('error')}")
+        return None
+
+    def get_with_version(self, key: str) -> Tuple[Optional[Any], int]:
+        # The value and its version (0 if the key does not exist), for a
+        # following cas. Read from the primary so the version is current.
+        request = {'operation': 'get_with_version', 'key': key}
+        response = self._send_request(request)
         
-        return success
+        if response.get('success'):
+            return response.get('value'), response.get('version', 0)
+        logger.error(f"GET_WITH_VERSION failed: {response.get('error')}")
+        return None, 0
 
-    def delete(self, key: str) -> bool:
+    def cas(self, key: str, expected_version: int, value: Any, ttl: Optional[float] = None,
+            token: Optional[int] = None) -> Tuple[bool, int]:
+        # Writes only if the key is still at expected_version (0: only if it
+        # does not exist yet). Returns whether it wrote and the key's version
+        # afterwards; after a conflict that is the version to retry against.
+        request = {'operation': 'cas', 'key': key, 'expected_version': expected_version, 'value': value}
+        if ttl is not None:
+            request['ttl'] = ttl
+        if token is not None:
+            request['token'] = token
+        response = self._send_request(request)
+        self._invalidate_local([key])
+        
+        success = response.get('success', False)
+        if success:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"CAS key='{key}' version={response.get('version')}")
+        elif 'error' in response:
+            logger.error(f"CAS failed: {response.get('error')}")
+        return success, response.get('version', 0)
+
+    def delete(self, key: str, token: Optional[int] = None) -> bool:
         request = {'operation': 'delete', 'key': key}
+        if token is not None:
+            request['token'] = token
         response = self._send_request(request)
+        self._invalidate_local([key])
         
         success = response.get('success', False)
         if success:
-            logger.info(f"DELETE key='{key}'")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"DELETE key='{key}'")
         else:
             logger.error(f"DELETE failed: {response.get('error')}")
         
         return success
 
-    def acquire_lock(self, key: str, owner: str, lease_duration: float = 30.0) -> bool:
+    def mget(self, keys: List[str]) -> Dict[str, Any]:
+        request = {'operation': 'mget', 'keys': list(keys)}
+        response = self._send_read(request)
+        
+        if response.get('success'):
+            values = response.get('values', {})
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"MGET keys={len(values)}")
+            return values
+        else:
+            logger.error(f"MGET failed: {response.get('error')}")
+            return {}
+
+    def mset(self, items: Dict[str, Any], ttl: Optional[float] = None) -> bool:
+        request = {'operation': 'mset', 'items': dict(items)}
+        if ttl is not None:
+            request['ttl'] = ttl
+        response = self._send_request(request)
+        self._invalidate_local(items)
+        
+        success = response.get('success', False)
+        if success:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"MSET keys={len(items)}")
+        else:
+            logger.error(f"MSET failed: {response.get('error')}")
+        
+        return success
+
+    def mdelete(self, keys: List[str]) -> int:
+        request = {'operation': 'mdelete', 'keys': list(keys)}
+        response = self._send_request(request)
+        self._invalidate_local(keys)
+        
+        if response.get('success'):
+            count = response.get('deleted', 0)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"MDELETE deleted={count}")
+            return count
+        else:
+            logger.error(f"MDELETE failed: {response.get('error')}")
+            return 0
+
+    def scan(self, prefix: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+             limit: int = 100, cursor: Optional[str] = None, values: bool = False) -> Optional[Dict[str, Any]]:
+        # One page of keys in order, under prefix and/or in [start, end):
+        # 'keys' (or 'items' of [key, value] with values) and the 'cursor' to
+        # pass for the next page, None after the last one. Pages can hold
+        # fewer than limit keys before the end.
+        request = scan_request('scan', prefix=prefix, start=start, end=end, limit=limit, cursor=cursor,
+                               values=values or None, local=self.worker_local or None)
+        response = self._send_read(request)
+        
+        if response.get('success'):
+            field = 'items' if values else 'keys'
+            return {field: response[field], 'cursor': response.get('cursor')}
+        return None
+
+    def scan_iter(self, prefix: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                  page_size: int = 100, values: bool = False) -> Iterator[Any]:
+        # Every key in the range, or (key, value) pairs, fetched page by page.
+        cursor = None
+        while True:
+            page = self.scan(prefix, start, end, page_size, cursor, values)
+            if page is None:
+                raise ConnectionError(f"scan failed on {self.host}:{self.port}")
+            if values:
+                yield from (tuple(item) for item in page['items'])
+            else:
+                yield from page['keys']
+            cursor = page['cursor']
+            if cursor is None:
+                return
+
+    def expire(self, key: str, ttl: Optional[float]) -> bool:
+        # Sets the key's TTL in seconds, or removes it with ttl=None. False if
+        # the key does not exist.
+        request = {'operation': 'expire', 'key': key, 'ttl': ttl}
+        response = self._send_request(request)
+        
+        success = response.get('success', False)
+        if success:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"EXPIRE key='{key}' ttl={ttl}")
+        elif 'error' in response:
+            logger.error(f"EXPIRE failed: {response.get('error')}")
+        return success
+
+    def ttl(self, key: str) -> Optional[float]:
+        # Seconds left before the key expires; None for a missing key or one
+        # without a TTL.
+        request = {'operation': 'ttl', 'key': key}
+        response = self._send_read(request)
+        
+        if response.get('success'):
+            return response.get('ttl')
+        return None
+
+    def acquire_lock(self, key: str, owner: str, lease_duration: float = 30.0,
+                     timeout: Optional[float] = None, shared: bool = False) -> Optional[int]:
+        # With a timeout the server queues this request behind earlier waiters
+        # and answers as soon as the lock is handed over, or after timeout
+        # seconds. The client's socket timeout must be longer than that.
+        # A shared lease only excludes exclusive holders. Returns the lease's
+        # fencing token, or None if the lock was not acquired.
         request = {
             'operation': 'acquire_lock',
             'key': key,
             'owner': owner,
             'lease_duration': lease_duration
         }
+        if timeout:
+            request['timeout'] = timeout
+        if shared:
+            request['shared'] = True
         response = self._send_request(request)
         
         success = response.get('success', False)
+        mode = 'shared' if shared else 'exclusive'
         if success:
-            logger.info(f"LOCK ACQUIRED key='{key}' owner='{owner}' duration={lease_duration}s")
-        else:
-            logger.warning(f"LOCK FAILED key='{key}' owner='{owner}'")
-        
-        return success
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LOCK ACQUIRED key='{key}' owner='{owner}' mode={mode} duration={lease_duration}s "
+                             f"token={response.get('token')}")
+            return response.get('token')
+        logger.warning(f"LOCK FAILED key='{key}' owner='{owner}' mode={mode}")
+        return None
 
     def release_lock(self, key: str, owner: str) -> bool:
         request = {
@@ -95,12 +406,56 @@ class KVStoreClient:
         
         success = response.get('success', False)
         if success:
-            logger.info(f"LOCK RELEASED key='{key}' owner='{owner}'")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LOCK RELEASED key='{key}' owner='{owner}'")
         else:
             logger.warning(f"UNLOCK FAILED key='{key}' owner='{owner}'")
         
         return success
 
+    def acquire_locks(self, keys: List[str], owner: str, lease_duration: float = 30.0) -> Optional[int]:
+        # Returns the batch's fencing token, or None if no lock was acquired.
+        acquired = self.acquire_locks_with_new(keys, owner, lease_duration)
+        return acquired[0] if acquired is not None else None
+
+    def acquire_locks_with_new(self, keys: List[str], owner: str,
+                               lease_duration: float = 30.0) -> Optional[Tuple[int, List[str]]]:
+        # The batch's fencing token and the keys owner did not hold before the
+        # call; keys already held are kept (with the new token) and not listed.
+        request = {
+            'operation': 'acquire_locks',
+            'keys': list(keys),
+            'owner': owner,
+            'lease_duration': lease_duration
+        }
+        response = self._send_request(request)
+        
+        success = response.get('success', False)
+        if success:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LOCKS ACQUIRED keys={len(request['keys'])} owner='{owner}' duration={lease_duration}s "
+                             f"token={response.get('token')}")
+            return response.get('token'), response.get('acquired', request['keys'])
+        logger.warning(f"LOCKS FAILED keys={len(request['keys'])} owner='{owner}'")
+        return None
+
+    def release_locks(self, keys: List[str], owner: str) -> int:
+        request = {
+            'operation': 'release_locks',
+            'keys': list(keys),
+            'owner': owner
+        }
+        response = self._send_request(request)
+        
+        if response.get('success'):
+            count = response.get('released', 0)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LOCKS RELEASED released={count} owner='{owner}'")
+            return count
+        else:
+            logger.warning(f"UNLOCK FAILED keys={len(request['keys'])} owner='{owner}'")
+            return 0
+
     def renew_lease(self, key: str, owner: str, lease_duration: float = 30.0) -> bool:
         request = {
             'operation': 'renew_lease',
@@ -112,15 +467,40 @@ class KVStoreClient:
         
         success = response.get('success', False)
         if success:
-            logger.info(f"LEASE RENEWED key='{key}' owner='{owner}'")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LEASE RENEWED key='{key}' owner='{owner}'")
         else:
             logger.warning(f"RENEW FAILED key='{key}' owner='{owner}'")
         
         return success
 
+    def renew_leases(self, owner: str, keys: Optional[List[str]] = None,
+                     lease_duration: float = 30.0) -> Optional[Dict[str, Any]]:
+        # Renews every lease owner holds, or only those on keys, in one
+        # request. Returns how many were renewed and the keys whose leases
+        # owner has lost; None if the request failed.
+        request = {'operation': 'renew_leases', 'owner': owner, 'lease_duration': lease_duration}
+        if keys is not None:
+            request['keys'] = list(keys)
+        response = self._send_request(request)
+        
+        if response.get('success'):
+            result = {'renewed': response.get('renewed', 0), 'lost': response.get('lost') or []}
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LEASES RENEWED owner='{owner}' renewed={result['renewed']} lost={len(result['lost'])}")
+            return result
+        logger.warning(f"RENEW LEASES FAILED owner='{owner}': {response.get('error')}")
+        return None
+
+    def keepalive(self, lease_duration: float = 30.0, interval: Optional[float] = None,
+                  on_lost: Optional[Callable[[str, List[str]], None]] = None) -> LeaseKeepalive:
+        # A started LeaseKeepalive renewing this client's leases in the
+        # background; stop() it, or use it as a context manager.
+        return LeaseKeepalive(self, lease_duration, interval, on_lost).start()
+
     def is_locked(self, key: str) -> bool:
         request = {'operation': 'is_locked', 'key': key}
-        response = self._send_request(request)
+        response = self._send_read(request)
         
         if response.get('success'):
             return response.get('locked', False)
@@ -128,12 +508,35 @@ class KVStoreClient:
 
     def get_lock_info(self, key: str) -> Optional[Dict[str, Any]]:
         request = {'operation': 'get_lock_info', 'key': key}
-        response = self._send_request(request)
+        response = self._send_read(request)
         
         if response.get('success'):
             return response.get('lock_info')
         return None
 
+    def list_locks(self, prefix: Optional[str] = None, limit: int = 100,
+                   cursor: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        # One page of held locks in key order: 'locks', each described as by
+        # get_lock_info plus 'key', and the 'cursor' for the next page.
+        request = scan_request('list_locks', prefix=prefix, limit=limit, cursor=cursor,
+                               local=self.worker_local or None)
+        response = self._send_read(request)
+        
+        if response.get('success'):
+            return {'locks': response['locks'], 'cursor': response.get('cursor')}
+        return None
+
+    def iter_locks(self, prefix: Optional[str] = None, page_size: int = 100) -> Iterator[Dict[str, Any]]:
+        cursor = None
+        while True:
+            page = self.list_locks(prefix, page_size, cursor)
+            if page is None:
+                raise ConnectionError(f"list_locks failed on {self.host}:{self.port}")
+            yield from page['locks']
+            cursor = page['cursor']
+            if cursor is None:
+                return
+
     def cleanup_expired_locks(self) -> int:
         request = {'operation': 'cleanup_expired_locks'}
         response = self._send_request(request)
@@ -143,3 +546,292 @@ class KVStoreClient:
             logger.info(f"CLEANUP removed {count} expired locks")
             return count
         return 0
+
+    def snapshot(self) -> Optional[Dict[str, Any]]:
+        request = {'operation': 'snapshot'}
+        response = self._send_request(request)
+        
+        if response.get('success'):
+            stats = response.get('snapshot')
+            logger.info(f"SNAPSHOT written at LSN {stats.get('lsn')}")
+            return stats
+        logger.error(f"SNAPSHOT failed: {response.get('error')}")
+        return None
+
+    def reaper_stats(self) -> Optional[Dict[str, Any]]:
+        request = {'operation': 'reaper_stats'}
+        response = self._send_request(request)
+        
+        if response.get('success'):
+            return response.get('reaper')
+        return None
+
+    def stats(self) -> Optional[Dict[str, Any]]:
+        request = {'operation': 'stats'}
+        response = self._send_request(request)
+        
+        if response.get('success'):
+            return response.get('stats')
+        return None
+
+    def memory(self) -> Optional[Dict[str, Any]]:
+        # Estimated memory use, the limit and eviction policy, key counts and
+        # expired/evicted totals.
+        request = {'operation': 'memory'}
+        response = self._send_request(request)
+        
+        if response.get('success'):
+            return response.get('memory')
+        return None
+
+    def replication(self) -> Optional[Dict[str, Any]]:
+        # The primary's replication position and the replicas following it.
+        request = {'operation': 'replication'}
+        response = self._send_request(request)
+        
+        if response.get('success'):
+            return response.get('replication')
+        return None
+
+    def topology(self) -> Optional[Dict[str, Any]]:
+        # Worker count, this server's worker index and every worker's port;
+        # a server without --workers is a single worker.
+        request = {'operation': 'topology'}
+        response = self._send_request(request)
+        
+        if response.get('success'):
+            return response.get('topology')
+        return None
+
+    def promote(self) -> bool:
+        # Sent to a replica: stop following the primary and accept writes.
+        request = {'operation': 'promote'}
+        response = self._send_request(request)
+        
+        success = response.get('success', False)
+        if success:
+            logger.warning(f"PROMOTED {self.host}:{self.port} to primary at seq {response.get('applied')}")
+        else:
+            logger.error(f"PROMOTE failed: {response.get('error')}")
+        return success
+
+    def watch(self, keys: Iterable[str] = (), prefixes: Iterable[str] = (),
+              since: Optional[int] = None, epoch: Optional[str] = None) -> 'Watch':
+        # Streams change events for the keys and key prefixes over a dedicated
+        # connection. Pass the seq and epoch of the last event seen to resume
+        # an earlier watch.
+        return Watch(self, list(keys), list(prefixes), since, epoch)
+
+
+class Pipeline:
+    def __init__(self, client: KVStoreClient):
+        self._client = client
+        self._requests: List[dict] = []
+        self._results: List[Callable[[dict], Any]] = []
+
+    def _queue(self, request: dict, result: Callable[[dict], Any]) -> 'Pipeline':
+        self._requests.append(request)
+        self._results.append(result)
+        return self
+
+    def get(self, key: str) -> 'Pipeline':
+        return self._queue({'operation': 'get', 'key': key},
+                           lambda r: r.get('value') if r.get('success') else None)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, token: Optional[int] = None) -> 'Pipeline':
+        request = {'operation': 'set', 'key': key, 'value': value}
+        if ttl is not None:
+            request['ttl'] = ttl
+        if token is not None:
+            request['token'] = token
+        return self._queue(request, lambda r: r.get('success', False))
+
+    def set_with_version(self, key: str, value: Any, ttl: Optional[float] = None,
+                         token: Optional[int] = None) -> 'Pipeline':
+        request = {'operation': 'set', 'key': key, 'value': value}
+        if ttl is not None:
+            request['ttl'] = ttl
+        if token is not None:
+            request['token'] = token
+        return self._queue(request, lambda r: r.get('version') if r.get('success') else None)
+
+    def get_with_version(self, key: str) -> 'Pipeline':
+        return self._queue({'operation': 'get_with_version', 'key': key},
+                           lambda r: (r.get('value'), r.get('version', 0)) if r.get('success') else (None, 0))
+
+    def cas(self, key: str, expected_version: int, value: Any, ttl: Optional[float] = None,
+            token: Optional[int] = None) -> 'Pipeline':
+        request = {'operation': 'cas', 'key': key, 'expected_version': expected_version, 'value': value}
+        if ttl is not None:
+            request['ttl'] = ttl
+        if token is not None:
+            request['token'] = token
+        return self._queue(request, lambda r: (r.get('success', False), r.get('version', 0)))
+
+    def delete(self, key: str, token: Optional[int] = None) -> 'Pipeline':
+        request = {'operation': 'delete', 'key': key}
+        if token is not None:
+            request['token'] = token
+        return self._queue(request, lambda r: r.get('success', False))
+
+    def acquire_lock(self, key: str, owner: str, lease_duration: float = 30.0,
+                     shared: bool = False) -> 'Pipeline':
+        request = {'operation': 'acquire_lock', 'key': key, 'owner': owner,
+                   'lease_duration': lease_duration}
+        if shared:
+            request['shared'] = True
+        return self._queue(request, lambda r: r.get('token') if r.get('success') else None)
+
+    def release_lock(self, key: str, owner: str) -> 'Pipeline':
+        return self._queue({'operation': 'release_lock', 'key': key, 'owner': owner},
+                           lambda r: r.get('success', False))
+
+    def renew_lease(self, key: str, owner: str, lease_duration: float = 30.0) -> 'Pipeline':
+        return self._queue({'operation': 'renew_lease', 'key': key, 'owner': owner,
+                            'lease_duration': lease_duration},
+                           lambda r: r.get('success', False))
+
+    def is_locked(self, key: str) -> 'Pipeline':
+        return self._queue({'operation': 'is_locked', 'key': key},
+                           lambda r: r.get('locked', False) if r.get('success') else False)
+
+    def get_lock_info(self, key: str) -> 'Pipeline':
+        return self._queue({'operation': 'get_lock_info', 'key': key},
+                           lambda r: r.get('lock_info') if r.get('success') else None)
+
+    def execute(self) -> List[Any]:
+        if not self._requests:
+            return []
+        requests, results = self._requests, self._results
+        self._requests, self._results = [], []
+        responses = self._client._send_requests(requests)
+        self._client._invalidate_local(request['key'] for request in requests
+                                       if request['operation'] in ('set', 'cas', 'delete'))
+        return [result(response) for result, response in zip(results, responses)]
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def __enter__(self) -> 'Pipeline':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.execute()
+
+
+class Watch:
+    # Iterating yields event dicts (seq, type, key, time, and value or owner).
+    # A dropped connection is re-established and the watch resumed after the
+    # last event yielded, so nothing is skipped or repeated. WatchError means
+    # the server can no longer fill the gap (history exceeded or restarted):
+    # re-read the current state and start a new watch. The server sends a
+    # heartbeat on idle streams, so a stream silent for heartbeat_timeout is
+    # treated as dropped.
+    def __init__(self, client: KVStoreClient, keys: List[str], prefixes: List[str],
+                 since: Optional[int] = None, epoch: Optional[str] = None,
+                 types: Optional[List[str]] = None, values: bool = True,
+                 on_connect: Optional[Callable[[], None]] = None,
+                 on_disconnect: Optional[Callable[[], None]] = None,
+                 heartbeat_timeout: Optional[float] = 15.0,
+                 reconnect_delay: float = 0.5, max_reconnect_delay: float = 5.0):
+        self.client = client
+        self.keys = keys
+        self.prefixes = prefixes
+        self.seq = since
+        self.epoch = epoch
+        self.types = types
+        self.values = values
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.heartbeat_timeout = heartbeat_timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.reconnects = 0
+        self._connection: Optional[KVConnection] = None
+        self._closed = False
+        self._connect()
+
+    def _connect(self):
+        connection = KVConnection(self.client.host, self.client.port, timeout=self.heartbeat_timeout,
+                                  codec=self.client.pool.codec)
+        try:
+            request = {'operation': 'watch', 'id': 1, 'keys': self.keys, 'prefixes': self.prefixes}
+            if self.seq is not None:
+                request['since'] = self.seq
+                request['epoch'] = self.epoch
+            if self.types is not None:
+                request['types'] = self.types
+            if not self.values:
+                request['values'] = False
+            if self.client.worker_local:
+                request['local'] = True
+            send_message(connection.sock, request, connection.codec)
+            ack = connection.reader.read_message()
+            if ack is None:
+                raise ConnectionError("Connection closed by server")
+            if not ack.get('success'):
+                raise WatchError(ack.get('error', 'watch refused'))
+        except BaseException:
+            connection.close()
+            raise
+        self.epoch = ack['epoch']
+        if self.seq is None:
+            self.seq = ack['seq']
+        self._connection = connection
+        logger.info(f"WATCH keys={len(self.keys)} prefixes={len(self.prefixes)} from seq {self.seq}")
+        if self.on_connect is not None:
+            self.on_connect()
+
+    def _reconnect(self):
+        delay = self.reconnect_delay
+        while not self._closed:
+            try:
+                self._connect()
+                self.reconnects += 1
+                return
+            except (OSError, ConnectionError, ProtocolError) as e:
+                logger.warning(f"WATCH reconnect failed: {e}; retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        while not self._closed:
+            connection = self._connection
+            try:
+                message = connection.reader.read_message() if connection is not None else None
+            except (OSError, ProtocolError):
+                message = None
+            if message is None or not message.get('success'):
+                if self._closed:
+                    return
+                if message is not None:
+                    logger.warning(f"WATCH interrupted: {message.get('error')}")
+                if connection is not None:
+                    connection.close()
+                self._connection = None
+                if self.on_disconnect is not None:
+                    self.on_disconnect()
+                self._reconnect()
+                continue
+            for event in message.get('events', ()):
+                self.seq = event['seq']
+                yield event
+
+    def close(self):
+        # Safe to call from another thread to end an iteration in progress.
+        self._closed = True
+        connection = self._connection
+        if connection is not None:
+            # shutdown() wakes a recv blocked on another thread; close() alone does not.
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+
+    def __enter__(self) -> 'Watch':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
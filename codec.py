@@ -0,0 +1,297 @@
+import json
+import base64
+import struct
+import itertools
+from typing import Any, Dict, List, Tuple
+
+
+def _json_default(obj: Any) -> Any:
+    # Raw byte values have no JSON form; they travel as {"$bytes": base64}.
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return {'$bytes': base64.b64encode(bytes(obj)).decode('ascii')}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _json_object_hook(obj: Dict[str, Any]) -> Any:
+    if len(obj) == 1:
+        if '$bytes' in obj:
+            return base64.b64decode(obj['$bytes'])
+        if '$dict' in obj:
+            return dict(obj['$dict'])
+    return obj
+
+
+def _escape_tags(value: Any) -> Any:
+    # A stored dict whose only key is "$bytes" or "$dict" would decode as a
+    # tag, so it travels as {"$dict": [[key, value]]}. Pairs rather than a
+    # nested object, since the hook decodes inner objects first.
+    kind = type(value)
+    if kind is dict:
+        escaped = {key: _escape_tags(item) for key, item in value.items()}
+        if len(escaped) == 1 and ('$bytes' in escaped or '$dict' in escaped):
+            return {'$dict': [[key, item] for key, item in escaped.items()]}
+        return escaped
+    if kind is list or kind is tuple:
+        return [_escape_tags(item) for item in value]
+    return value
+
+
+def json_dumps(message: Any) -> bytes:
+    data = json.dumps(message, separators=(',', ':'), default=_json_default).encode('utf-8')
+    # Only messages that mention a tag name at all pay for the second pass.
+    if b'"$bytes"' in data or b'"$dict"' in data:
+        data = json.dumps(_escape_tags(message), separators=(',', ':'), default=_json_default).encode('utf-8')
+    return data
+
+
+def json_loads(payload: bytes) -> Any:
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload.decode('utf-8')
+    return json.loads(payload, object_hook=_json_object_hook)
+
+
+class JsonCodec:
+    name = 'json'
+
+    def encode(self, message: Any) -> bytes:
+        return json_dumps(message)
+
+    def decode(self, payload: bytes) -> Any:
+        return json_loads(payload)
+
+
+# Binary codec. A message is a sequence of fields, each a one-byte field tag
+# followed by a typed value. Common fields have fixed tags, operations are a
+# single opcode byte and everything else falls back to a named field, so any
+# message the JSON codec can carry round-trips through this one as well.
+T_NONE = 0x00
+T_FALSE = 0x01
+T_TRUE = 0x02
+T_INT = 0x03
+T_FLOAT = 0x04
+T_STR = 0x05
+T_BYTES = 0x06
+T_LIST = 0x07
+T_DICT = 0x08
+T_BIGINT = 0x09
+T_STR_LIST = 0x0A
+
+FIELDS = [
+    'operation', 'id', 'key', 'value', 'owner', 'lease_duration', 'success', 'error',
+    'keys', 'items', 'values', 'locked', 'lock_info',
+]
+FIELD_TAGS = {name: tag for tag, name in enumerate(FIELDS, start=1)}
+TAG_FIELDS = {tag: name for name, tag in FIELD_TAGS.items()}
+TAG_OPCODE = 0xFE
+TAG_NAMED = 0xFF
+
+OPERATIONS = [
+    'get', 'set', 'delete', 'mget', 'mset', 'mdelete', 'acquire_lock', 'acquire_locks',
+    'release_lock', 'release_locks', 'renew_lease', 'is_locked', 'get_lock_info',
+    'cleanup_expired_locks', 'hello', 'snapshot', 'reaper_stats', 'stats', 'watch',
+    'replicate', 'replicate_sync', 'replication', 'promote', 'expire', 'ttl', 'memory',
+    'cas', 'get_with_version', 'renew_leases', 'topology',
+    'scan', 'list_locks',
+]
+OPCODES = {name: code for code, name in enumerate(OPERATIONS, start=1)}
+OPERATION_NAMES = {code: name for name, code in OPCODES.items()}
+
+_U8 = struct.Struct('>B')
+_U32 = struct.Struct('>I')
+_I64 = struct.Struct('>q')
+_F64 = struct.Struct('>d')
+_TYPE_U32 = struct.Struct('>BI')
+_TYPE_I64 = struct.Struct('>Bq')
+_TYPE_F64 = struct.Struct('>Bd')
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+
+
+def _encode_value(value: Any, out: bytearray):
+    kind = type(value)
+    if kind is str:
+        data = value.encode('utf-8')
+        out += _TYPE_U32.pack(T_STR, len(data))
+        out += data
+    elif value is None:
+        out.append(T_NONE)
+    elif kind is bool:
+        out.append(T_TRUE if value else T_FALSE)
+    elif kind is int:
+        if _INT64_MIN <= value <= _INT64_MAX:
+            out += _TYPE_I64.pack(T_INT, value)
+        else:
+            data = str(value).encode('ascii')
+            out += _TYPE_U32.pack(T_BIGINT, len(data))
+            out += data
+    elif kind is float:
+        out += _TYPE_F64.pack(T_FLOAT, value)
+    elif kind is bytes or kind is bytearray or kind is memoryview:
+        data = bytes(value)
+        out += _TYPE_U32.pack(T_BYTES, len(data))
+        out += data
+    elif kind is list or kind is tuple:
+        if value and all(type(item) is str for item in value):
+            # Key lists dominate batch traffic: all lengths go in one struct
+            # call followed by the concatenated strings.
+            encoded = [item.encode('utf-8') for item in value]
+            out += _TYPE_U32.pack(T_STR_LIST, len(encoded))
+            out += struct.pack(f'>{len(encoded)}I', *map(len, encoded))
+            out += b''.join(encoded)
+        else:
+            out += _TYPE_U32.pack(T_LIST, len(value))
+            for item in value:
+                _encode_value(item, out)
+    elif kind is dict:
+        out += _TYPE_U32.pack(T_DICT, len(value))
+        for k, v in value.items():
+            data = str(k).encode('utf-8')
+            out += _U32.pack(len(data))
+            out += data
+            _encode_value(v, out)
+    elif isinstance(value, bool):
+        out.append(T_TRUE if value else T_FALSE)
+    elif isinstance(value, int):
+        _encode_value(int(value), out)
+    elif isinstance(value, float):
+        _encode_value(float(value), out)
+    elif isinstance(value, str):
+        _encode_value(str(value), out)
+    elif isinstance(value, (list, tuple)):
+        _encode_value(list(value), out)
+    elif isinstance(value, dict):
+        _encode_value(dict(value), out)
+    else:
+        raise TypeError(f"Object of type {kind.__name__} cannot be encoded")
+
+
+def _decode_value(data: bytes, offset: int) -> Tuple[Any, int]:
+    kind = data[offset]
+    offset += 1
+    if kind == T_STR:
+        (length,) = _U32.unpack_from(data, offset)
+        offset += 4
+        return data[offset:offset + length].decode('utf-8'), offset + length
+    if kind == T_INT:
+        return _I64.unpack_from(data, offset)[0], offset + 8
+    if kind == T_NONE:
+        return None, offset
+    if kind == T_TRUE:
+        return True, offset
+    if kind == T_FALSE:
+        return False, offset
+    if kind == T_FLOAT:
+        return _F64.unpack_from(data, offset)[0], offset + 8
+    if kind == T_BYTES:
+        (length,) = _U32.unpack_from(data, offset)
+        offset += 4
+        return bytes(data[offset:offset + length]), offset + length
+    if kind == T_LIST:
+        (count,) = _U32.unpack_from(data, offset)
+        offset += 4
+        items = []
+        for _ in range(count):
+            item, offset = _decode_value(data, offset)
+            items.append(item)
+        return items, offset
+    if kind == T_STR_LIST:
+        (count,) = _U32.unpack_from(data, offset)
+        offset += 4
+        lengths = struct.unpack_from(f'>{count}I', data, offset)
+        offset += 4 * count
+        ends = list(itertools.accumulate(lengths))
+        blob = bytes(data[offset:offset + (ends[-1] if ends else 0)])
+        starts = [0] + ends[:-1]
+        if blob.isascii():
+            text = blob.decode('ascii')
+            items = [text[start:end] for start, end in zip(starts, ends)]
+        else:
+            items = [blob[start:end].decode('utf-8') for start, end in zip(starts, ends)]
+        return items, offset + len(blob)
+    if kind == T_DICT:
+        (count,) = _U32.unpack_from(data, offset)
+        offset += 4
+        result = {}
+        for _ in range(count):
+            (length,) = _U32.unpack_from(data, offset)
+            offset += 4
+            k = data[offset:offset + length].decode('utf-8')
+            offset += length
+            result[k], offset = _decode_value(data, offset)
+        return result, offset
+    if kind == T_BIGINT:
+        (length,) = _U32.unpack_from(data, offset)
+        offset += 4
+        return int(data[offset:offset + length].decode('ascii')), offset + length
+    raise ValueError(f"Unknown value type {kind:#x} at offset {offset - 1}")
+
+
+class BinaryCodec:
+    name = 'binary'
+
+    def encode(self, message: Dict[str, Any]) -> bytes:
+        out = bytearray()
+        for name, value in message.items():
+            tag = FIELD_TAGS.get(name)
+            if tag == 1:
+                code = OPCODES.get(value)
+                if code is not None:
+                    out += _U8.pack(TAG_OPCODE)
+                    out += _U8.pack(code)
+                    continue
+            if tag is not None:
+                out.append(tag)
+            else:
+                data = name.encode('utf-8')
+                out.append(TAG_NAMED)
+                out += _U32.pack(len(data))
+                out += data
+            _encode_value(value, out)
+        return bytes(out)
+
+    def decode(self, payload: bytes) -> Dict[str, Any]:
+        try:
+            return self._decode(payload)
+        except (struct.error, IndexError) as e:
+            raise ValueError(f"Truncated binary payload: {e}")
+
+    def _decode(self, payload: bytes) -> Dict[str, Any]:
+        message = {}
+        offset = 0
+        size = len(payload)
+        while offset < size:
+            tag = payload[offset]
+            offset += 1
+            if tag == TAG_OPCODE:
+                code = payload[offset]
+                offset += 1
+                if code not in OPERATION_NAMES:
+                    raise ValueError(f"Unknown opcode {code}")
+                message['operation'] = OPERATION_NAMES[code]
+                continue
+            if tag == TAG_NAMED:
+                (length,) = _U32.unpack_from(payload, offset)
+                offset += 4
+                name = payload[offset:offset + length].decode('utf-8')
+                offset += length
+            else:
+                name = TAG_FIELDS.get(tag)
+                if name is None:
+                    raise ValueError(f"Unknown field tag {tag:#x}")
+            message[name], offset = _decode_value(payload, offset)
+        return message
+
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+CODECS = {codec.name: codec for codec in (BINARY_CODEC, JSON_CODEC)}
+DEFAULT_CODEC = JSON_CODEC
+
+
+def choose_codec(offered: List[str]):
+    # The server takes the first codec in the client's preference order that
+    # it also supports, and falls back to JSON otherwise.
+    for name in offered:
+        if name in CODECS:
+            return CODECS[name]
+    return DEFAULT_CODEC
@@ -0,0 +1,141 @@
+import re
+import sys
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+EVICTION_POLICIES = ('noeviction', 'lru', 'lfu', 'ttl')
+# Rough per-key cost on top of the key and value objects: the store's dict
+# slot, the size and expiry bookkeeping and the eviction policy's entry.
+ENTRY_OVERHEAD = 96
+# LFU counts stop here, so keys that were hot long ago can still age out
+# once newer keys reach the cap.
+LFU_MAX_COUNT = 255
+
+_STR_SIZE = sys.getsizeof('')
+_BYTES_SIZE = sys.getsizeof(b'')
+_SCALAR_SIZES = {int: sys.getsizeof(1), float: sys.getsizeof(1.0), bool: sys.getsizeof(True),
+                 type(None): sys.getsizeof(None)}
+_SIZE_UNITS = {'': 1, 'b': 1, 'kb': 1024, 'mb': 1024 ** 2, 'gb': 1024 ** 3}
+
+
+class MemoryLimitError(Exception):
+    pass
+
+
+def parse_size(text: str) -> int:
+    # '1048576', '512kb', '64mb', '2gb'.
+    match = re.fullmatch(r'\s*(\d+)\s*([kmg]?b?)\s*', str(text).lower())
+    if match is None:
+        raise ValueError(f"Invalid size: {text!r}")
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2)]
+
+
+def estimate_size(value: Any) -> int:
+    # Approximate memory held by a value, walking into lists and dicts.
+    # Strings and bytes are costed from their length instead of asking the
+    # interpreter, which is several times slower on the write path; strings
+    # count one byte per character.
+    kind = type(value)
+    if kind is str:
+        return _STR_SIZE + len(value)
+    if kind is bytes:
+        return _BYTES_SIZE + len(value)
+    size = _SCALAR_SIZES.get(kind)
+    if size is not None:
+        return size
+    size = sys.getsizeof(value)
+    if kind is dict:
+        for key, item in value.items():
+            size += estimate_size(key) + estimate_size(item)
+    elif kind is list or kind is tuple:
+        for item in value:
+            size += estimate_size(item)
+    return size
+
+
+def entry_size(key: str, value: Any) -> int:
+    return ENTRY_OVERHEAD + _STR_SIZE + len(key) + estimate_size(value)
+
+
+class LRUPolicy:
+    # Keys from least to most recently read or written.
+    def __init__(self):
+        self._order: 'OrderedDict[str, None]' = OrderedDict()
+
+    def added(self, key: str):
+        self._order[key] = None
+        self._order.move_to_end(key)
+
+    def accessed(self, key: str):
+        if key in self._order:
+            self._order.move_to_end(key)
+
+    def removed(self, key: str):
+        self._order.pop(key, None)
+
+    def candidates(self) -> Iterator[str]:
+        return iter(self._order)
+
+    def clear(self):
+        self._order.clear()
+
+
+class LFUPolicy:
+    # Keys bucketed by access count, each bucket in LRU order, so the victim
+    # is the least recently used of the least frequently used keys. Counts
+    # saturate at LFU_MAX_COUNT, which also bounds the number of buckets.
+    def __init__(self):
+        self._counts: Dict[str, int] = {}
+        self._buckets: Dict[int, 'OrderedDict[str, None]'] = {}
+
+    def added(self, key: str):
+        if key in self._counts:
+            self.accessed(key)
+            return
+        self._counts[key] = 1
+        self._buckets.setdefault(1, OrderedDict())[key] = None
+
+    def accessed(self, key: str):
+        count = self._counts.get(key)
+        if count is None:
+            return
+        bucket = self._buckets[count]
+        if count >= LFU_MAX_COUNT:
+            bucket.move_to_end(key)
+            return
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+        self._counts[key] = count + 1
+        self._buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+    def removed(self, key: str):
+        count = self._counts.pop(key, None)
+        if count is None:
+            return
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+
+    def candidates(self) -> Iterator[str]:
+        for count in sorted(self._buckets):
+            yield from self._buckets[count]
+
+    def clear(self):
+        self._counts.clear()
+        self._buckets.clear()
+
+
+def make_policy(name: str) -> Optional[Any]:
+    # The 'ttl' policy evicts by expiry time from the store's own expiry
+    # index and only needs recency order to fall back on.
+    if name not in EVICTION_POLICIES:
+        raise ValueError(f"Unknown eviction policy {name!r}; expected one of {', '.join(EVICTION_POLICIES)}")
+    if name == 'noeviction':
+        return None
+    return LFUPolicy() if name == 'lfu' else LRUPolicy()
@@ -0,0 +1,164 @@
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class LeaseKeepalive:
+    # Keeps leases alive for a KVStoreClient or ShardedKVClient. Every
+    # tracked lease is renewed each interval with one renew_leases request per
+    # owner, however many leases the owner holds. A lease is reported lost,
+    # and no longer tracked, when the server says its owner no longer holds
+    # it, or when renewals kept failing until it must have run out.
+    def __init__(self, client, lease_duration: float = 30.0, interval: Optional[float] = None,
+                 on_lost: Optional[Callable[[str, List[str]], None]] = None):
+        self.client = client
+        self.lease_duration = lease_duration
+        self.interval = interval if interval is not None else lease_duration / 3
+        if not 0 < self.interval < lease_duration:
+            raise ValueError("interval must be positive and shorter than lease_duration")
+        self.on_lost = on_lost
+        # Tracked leases by owner and key: how long the lease is known to
+        # last, and when tracking began. A renewal's verdict only applies to
+        # leases tracked before it was sent, so a lock released and acquired
+        # again meanwhile is not reported lost.
+        self._leases: Dict[str, Dict[str, Tuple[float, float]]] = {}
+        self._lost: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {'requests': 0, 'renewed': 0, 'failures': 0, 'lost': 0}
+
+    def start(self) -> 'LeaseKeepalive':
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='lease-keepalive', daemon=True)
+            self._thread.start()
+            logger.info(f"LeaseKeepalive started (lease={self.lease_duration}s, interval={self.interval}s)")
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1.0)
+            self._thread = None
+
+    def __enter__(self) -> 'LeaseKeepalive':
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def track(self, key: str, owner: str, lease_duration: Optional[float] = None):
+        # For leases acquired without the keepalive's helpers.
+        now = time.time()
+        duration = lease_duration if lease_duration is not None else self.lease_duration
+        with self._lock:
+            self._leases.setdefault(owner, {})[key] = (now + duration, now)
+
+    def untrack(self, key: str, owner: str):
+        with self._lock:
+            owned = self._leases.get(owner)
+            if owned is not None:
+                owned.pop(key, None)
+                if not owned:
+                    del self._leases[owner]
+
+    def tracked(self, owner: Optional[str] = None) -> List[str]:
+        with self._lock:
+            if owner is not None:
+                return list(self._leases.get(owner, ()))
+            return [key for owned in self._leases.values() for key in owned]
+
+    def acquire_lock(self, key: str, owner: str, timeout: Optional[float] = None,
+                     shared: bool = False) -> Optional[int]:
+        token = self.client.acquire_lock(key, owner, self.lease_duration, timeout, shared)
+        if token:
+            self.track(key, owner)
+        return token
+
+    def acquire_locks(self, keys: List[str], owner: str) -> Any:
+        tokens = self.client.acquire_locks(keys, owner, self.lease_duration)
+        if tokens:
+            for key in keys:
+                self.track(key, owner)
+        return tokens
+
+    def release_lock(self, key: str, owner: str) -> bool:
+        self.untrack(key, owner)
+        return self.client.release_lock(key, owner)
+
+    def release_locks(self, keys: List[str], owner: str) -> int:
+        for key in keys:
+            self.untrack(key, owner)
+        return self.client.release_locks(keys, owner)
+
+    def renew(self) -> int:
+        # One renewal pass; returns how many leases were found lost.
+        with self._lock:
+            owners = {owner: list(owned) for owner, owned in self._leases.items()}
+        lost_total = 0
+        for owner, keys in owners.items():
+            sent_at = time.time()
+            try:
+                result = self.client.renew_leases(owner, keys, self.lease_duration)
+            except Exception as e:
+                logger.warning(f"KEEPALIVE renewal for owner='{owner}' failed: {e}")
+                result = None
+            lost_total += self._apply(owner, keys, result, sent_at)
+        return lost_total
+
+    def _apply(self, owner: str, keys: List[str], result: Optional[Dict[str, Any]], sent_at: float) -> int:
+        now = time.time()
+        lost_keys = set(result['lost']) if result is not None else set()
+        # A sharded client reports keys whose node could not be reached.
+        failed = set(result.get('failed') or ()) if result is not None else set(keys)
+        lost: List[str] = []
+        with self._lock:
+            self._stats['requests'] += 1
+            if failed:
+                self._stats['failures'] += 1
+            owned = self._leases.get(owner, {})
+            for key in keys:
+                entry = owned.get(key)
+                if entry is None or entry[1] > sent_at:
+                    continue
+                if key in lost_keys or (key in failed and entry[0] <= now):
+                    del owned[key]
+                    lost.append(key)
+                elif key not in failed:
+                    owned[key] = (sent_at + self.lease_duration, entry[1])
+                    self._stats['renewed'] += 1
+            if not owned:
+                self._leases.pop(owner, None)
+            self._stats['lost'] += len(lost)
+            self._lost.extend((owner, key) for key in lost)
+        if lost:
+            logger.warning(f"KEEPALIVE owner='{owner}' lost {len(lost)} leases: {lost[:10]}")
+            if self.on_lost is not None:
+                try:
+                    self.on_lost(owner, lost)
+                except Exception as e:
+                    logger.error(f"KEEPALIVE on_lost callback failed: {e}")
+        return len(lost)
+
+    def take_lost(self) -> List[Tuple[str, str]]:
+        # (owner, key) of every lease lost since the last call.
+        with self._lock:
+            lost, self._lost = self._lost, []
+            return lost
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.renew()
+            except Exception as e:
+                logger.error(f"KEEPALIVE renewal pass failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats, owners=len(self._leases),
+                        leases=sum(len(owned) for owned in self._leases.values()))
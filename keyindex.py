@@ -0,0 +1,139 @@
+import heapq
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Keys per block. Blocks split at twice this and merge into a neighbour
+# below a quarter of it, so an insert or removal shifts at most ~1000 slots.
+BLOCK_LOAD = 512
+
+Page = Tuple[List[Any], Optional[str]]
+
+
+class SortedKeyIndex:
+    # Keys in sorted order, for prefix and range scans next to a dict store.
+    # The keys are kept in sorted blocks with each block's last key in
+    # _maxes, so finding a key is two bisects and a write only moves entries
+    # within its block rather than along one list of every key.
+    def __init__(self, keys: Iterable[str] = ()):
+        ordered = sorted(set(keys))
+        self._blocks: List[List[str]] = [ordered[i:i + BLOCK_LOAD] for i in range(0, len(ordered), BLOCK_LOAD)]
+        self._maxes: List[str] = [block[-1] for block in self._blocks]
+        self._len = len(ordered)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def add(self, key: str) -> bool:
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            return True
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            block = self._blocks[i]
+            block.append(key)
+            self._maxes[i] = key
+        else:
+            block = self._blocks[i]
+            j = bisect_left(block, key)
+            if block[j] == key:
+                return False
+            block.insert(j, key)
+        self._len += 1
+        if len(block) > 2 * BLOCK_LOAD:
+            self._blocks[i:i + 1] = [block[:BLOCK_LOAD], block[BLOCK_LOAD:]]
+            self._maxes[i:i + 1] = [block[BLOCK_LOAD - 1], block[-1]]
+        return True
+
+    def discard(self, key: str) -> bool:
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return False
+        block = self._blocks[i]
+        j = bisect_left(block, key)
+        if block[j] != key:
+            return False
+        del block[j]
+        self._len -= 1
+        if not block:
+            del self._blocks[i]
+            del self._maxes[i]
+        elif len(block) < BLOCK_LOAD // 4 and len(self._blocks) > 1:
+            self._merge(i if i + 1 < len(self._blocks) else i - 1)
+        elif j == len(block):
+            self._maxes[i] = block[-1]
+        return True
+
+    def _merge(self, i: int):
+        # Joins blocks i and i + 1, splitting the result again if too large.
+        block = self._blocks[i] + self._blocks[i + 1]
+        if len(block) > 2 * BLOCK_LOAD:
+            half = len(block) // 2
+            self._blocks[i:i + 2] = [block[:half], block[half:]]
+            self._maxes[i:i + 2] = [block[half - 1], block[-1]]
+        else:
+            self._blocks[i:i + 2] = [block]
+            self._maxes[i:i + 2] = [block[-1]]
+
+    def clear(self):
+        self._blocks.clear()
+        self._maxes.clear()
+        self._len = 0
+
+    def irange(self, start: Optional[str] = None, inclusive: bool = True) -> Iterator[str]:
+        # Keys from start on (after it when not inclusive). The index must not
+        # change while the iterator is in use.
+        if start is None:
+            i = j = 0
+        elif inclusive:
+            i = bisect_left(self._maxes, start)
+            j = bisect_left(self._blocks[i], start) if i < len(self._blocks) else 0
+        else:
+            i = bisect_right(self._maxes, start)
+            j = bisect_right(self._blocks[i], start) if i < len(self._blocks) else 0
+        while i < len(self._blocks):
+            block = self._blocks[i]
+            while j < len(block):
+                yield block[j]
+                j += 1
+            i += 1
+            j = 0
+
+
+def scan_bounds(prefix: Optional[str], start: Optional[str], cursor: Optional[str]) -> Tuple[Optional[str], bool]:
+    # Where a page starts, and whether that key itself is included: at the
+    # later of start and prefix, or just after the cursor once past them.
+    lower = max((bound for bound in (prefix, start) if bound is not None), default=None)
+    if cursor is not None and (lower is None or cursor >= lower):
+        return cursor, False
+    return lower, True
+
+
+def in_range(key: str, prefix: Optional[str], end: Optional[str]) -> bool:
+    return (end is None or key < end) and (not prefix or key.startswith(prefix))
+
+
+def scan_request(operation: str, **fields) -> Dict[str, Any]:
+    # A scan or list_locks request carrying only the bounds that are set.
+    request = {'operation': operation}
+    request.update((name, value) for name, value in fields.items() if value is not None)
+    return request
+
+
+def merge_pages(pages: Sequence[Page], limit: int, key: Optional[Callable[[Any], str]] = None) -> Page:
+    # Combines pages of one scan taken from several partitions after the same
+    # cursor into one page in key order. A partition that returned a cursor
+    # has unseen keys beyond it, so the page stops at the smallest such cursor
+    # and the next page resumes from there in every partition.
+    bound = min((cursor for _, cursor in pages if cursor is not None), default=None)
+    page: List[Any] = []
+    for entry in heapq.merge(*(entries for entries, _ in pages), key=key):
+        entry_key = key(entry) if key is not None else entry
+        if bound is not None and entry_key > bound:
+            break
+        if len(page) >= limit:
+            return page, key(page[-1]) if key is not None else page[-1]
+        page.append(entry)
+    return page, bound
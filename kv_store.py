@@ -1,9 +1,15 @@
+import heapq
+import itertools
 import logging
 import threading
 import time
-from typing import Any, Optional, Dict
+import zlib
+from typing import Any, Callable, Deque, Optional, Dict, Iterable, Iterator, List, Tuple
+from collections import deque
+from contextlib import ExitStack
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from eviction import MemoryLimitError, entry_size, make_policy
+from keyindex import SortedKeyIndex, in_range, merge_pages, scan_bounds
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -16,87 +22,927 @@ class Lease:
     acquired_at: float
     expires_at: float
     lease_duration: float
+    shared: bool = False
+    # Fencing token: grows with every grant in the partition, so a write
+    # carrying it can be checked against the lease currently on the key.
+    token: int = 0
+
+
+class FencingError(Exception):
+    pass
+
+
+class LockWaiter:
+    # A parked acquire_lock call. It is resolved exactly once, under the store
+    # lock: granted when the lock is handed to it, or refused at its deadline.
+    def __init__(self, key: str, owner: str, lease_duration: float, deadline: float,
+                 callback: Optional[Callable[['LockWaiter'], None]] = None, shared: bool = False):
+        self.key = key
+        self.owner = owner
+        self.lease_duration = lease_duration
+        self.deadline = deadline
+        self.callback = callback
+        self.shared = shared
+        self.enqueued_at = time.time()
+        self.event = threading.Event()
+        self.done = False
+        self.granted = False
+        self.lsn: Optional[int] = None
+        self.token: Optional[int] = None
+
+    def _resolve(self, granted: bool, lsn: Optional[int] = None, token: Optional[int] = None):
+        self.done = True
+        self.granted = granted
+        self.lsn = lsn
+        self.token = token
+        self.event.set()
+        if self.callback is not None:
+            try:
+                self.callback(self)
+            except Exception as e:
+                logger.error(f"Lock waiter callback for key='{self.key}' failed: {e}")
 
 
 class DistributedKVStore:
-    def __init__(self):
+    def __init__(self, wal=None, metrics=None, writer_preference: bool = False, watch=None,
+                 replication=None, max_memory: Optional[int] = None, eviction_policy: str = 'lru'):
+        self._wal = wal
+        self._metrics = metrics
+        # Mutation records for replicas, appended alongside the log.
+        self._replication = replication
+        # Change feed for watchers. Publishing happens under self._lock so each
+        # key's events are queued in apply order.
+        self._watch = watch
         self._store: Dict[str, Any] = {}
+        # The store's keys and the keys with a lease, in sorted order, for
+        # prefix and range scans.
+        self._index = SortedKeyIndex()
+        self._lock_index = SortedKeyIndex()
+        # Estimated bytes per key and their total. With max_memory set, writes
+        # that would go over it first evict keys chosen by the policy.
+        self._sizes: Dict[str, int] = {}
+        self._used_memory = 0
+        self._max_memory = max_memory
+        self.eviction_policy = eviction_policy
+        self._policy = make_policy(eviction_policy) if max_memory is not None else None
+        # Absolute expiry times of keys with a TTL, and a min-heap of
+        # (expires_at, key) over them with stale entries skipped like the
+        # lease heap. Expired keys read as missing and are dropped on access
+        # or by the reaper; expiry is not logged, since every copy of the log
+        # reaches the same verdict from the recorded expiry time.
+        self._expires: Dict[str, float] = {}
+        self._key_heap: List[Tuple[float, str]] = []
+        self.expired_keys = 0
+        self.evicted_keys = 0
+        # Every write gives its keys a new version and every lock grant a new
+        # fencing token, both from this one counter. Log records carry the
+        # numbers, so replay and replicas reproduce them.
+        self._versions: Dict[str, int] = {}
+        self._last_version = 0
+        # Exclusive leases by key, and shared leases by key and owner. A key is
+        # held either exclusively by one owner or shared by any number of them.
         self._locks: Dict[str, Lease] = {}
+        self._shared: Dict[str, Dict[str, Lease]] = {}
+        self._shared_count = 0
+        # Every lease by owner and key, so an owner's leases can be renewed
+        # together without scanning all of them.
+        self._owned: Dict[str, Dict[str, Lease]] = {}
+        # With writer preference a queued exclusive waiter stops new shared
+        # leases from being granted, so a steady stream of readers cannot
+        # starve writers.
+        self._writer_preference = writer_preference
+        # Min-heap of (expires_at, seq, lease). Renewed or released leases leave
+        # stale entries behind that are skipped when popped.
+        self._expiry_heap: List[Tuple[float, int, Lease]] = []
+        self._expiry_seq = itertools.count()
+        # Per-key FIFO of parked acquirers. A key only has waiters while it is
+        # held: releasing or expiring a lease grants it to the head waiter, or
+        # to the run of shared waiters at the head of the queue.
+        self._waiters: Dict[str, Deque[LockWaiter]] = {}
         self._lock = threading.RLock()
         logger.info("DistributedKVStore initialized")
 
+    def _next_version(self) -> int:
+        self._last_version += 1
+        return self._last_version
+
+    def _seen_version(self, version: int):
+        if version > self._last_version:
+            self._last_version = version
+
     def get(self, key: str) -> Optional[Any]:
         with self._lock:
+            if key in self._expires and self._expire_if_due(key, time.time()):
+                return None
             value = self._store.get(key)
-            logger.info(f"GET key='{key}' value={value}")
+            if self._policy is not None and value is not None:
+                self._policy.accessed(key)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"GET key='{key}' value={value}")
             return value
 
-    def set(self, key: str, value: Any) -> bool:
-        with self._lock:
-            self._store[key] = value
-            logger.info(f"SET key='{key}' value={value}")
+    def _put(self, key: str, value: Any, size: int, expires_at: Optional[float], version: int):
+        # Caller must hold self._lock. Stores a value with its size and
+        # version, and sets or clears its expiry.
+        if key not in self._store:
+            self._index.add(key)
+        self._store[key] = value
+        self._versions[key] = version
+        self._used_memory += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        if expires_at is not None or key in self._expires:
+            self._set_expiry(key, expires_at)
+        if self._policy is not None:
+            self._policy.added(key)
+
+    def _set_expiry(self, key: str, expires_at: Optional[float]):
+        if expires_at is None:
+            self._expires.pop(key, None)
+            return
+        self._expires[key] = expires_at
+        heapq.heappush(self._key_heap, (expires_at, key))
+        if len(self._key_heap) > 2 * len(self._expires) + 1024:
+            self._key_heap = [(at, k) for k, at in self._expires.items()]
+            heapq.heapify(self._key_heap)
+
+    def _remove(self, key: str):
+        # Caller must hold self._lock and know the key exists.
+        del self._store[key]
+        self._index.discard(key)
+        del self._versions[key]
+        self._used_memory -= self._sizes.pop(key, 0)
+        self._expires.pop(key, None)
+        if self._policy is not None:
+            self._policy.removed(key)
+
+    def _expire_if_due(self, key: str, now: float) -> bool:
+        # Caller must hold self._lock. Drops the key if its TTL has run out.
+        expires_at = self._expires.get(key)
+        if expires_at is None or now < expires_at:
+            return False
+        self._remove(key)
+        self.expired_keys += 1
+        if self._watch is not None:
+            self._watch.publish('expired', key)
+        if self._metrics is not None:
+            self._metrics.incr('keys_expired')
+        return True
+
+    def _expiry_at(self, ttl: Optional[float], now: float) -> Optional[float]:
+        if ttl is None:
+            return None
+        ttl = float(ttl)
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+        return now + ttl
+
+    def _leased(self, key: str, now: float) -> bool:
+        lease = self._locks.get(key)
+        if lease is not None and lease.expires_at > now:
             return True
+        holders = self._shared.get(key)
+        return bool(holders) and any(lease.expires_at > now for lease in holders.values())
+
+    def _keys_by_expiry(self) -> Iterator[str]:
+        # Walks the expiry heap in order without popping it: a second heap
+        # holds the frontier of heap positions still to visit.
+        heap = self._key_heap
+        frontier = [(heap[0], 0)] if heap else []
+        while frontier:
+            (expires_at, key), index = heapq.heappop(frontier)
+            if self._expires.get(key) == expires_at:
+                yield key
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+
+    def _make_room(self, needed: int, writing: Iterable[str], now: float) -> List[str]:
+        # Caller must hold self._lock. Evicts keys until a write adding
+        # `needed` bytes fits under max_memory. Keys under a live lease and the
+        # keys being written are never chosen; when that leaves too little,
+        # nothing is evicted and the write is refused. Returns the evicted keys.
+        if self._max_memory is None or self._used_memory + needed <= self._max_memory:
+            return []
+        if self._policy is None:
+            self._refuse_write(needed)
+        target = self._used_memory + needed - self._max_memory
+        candidates = self._policy.candidates()
+        if self.eviction_policy == 'ttl':
+            # Soonest-expiring keys first, then least recently used ones.
+            candidates = itertools.chain(self._keys_by_expiry(), candidates)
+        protected = set(writing)
+        victims: List[str] = []
+        freed = 0
+        for key in candidates:
+            if key in protected or self._leased(key, now):
+                continue
+            protected.add(key)
+            victims.append(key)
+            freed += self._sizes[key]
+            if freed >= target:
+                break
+        else:
+            self._refuse_write(needed)
+        for key in victims:
+            self._remove(key)
+            if self._watch is not None:
+                self._watch.publish('evicted', key)
+        self.evicted_keys += len(victims)
+        if self._metrics is not None:
+            self._metrics.incr('keys_evicted', amount=len(victims))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"EVICTED keys={len(victims)} freed={freed} policy={self.eviction_policy}")
+        return victims
+
+    def _refuse_write(self, needed: int):
+        if self._metrics is not None:
+            self._metrics.incr('writes_refused_memory')
+        raise MemoryLimitError(f"Memory limit of {self._max_memory} bytes reached "
+                               f"({self._used_memory} used, {needed} more needed, policy "
+                               f"{self.eviction_policy})")
+
+    def _check_fence(self, key: str, token: int, now: float):
+        # Caller must hold self._lock. A fenced write is only accepted while
+        # the key's exclusive lease is live and carries the given token.
+        lease = self._locks.get(key)
+        if lease is not None and now >= lease.expires_at:
+            lease = None
+        if lease is None or lease.token != token:
+            if self._metrics is not None:
+                self._metrics.incr('writes_fenced')
+            current = lease.token if lease is not None else None
+            raise FencingError(f"Fencing token {token} rejected for key '{key}' (current token: {current})")
+
+    def attach_replication(self, replication):
+        # Starts feeding mutations to a replication log created after the
+        # store, e.g. when the first replica connects.
+        with self._lock:
+            self._replication = replication
+
+    def _log(self, record: Dict[str, Any]) -> Optional[int]:
+        # Caller must hold self._lock so log order matches apply order.
+        if self._replication is not None:
+            self._replication.append(record)
+        if self._wal is None:
+            return None
+        return self._wal.append(record)
+
+    def _record_release(self, lease: Lease, now: float, expired: bool = False):
+        # Hold time runs from acquisition to release, or to expiry for leases
+        # that were never released.
+        if self._watch is not None:
+            self._watch.publish('lock_expired' if expired else 'lock_released', lease.key,
+                                owner=lease.owner, shared=lease.shared)
+        if self._metrics is not None:
+            self._metrics.observe('lease_hold_seconds', max(now - lease.acquired_at, 0.0))
+            self._metrics.incr('leases_expired' if expired else 'leases_released')
+
+    def _sync(self, lsn: Optional[int]):
+        # Called after self._lock is released so concurrent writers can share
+        # one fsync (group commit).
+        if lsn is not None:
+            self._wal.wait(lsn)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, token: Optional[int] = None) -> int:
+        # A ttl in seconds makes the key expire; a set without one clears any
+        # earlier expiry. With a fencing token the write is refused unless
+        # the caller still holds the key's exclusive lease. Returns the new
+        # version.
+        with self._lock:
+            now = time.time()
+            if token is not None:
+                self._check_fence(key, token, now)
+            version, lsn = self._write(key, value, ttl, now)
+        self._sync(lsn)
+        return version
+
+    def _write(self, key: str, value: Any, ttl: Optional[float], now: float) -> Tuple[int, Optional[int]]:
+        # Caller must hold self._lock.
+        expires_at = self._expiry_at(ttl, now) if ttl is not None else None
+        size = entry_size(key, value)
+        if self._max_memory is not None:
+            evicted = self._make_room(size - self._sizes.get(key, 0), (key,), now)
+            if evicted:
+                self._log({'op': 'mdelete', 'keys': evicted})
+        version = self._next_version()
+        self._put(key, value, size, expires_at, version)
+        record = {'op': 'set', 'key': key, 'value': value, 'version': version}
+        if expires_at is not None:
+            record['expires_at'] = expires_at
+        lsn = self._log(record)
+        if self._watch is not None:
+            self._watch.publish('set', key, value)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"SET key='{key}' value={value} version={version}")
+        return version, lsn
+
+    def get_with_version(self, key: str) -> Tuple[Optional[Any], int]:
+        # Version 0 means the key does not exist.
+        with self._lock:
+            if key in self._expires and self._expire_if_due(key, time.time()):
+                return None, 0
+            if key not in self._store:
+                return None, 0
+            if self._policy is not None:
+                self._policy.accessed(key)
+            return self._store[key], self._versions[key]
+
+    def cas(self, key: str, expected_version: int, value: Any, ttl: Optional[float] = None,
+            token: Optional[int] = None) -> Tuple[bool, int]:
+        # Writes only if the key is still at expected_version (0: only if it
+        # does not exist). Returns whether it wrote and the key's version
+        # afterwards, which on a conflict is the version that won.
+        with self._lock:
+            now = time.time()
+            if token is not None:
+                self._check_fence(key, token, now)
+            if key in self._expires:
+                self._expire_if_due(key, now)
+            current = self._versions.get(key, 0)
+            if current != expected_version:
+                if self._metrics is not None:
+                    self._metrics.incr('cas_conflicts')
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"CAS key='{key}' expected={expected_version} current={current} conflict")
+                return False, current
+            version, lsn = self._write(key, value, ttl, now)
+        self._sync(lsn)
+        return True, version
+
+    def delete(self, key: str, token: Optional[int] = None) -> bool:
+        with self._lock:
+            now = time.time()
+            if token is not None:
+                self._check_fence(key, token, now)
+            if key not in self._store or self._expire_if_due(key, now):
+                logger.warning(f"DELETE key='{key}' failed - key not found")
+                return False
+            self._remove(key)
+            lsn = self._log({'op': 'delete', 'key': key})
+            if self._watch is not None:
+                self._watch.publish('delete', key)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"DELETE key='{key}' success")
+        self._sync(lsn)
+        return True
+
+    def mget(self, keys: List[str]) -> Dict[str, Any]:
+        with self._lock:
+            if self._expires:
+                now = time.time()
+                for key in keys:
+                    if key in self._expires:
+                        self._expire_if_due(key, now)
+            values = {key: self._store.get(key) for key in keys}
+            if self._policy is not None:
+                for key in keys:
+                    self._policy.accessed(key)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"MGET keys={len(keys)}")
+            return values
+
+    def mset(self, items: Dict[str, Any], ttl: Optional[float] = None) -> bool:
+        # All keys written by one call share a version.
+        with self._lock:
+            expires_at = self._expiry_at(ttl, time.time()) if ttl is not None else None
+            sizes = {key: entry_size(key, value) for key, value in items.items()}
+            if self._max_memory is not None:
+                needed = sum(size - self._sizes.get(key, 0) for key, size in sizes.items())
+                evicted = self._make_room(needed, items, time.time())
+                if evicted:
+                    self._log({'op': 'mdelete', 'keys': evicted})
+            version = self._next_version()
+            for key, value in items.items():
+                self._put(key, value, sizes[key], expires_at, version)
+            record = {'op': 'mset', 'items': items, 'version': version}
+            if expires_at is not None:
+                record['expires_at'] = expires_at
+            lsn = self._log(record)
+            if self._watch is not None:
+                for key, value in items.items():
+                    self._watch.publish('set', key, value)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"MSET keys={len(items)}")
+        self._sync(lsn)
+        return True
+
+    def mdelete(self, keys: List[str]) -> int:
+        with self._lock:
+            deleted = []
+            now = time.time()
+            for key in keys:
+                if key in self._store and not self._expire_if_due(key, now):
+                    self._remove(key)
+                    deleted.append(key)
+            lsn = self._log({'op': 'mdelete', 'keys': deleted}) if deleted else None
+            if self._watch is not None:
+                for key in deleted:
+                    self._watch.publish('delete', key)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"MDELETE keys={len(keys)} deleted={len(deleted)}")
+        self._sync(lsn)
+        return len(deleted)
+
+    def expire(self, key: str, ttl: Optional[float]) -> bool:
+        # Sets a key's TTL, or with ttl=None makes it persistent again.
+        with self._lock:
+            now = time.time()
+            if key not in self._store or self._expire_if_due(key, now):
+                return False
+            expires_at = self._expiry_at(ttl, now)
+            self._set_expiry(key, expires_at)
+            lsn = self._log({'op': 'expire', 'key': key, 'expires_at': expires_at})
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"EXPIRE key='{key}' ttl={ttl}")
+        self._sync(lsn)
+        return True
 
-    def delete(self, key: str) -> bool:
+    def ttl(self, key: str) -> Optional[float]:
+        # Seconds until the key expires; None if it is missing or has no TTL.
         with self._lock:
-            if key in self._store:
-                del self._store[key]
-                logger.info(f"DELETE key='{key}' success")
-                return True
-            logger.warning(f"DELETE key='{key}' failed - key not found")
+            expires_at = self._expires.get(key)
+            if expires_at is None:
+                return None
+            now = time.time()
+            if self._expire_if_due(key, now):
+                return None
+            return expires_at - now
+
+    def scan(self, prefix: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+             limit: int = 100, cursor: Optional[str] = None, values: bool = False) -> Tuple[List[Any], Optional[str]]:
+        # One page of live keys in order: those starting with prefix, from
+        # start up to but not including end, after the previous page's cursor.
+        # At most limit keys are examined under the lock, expired ones
+        # included, so a page can come back short. The returned cursor is None
+        # once the range is exhausted. With values, entries are [key, value].
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        lower, inclusive = scan_bounds(prefix, start, cursor)
+        entries: List[Any] = []
+        with self._lock:
+            now = time.time()
+            examined = 0
+            last_examined: Optional[str] = None
+            for key in self._index.irange(lower, inclusive):
+                if not in_range(key, prefix, end):
+                    break
+                if examined == limit:
+                    return entries, last_examined
+                examined += 1
+                last_examined = key
+                expires_at = self._expires.get(key)
+                if expires_at is not None and now >= expires_at:
+                    continue
+                entries.append([key, self._store[key]] if values else key)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"SCAN prefix={prefix!r} start={start!r} end={end!r} returned={len(entries)}")
+        return entries, None
+
+    def memory_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'used_bytes': self._used_memory,
+                'max_bytes': self._max_memory,
+                'policy': self.eviction_policy if self._max_memory is not None else None,
+                'keys': len(self._store),
+                'keys_with_ttl': len(self._expires),
+                'expired': self.expired_keys,
+                'evicted': self.evicted_keys,
+            }
+
+    def reap_expired_keys(self, max_items: int = 1000) -> int:
+        # Drops at most max_items expired keys per call, like
+        # reap_expired_locks, so the lock is held for bounded work.
+        with self._lock:
+            now = time.time()
+            heap = self._key_heap
+            expired = 0
+            popped = 0
+            while heap and heap[0][0] <= now and popped < max_items:
+                expires_at, key = heapq.heappop(heap)
+                popped += 1
+                if self._expires.get(key) == expires_at and self._expire_if_due(key, now):
+                    expired += 1
+            return expired
+
+    def next_key_expiry(self) -> Optional[float]:
+        with self._lock:
+            heap = self._key_heap
+            while heap and self._expires.get(heap[0][1]) != heap[0][0]:
+                heapq.heappop(heap)
+            return heap[0][0] if heap else None
+
+    def _lock_available(self, key: str, owner: str, now: float) -> bool:
+        # Caller must hold self._lock. Drops leases that have expired.
+        if key not in self._locks and key not in self._shared:
+            return True
+        # A parked waiter may be handed the lock as stale leases are dropped.
+        self._expire_stale(key, now)
+        lease = self._locks.get(key)
+        if lease is not None:
+            return lease.owner == owner
+        return key not in self._shared
+
+    def _expire_stale(self, key: str, now: float):
+        # Caller must hold self._lock. Drops the key's expired leases.
+        lease = self._locks.get(key)
+        if lease is not None and now >= lease.expires_at:
+            self._expire_lease(lease, now)
+        holders = self._shared.get(key)
+        if holders:
+            for lease in [lease for lease in holders.values() if now >= lease.expires_at]:
+                self._expire_lease(lease, now)
+
+    def _holders(self, key: str) -> List[str]:
+        lease = self._locks.get(key)
+        if lease is not None:
+            return [lease.owner]
+        return list(self._shared.get(key, ()))
+
+    def _held_lease(self, key: str, owner: str) -> Optional[Lease]:
+        # The lease owner holds on key, exclusive or shared.
+        lease = self._locks.get(key)
+        if lease is not None:
+            return lease if lease.owner == owner else None
+        holders = self._shared.get(key)
+        return holders.get(owner) if holders else None
+
+    def _grant_lock(self, key: str, owner: str, lease_duration: float, now: float,
+                    shared: bool = False, token: Optional[int] = None) -> bool:
+        if self._held_lease(key, owner) is not None:
             return False
+        lease = Lease(
+            owner=owner,
+            key=key,
+            acquired_at=now,
+            expires_at=now + lease_duration,
+            lease_duration=lease_duration,
+            shared=shared,
+            token=token if token is not None else self._next_version()
+        )
+        self._install_lease(lease)
+        if self._watch is not None:
+            self._watch.publish('lock_acquired', key, owner=owner, shared=shared)
+        return True
+
+    def _install_lease(self, lease: Lease):
+        # Replay may install a lease over leases whose expiry was never
+        # logged. Those of the other kind are dropped, so a key is never held
+        # exclusively and shared at once.
+        if lease.shared:
+            previous = self._locks.get(lease.key)
+            if previous is not None:
+                self._drop_lease(previous)
+        else:
+            for holder in list(self._shared.get(lease.key, {}).values()):
+                self._drop_lease(holder)
+        if lease.key not in self._locks and lease.key not in self._shared:
+            self._lock_index.add(lease.key)
+        if lease.shared:
+            holders = self._shared.setdefault(lease.key, {})
+            if lease.owner not in holders:
+                self._shared_count += 1
+            holders[lease.owner] = lease
+        else:
+            # Replay may replace a lease whose expiry was never logged.
+            previous = self._locks.get(lease.key)
+            if previous is not None:
+                self._unindex_owner(previous)
+            self._locks[lease.key] = lease
+        self._owned.setdefault(lease.owner, {})[lease.key] = lease
+        self._index_expiry(lease)
+
+    def _drop_lease(self, lease: Lease):
+        if lease.shared:
+            holders = self._shared[lease.key]
+            del holders[lease.owner]
+            self._shared_count -= 1
+            if not holders:
+                del self._shared[lease.key]
+        else:
+            del self._locks[lease.key]
+        if lease.key not in self._locks and lease.key not in self._shared:
+            self._lock_index.discard(lease.key)
+        self._unindex_owner(lease)
+
+    def _unindex_owner(self, lease: Lease):
+        owned = self._owned.get(lease.owner)
+        if owned is not None and owned.get(lease.key) is lease:
+            del owned[lease.key]
+            if not owned:
+                del self._owned[lease.owner]
 
-    def acquire_lock(self, key: str, owner: str, lease_duration: float = 30.0) -> bool:
+    def _lease_record(self, lease: Lease) -> Dict[str, Any]:
+        record = {
+            'op': 'lock',
+            'key': lease.key,
+            'owner': lease.owner,
+            'acquired_at': lease.acquired_at,
+            'expires_at': lease.expires_at,
+            'lease_duration': lease.lease_duration,
+            'token': lease.token
+        }
+        if lease.shared:
+            record['shared'] = True
+        return record
+
+    @staticmethod
+    def _unlock_record(lease: Lease) -> Dict[str, Any]:
+        if lease.shared:
+            return {'op': 'unlock', 'key': lease.key, 'owner': lease.owner, 'shared': True}
+        return {'op': 'unlock', 'key': lease.key}
+
+    def _index_expiry(self, lease: Lease):
+        heapq.heappush(self._expiry_heap, (lease.expires_at, next(self._expiry_seq), lease))
+        if len(self._expiry_heap) > 2 * (len(self._locks) + self._shared_count) + 1024:
+            self._expiry_heap = [(l.expires_at, next(self._expiry_seq), l) for l in self._leases()]
+            heapq.heapify(self._expiry_heap)
+
+    def _leases(self) -> Iterable[Lease]:
+        yield from self._locks.values()
+        for holders in self._shared.values():
+            yield from holders.values()
+
+    def _is_indexed(self, expires_at: float, lease: Lease) -> bool:
+        if lease.shared:
+            holders = self._shared.get(lease.key)
+            current = holders.get(lease.owner) if holders else None
+        else:
+            current = self._locks.get(lease.key)
+        return current is lease and lease.expires_at == expires_at
+
+    def _writers_waiting(self, key: str) -> bool:
+        queue = self._waiters.get(key)
+        return bool(queue) and any(not waiter.shared and not waiter.done for waiter in queue)
+
+    def _try_acquire(self, key: str, owner: str, lease_duration: float, now: float,
+                     shared: bool = False) -> Tuple[Optional[int], Optional[int]]:
+        # Caller must hold self._lock. Returns the fencing token of the lease
+        # owner holds afterwards (None if the lock was not acquired) and the
+        # LSN of the grant, if one was logged.
+        self._expire_stale(key, now)
+        held = self._held_lease(key, owner)
+        if held is not None and held.shared == shared:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LOCK key='{key}' owner='{owner}' already held by same owner")
+            return held.token, None
+        
+        # Exclusive needs the key free; shared only needs no exclusive holder
+        # and, with writer preference, no writer queued ahead of it.
+        if key in self._locks or (not shared and key in self._shared) or \
+                (shared and self._writer_preference and self._writers_waiting(key)):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LOCK key='{key}' owner='{owner}' shared={shared} failed - "
+                             f"held by {self._holders(key)}")
+            return None, None
+        
+        self._grant_lock(key, owner, lease_duration, now, shared)
+        lease = self._held_lease(key, owner)
+        lsn = self._log(self._lease_record(lease))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"LOCK ACQUIRED key='{key}' owner='{owner}' shared={shared} duration={lease_duration}s "
+                         f"token={lease.token}")
+        return lease.token, lsn
+
+    def acquire_lock(self, key: str, owner: str, lease_duration: float = 30.0,
+                     timeout: Optional[float] = None, shared: bool = False) -> Optional[int]:
+        # With a timeout the caller parks in the key's FIFO queue until the
+        # lock is handed to it or the timeout runs out. A shared lease can be
+        # held by many owners at once; an owner cannot hold both kinds.
+        # Returns the lease's fencing token, or None if it was not acquired.
+        if timeout:
+            waiter = self.wait_for_lock(key, owner, lease_duration, timeout, shared=shared)
+            while True:
+                wake_at = self.poll_waiter(waiter)
+                if wake_at is None:
+                    break
+                waiter.event.wait(max(wake_at - time.time(), 0.0))
+            self._sync(waiter.lsn)
+            return waiter.token
+        
+        with self._lock:
+            token, lsn = self._try_acquire(key, owner, lease_duration, time.time(), shared)
+        self._sync(lsn)
+        return token
+
+    def wait_for_lock(self, key: str, owner: str, lease_duration: float, timeout: float,
+                      callback: Optional[Callable[[LockWaiter], None]] = None,
+                      shared: bool = False) -> LockWaiter:
+        # Non-blocking form of a timed acquire_lock for event-loop callers. The
+        # returned waiter may already be resolved; otherwise callback runs on
+        # whichever thread grants or times it out, with the store lock held.
+        # Callers must call poll_waiter at the returned wake-up times, which
+        # applies the deadline and expires the current lease when it is due.
+        # A granted waiter's lsn must be durable before the grant is reported.
+        with self._lock:
+            now = time.time()
+            token, lsn = self._try_acquire(key, owner, lease_duration, now, shared)
+            waiter = LockWaiter(key, owner, lease_duration, now + max(timeout, 0.0), callback, shared)
+            if token is not None:
+                waiter._resolve(True, lsn, token)
+            elif timeout <= 0:
+                waiter._resolve(False)
+            else:
+                self._waiters.setdefault(key, deque()).append(waiter)
+                if self._metrics is not None:
+                    self._metrics.incr('lock_waits')
+            return waiter
+
+    def poll_waiter(self, waiter: LockWaiter) -> Optional[float]:
+        # Returns None once the waiter is resolved, otherwise the time at which
+        # it should be polled again: its deadline or the holder's expiry.
         with self._lock:
+            if waiter.done:
+                return None
             now = time.time()
+            self._expire_stale(waiter.key, now)
+            self._hand_off(waiter.key, now)
+            if waiter.done:
+                return None
             
-            if key in self._locks:
-                lease = self._locks[key]
-                if now < lease.expires_at:
-                    if lease.owner == owner:
-                        logger.info(f"LOCK key='{key}' owner='{owner}' already held by same owner")
-                        return True
-                    logger.warning(f"LOCK key='{key}' owner='{owner}' failed - held by '{lease.owner}'")
-                    return False
-                else:
-                    logger.info(f"LOCK key='{key}' lease expired, removing stale lock from '{lease.owner}'")
-                    del self._locks[key]
+            if now >= waiter.deadline:
+                self._cancel_waiter(waiter)
+                if self._metrics is not None:
+                    self._metrics.incr('lock_wait_timeouts')
+                return None
             
-            expires_at = now + lease_duration
-            self._locks[key] = Lease(
-                owner=owner,
-                key=key,
-                acquired_at=now,
-                expires_at=expires_at,
-                lease_duration=lease_duration
-            )
-            logger.info(f"LOCK ACQUIRED key='{key}' owner='{owner}' duration={lease_duration}s")
+            expiries = [lease.expires_at for lease in self._leases_on(waiter.key)]
+            return min([waiter.deadline] + expiries)
+
+    def _leases_on(self, key: str) -> List[Lease]:
+        lease = self._locks.get(key)
+        if lease is not None:
+            return [lease]
+        return list(self._shared.get(key, {}).values())
+
+    def cancel_waiter(self, waiter: LockWaiter) -> bool:
+        # Withdraws a parked waiter, e.g. when its client disconnects. Returns
+        # False if it was already resolved.
+        with self._lock:
+            if waiter.done:
+                return False
+            self._cancel_waiter(waiter)
             return True
 
+    def _cancel_waiter(self, waiter: LockWaiter):
+        queue = self._waiters.get(waiter.key)
+        if queue is not None:
+            queue.remove(waiter)
+            if not queue:
+                del self._waiters[waiter.key]
+        waiter._resolve(False)
+        # A writer leaving the head of the queue may unblock readers behind it.
+        if waiter.key in self._waiters:
+            self._hand_off(waiter.key, time.time())
+
+    def _hand_off(self, key: str, now: float):
+        # Caller must hold self._lock. Grants the lock to the longest-waiting
+        # live waiter if the current holders allow it; a shared grant carries
+        # on to the shared waiters directly behind it.
+        queue = self._waiters.get(key)
+        while queue:
+            waiter = queue[0]
+            if waiter.done:
+                queue.popleft()
+                continue
+            if key in self._locks or (not waiter.shared and key in self._shared):
+                break
+            queue.popleft()
+            self._grant_lock(key, waiter.owner, waiter.lease_duration, now, waiter.shared)
+            lease = self._held_lease(key, waiter.owner)
+            lsn = self._log(self._lease_record(lease))
+            if self._metrics is not None:
+                self._metrics.observe('lock_wait_seconds', max(now - waiter.enqueued_at, 0.0))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LOCK HANDED OFF key='{key}' owner='{waiter.owner}' shared={waiter.shared} "
+                             f"waited={now - waiter.enqueued_at:.3f}s")
+            waiter._resolve(True, lsn, lease.token)
+            if not waiter.shared:
+                break
+        if queue is not None and not queue:
+            del self._waiters[key]
+
+    def _expire_lease(self, lease: Lease, now: float):
+        # Caller must hold self._lock. Drops an expired lease and passes the
+        # lock on to the next waiter.
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"LOCK key='{lease.key}' lease expired, removing stale lock from '{lease.owner}'")
+        self._drop_lease(lease)
+        self._record_release(lease, lease.expires_at, expired=True)
+        if lease.key in self._waiters:
+            self._hand_off(lease.key, now)
+
+    def acquire_locks(self, keys: List[str], owner: str, lease_duration: float = 30.0) -> Optional[int]:
+        # All-or-nothing: either every key is granted to owner or none is.
+        # Every key gets a fresh lease with one shared fencing token, which is
+        # returned; leases the owner already held are replaced, so the token
+        # is valid for every key. None if nothing was acquired.
+        acquired = self.acquire_locks_with_new(keys, owner, lease_duration)
+        return acquired[0] if acquired is not None else None
+
+    def acquire_locks_with_new(self, keys: List[str], owner: str,
+                               lease_duration: float = 30.0) -> Optional[Tuple[int, List[str]]]:
+        # As acquire_locks, also returning the keys owner did not hold before,
+        # which are the ones to release if the batch is abandoned.
+        with self._lock:
+            now = time.time()
+            
+            for key in keys:
+                if not self._lock_available(key, owner, now):
+                    logger.warning(f"LOCKS keys={len(keys)} owner='{owner}' failed - "
+                                   f"'{key}' held by {self._holders(key)}")
+                    return None
+            
+            new = [key for key in dict.fromkeys(keys) if self._held_lease(key, owner) is None]
+            token = self._next_version()
+            granted = [key for key in keys if self._restamp_lock(key, owner, lease_duration, now, token)]
+            lsn = self._log(self._leases_record(granted, owner, lease_duration, now, token)) if granted else None
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LOCKS ACQUIRED keys={len(keys)} owner='{owner}' duration={lease_duration}s "
+                             f"token={token}")
+        self._sync(lsn)
+        return token, new
+
+    def _restamp_lock(self, key: str, owner: str, lease_duration: float, now: float, token: int) -> bool:
+        # Caller must hold self._lock and have checked the key is available.
+        # A lease owner already holds is replaced rather than kept, and the
+        # 'locks' record replaces it the same way on replay. The old lease is
+        # reported released, so watchers see it end before the new one starts.
+        held = self._locks.get(key)
+        if held is not None and held.owner == owner:
+            self._drop_lease(held)
+            self._record_release(held, now)
+        return self._grant_lock(key, owner, lease_duration, now, token=token)
+
+    @staticmethod
+    def _leases_record(keys: List[str], owner: str, lease_duration: float, now: float,
+                       token: int) -> Dict[str, Any]:
+        return {
+            'op': 'locks',
+            'keys': keys,
+            'owner': owner,
+            'acquired_at': now,
+            'expires_at': now + lease_duration,
+            'lease_duration': lease_duration,
+            'token': token
+        }
+
     def release_lock(self, key: str, owner: str) -> bool:
+        # Releases whichever lease owner holds on key, exclusive or shared.
         with self._lock:
-            if key not in self._locks:
+            if key not in self._locks and key not in self._shared:
                 logger.warning(f"UNLOCK key='{key}' owner='{owner}' failed - no lock exists")
                 return False
             
-            lease = self._locks[key]
-            if lease.owner != owner:
-                logger.warning(f"UNLOCK key='{key}' owner='{owner}' failed - owned by '{lease.owner}'")
+            lease = self._held_lease(key, owner)
+            if lease is None:
+                logger.warning(f"UNLOCK key='{key}' owner='{owner}' failed - owned by {self._holders(key)}")
                 return False
             
-            del self._locks[key]
-            logger.info(f"LOCK RELEASED key='{key}' owner='{owner}'")
-            return True
+            now = time.time()
+            self._drop_lease(lease)
+            self._record_release(lease, now)
+            lsn = self._log(self._unlock_record(lease))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LOCK RELEASED key='{key}' owner='{owner}'")
+            if key in self._waiters:
+                self._hand_off(key, now)
+        self._sync(lsn)
+        return True
+
+    def release_locks(self, keys: List[str], owner: str) -> int:
+        with self._lock:
+            released = []
+            released_shared = []
+            now = time.time()
+            for key in keys:
+                lease = self._held_lease(key, owner)
+                if lease is not None:
+                    self._drop_lease(lease)
+                    self._record_release(lease, now)
+                    (released_shared if lease.shared else released).append(key)
+            lsn = self._log({'op': 'unlock', 'keys': released}) if released else None
+            if released_shared:
+                lsn = self._log({'op': 'unlock', 'keys': released_shared, 'owner': owner, 'shared': True})
+            released += released_shared
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LOCKS RELEASED keys={len(keys)} owner='{owner}' released={len(released)}")
+            for key in released:
+                if key in self._waiters:
+                    self._hand_off(key, now)
+        self._sync(lsn)
+        return len(released)
 
     def renew_lease(self, key: str, owner: str, lease_duration: float = 30.0) -> bool:
+        # Each shared holder renews its own lease independently.
         with self._lock:
-            if key not in self._locks:
+            if key not in self._locks and key not in self._shared:
                 logger.warning(f"RENEW LEASE key='{key}' owner='{owner}' failed - no lock exists")
                 return False
             
-            lease = self._locks[key]
-            if lease.owner != owner:
-                logger.warning(f"RENEW LEASE key='{key}' owner='{owner}' failed - owned by '{lease.owner}'")
+            lease = self._held_lease(key, owner)
+            if lease is None:
+                logger.warning(f"RENEW LEASE key='{key}' owner='{owner}' failed - owned by {self._holders(key)}")
                 return False
             
             now = time.time()
@@ -106,54 +952,537 @@ class DistributedKVStore:
             
             lease.expires_at = now + lease_duration
             lease.lease_duration = lease_duration
-            logger.info(f"LEASE RENEWED key='{key}' owner='{owner}' new_expiry={lease.expires_at}")
-            return True
+            self._index_expiry(lease)
+            lsn = self._log(self._lease_record(lease))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LEASE RENEWED key='{key}' owner='{owner}' new_expiry={lease.expires_at}")
+        self._sync(lsn)
+        return True
+
+    def renew_leases(self, owner: str, keys: Optional[List[str]] = None,
+                     lease_duration: float = 30.0) -> Tuple[int, List[str]]:
+        # Extends every lease owner holds, or only those on keys, in one pass
+        # and one log record. Returns how many were renewed and the keys
+        # owner no longer holds because their leases expired or were released.
+        with self._lock:
+            now = time.time()
+            owned = self._owned.get(owner, {})
+            expires_at = now + lease_duration
+            renewed: List[str] = []
+            lost: List[str] = []
+            for key in (list(owned) if keys is None else keys):
+                lease = owned.get(key)
+                if lease is None or now > lease.expires_at:
+                    lost.append(key)
+                    continue
+                lease.expires_at = expires_at
+                lease.lease_duration = lease_duration
+                self._index_expiry(lease)
+                renewed.append(key)
+            lsn = None
+            if renewed:
+                lsn = self._log({'op': 'renew', 'keys': renewed, 'owner': owner, 'expires_at': expires_at,
+                                 'lease_duration': lease_duration})
+            if lost:
+                logger.warning(f"RENEW LEASES owner='{owner}' lost {len(lost)} leases")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LEASES RENEWED owner='{owner}' renewed={len(renewed)} new_expiry={expires_at}")
+        self._sync(lsn)
+        return len(renewed), lost
 
     def get_lock_info(self, key: str) -> Optional[Dict[str, Any]]:
+        # Exclusive leases are described directly; a shared lock lists every
+        # holder with its own expiry.
         with self._lock:
-            if key not in self._locks:
+            if key not in self._locks and key not in self._shared:
                 return None
             
-            lease = self._locks[key]
             now = time.time()
-            
-            if now > lease.expires_at:
-                logger.info(f"LOCK INFO key='{key}' - lease expired, cleaning up")
-                del self._locks[key]
-                return None
-            
-            return {
-                'owner': lease.owner,
-                'acquired_at': lease.acquired_at,
-                'expires_at': lease.expires_at,
-                'time_remaining': lease.expires_at - now,
-                'lease_duration': lease.lease_duration
-            }
+            self._expire_stale(key, now)
+            return self._describe_lock(key, now)
+
+    def _describe_lock(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        # Exclusive leases are described directly; a shared lock lists every
+        # holder with its own expiry. Leases past their expiry are left out.
+        lease = self._locks.get(key)
+        if lease is not None and lease.expires_at > now:
+            return dict(self._lease_info(lease, now), mode='exclusive')
+        
+        holders = [lease for lease in self._shared.get(key, {}).values() if lease.expires_at > now]
+        if not holders:
+            return None
+        return {
+            'mode': 'shared',
+            'holders': [self._lease_info(lease, now) for lease in holders]
+        }
+
+    def list_locks(self, prefix: Optional[str] = None, limit: int = 100,
+                   cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        # Held locks in key order, paged like scan, each described as by
+        # get_lock_info plus its key. Expired leases are skipped and left to
+        # the reaper.
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        lower, inclusive = scan_bounds(prefix, None, cursor)
+        locks: List[Dict[str, Any]] = []
+        with self._lock:
+            now = time.time()
+            examined = 0
+            last_examined: Optional[str] = None
+            for key in self._lock_index.irange(lower, inclusive):
+                if not in_range(key, prefix, None):
+                    break
+                if examined == limit:
+                    return locks, last_examined
+                examined += 1
+                last_examined = key
+                info = self._describe_lock(key, now)
+                if info is not None:
+                    locks.append(dict(info, key=key))
+        return locks, None
+
+    @staticmethod
+    def _lease_info(lease: Lease, now: float) -> Dict[str, Any]:
+        return {
+            'owner': lease.owner,
+            'acquired_at': lease.acquired_at,
+            'expires_at': lease.expires_at,
+            'time_remaining': lease.expires_at - now,
+            'lease_duration': lease.lease_duration,
+            'token': lease.token
+        }
 
     def is_locked(self, key: str) -> bool:
         with self._lock:
-            if key not in self._locks:
+            if key not in self._locks and key not in self._shared:
                 return False
             
-            lease = self._locks[key]
+            self._expire_stale(key, time.time())
+            return key in self._locks or key in self._shared
+
+    def reset(self):
+        # Drops every key and lease without logging, before a replica reloads
+        # the primary's state. Parked acquirers are refused.
+        with self._lock:
+            self._store.clear()
+            self._index.clear()
+            self._versions.clear()
+            self._last_version = 0
+            self._sizes.clear()
+            self._used_memory = 0
+            self._expires.clear()
+            self._key_heap.clear()
+            if self._policy is not None:
+                self._policy.clear()
+            self._locks.clear()
+            self._shared.clear()
+            self._shared_count = 0
+            self._lock_index.clear()
+            self._owned.clear()
+            self._expiry_heap.clear()
+            waiters = [waiter for queue in self._waiters.values() for waiter in queue]
+            self._waiters.clear()
+        for waiter in waiters:
+            waiter._resolve(False)
+
+    def partitions(self) -> List['DistributedKVStore']:
+        return [self]
+
+    def export_chunks(self, chunk_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        # The partition's state as snapshot chunks: 'kv', 'expires' and
+        # 'versions' for up to chunk_size keys at a time in key order, then the
+        # version counter and the live 'leases'. Each chunk is copied under the
+        # lock and the lock is released between chunks, so a writer waits for
+        # one chunk at most rather than a copy of the whole partition. Later
+        # chunks may include writes made after earlier ones were taken; those
+        # writes are logged after the position the caller noted beforehand,
+        # and replaying them over the image is harmless.
+        after = None
+        while True:
+            with self._lock:
+                keys = list(itertools.islice(self._index.irange(after, inclusive=False), chunk_size))
+                if not keys:
+                    now = time.time()
+                    leases = [self._lease_record(lease) for lease in self._leases() if lease.expires_at > now]
+                    last_version = self._last_version
+                    break
+                items = [(key, self._store[key]) for key in keys]
+                expires = [(key, self._expires[key]) for key in keys if key in self._expires]
+                versions = [(key, self._versions[key]) for key in keys]
+                last_version = self._last_version
+            yield {'kv': items}
+            if expires:
+                yield {'expires': expires}
+            yield {'versions': versions, 'last_version': last_version}
+            after = keys[-1]
+        # The counter is kept apart from any key's version, so versions and
+        # tokens issued before a delete are never reused.
+        yield {'versions': [], 'last_version': last_version}
+        for i in range(0, len(leases), chunk_size):
+            yield {'leases': leases[i:i + chunk_size]}
+
+    def apply_record(self, record: Dict[str, Any]):
+        # Re-applies a logged mutation without logging it again. Records carry
+        # the resulting state, so applying one twice is harmless. Expiry times
+        # are applied even when already past, so a later 'expire' record can
+        # still clear them; the expired keys are then dropped as usual. Replay
+        # never evicts: evictions are in the log as deletes. Writes logged
+        # before versions existed get fresh ones.
+        with self._lock:
+            op = record['op']
+            if op == 'set':
+                key, value = record['key'], record['value']
+                self._put(key, value, entry_size(key, value), record.get('expires_at'), self._replayed_version(record))
+            elif op == 'delete':
+                if record['key'] in self._store:
+                    self._remove(record['key'])
+            elif op == 'mset':
+                expires_at = record.get('expires_at')
+                version = self._replayed_version(record)
+                for key, value in record['items'].items():
+                    self._put(key, value, entry_size(key, value), expires_at, version)
+            elif op == 'mdelete':
+                for key in record['keys']:
+                    if key in self._store:
+                        self._remove(key)
+            elif op == 'expire':
+                if record['key'] in self._store:
+                    self._set_expiry(record['key'], record['expires_at'])
+            elif op == 'expires':
+                for key, expires_at in record['items'].items():
+                    if key in self._store:
+                        self._set_expiry(key, expires_at)
+            elif op == 'versions':
+                self._seen_version(record.get('last_version', 0))
+                for key, version in record['items'].items():
+                    if key in self._store:
+                        self._versions[key] = version
+                        self._seen_version(version)
+            elif op in ('lock', 'locks'):
+                keys = record['keys'] if op == 'locks' else [record['key']]
+                shared = record.get('shared', False)
+                token = self._replayed_version(record, 'token')
+                for key in keys:
+                    lease = Lease(
+                        owner=record['owner'],
+                        key=key,
+                        acquired_at=record['acquired_at'],
+                        expires_at=record['expires_at'],
+                        lease_duration=record['lease_duration'],
+                        shared=shared,
+                        token=token
+                    )
+                    self._install_lease(lease)
+            elif op == 'renew':
+                for key in record['keys']:
+                    lease = self._locks.get(key)
+                    if lease is None or lease.owner != record['owner']:
+                        lease = self._shared.get(key, {}).get(record['owner'])
+                    if lease is not None:
+                        lease.expires_at = record['expires_at']
+                        lease.lease_duration = record['lease_duration']
+                        self._index_expiry(lease)
+            elif op == 'unlock':
+                for key in record.get('keys', [record.get('key')]):
+                    lease = self._shared.get(key, {}).get(record['owner']) if record.get('shared') \
+                        else self._locks.get(key)
+                    if lease is not None and lease.shared == record.get('shared', False):
+                        self._drop_lease(lease)
+            else:
+                raise ValueError(f"Unknown log record op: {op}")
+
+    def _replayed_version(self, record: Dict[str, Any], field: str = 'version') -> int:
+        version = record.get(field)
+        if version is None:
+            return self._next_version()
+        self._seen_version(version)
+        return version
+
+    def reap_expired_locks(self, max_items: int = 1000) -> int:
+        # Pops at most max_items due entries off the expiry heap, so the store
+        # lock is only held for a bounded amount of work per call.
+        with self._lock:
             now = time.time()
-            
-            if now > lease.expires_at:
-                del self._locks[key]
-                return False
-            
-            return True
+            heap = self._expiry_heap
+            reaped = 0
+            popped = 0
+            while heap and heap[0][0] < now and popped < max_items:
+                expires_at, _, lease = heapq.heappop(heap)
+                popped += 1
+                if self._is_indexed(expires_at, lease):
+                    self._expire_lease(lease, now)
+                    reaped += 1
+            return reaped
 
-    def cleanup_expired_locks(self) -> int:
+    def expiry_lag(self) -> float:
+        # How long the most overdue lease still in the index has been expired.
         with self._lock:
             now = time.time()
-            expired = [key for key, lease in self._locks.items() if now > lease.expires_at]
-            
-            for key in expired:
-                logger.info(f"CLEANUP expired lock key='{key}' owner='{self._locks[key].owner}'")
-                del self._locks[key]
+            heap = self._expiry_heap
+            while heap and not self._is_indexed(heap[0][0], heap[0][2]):
+                heapq.heappop(heap)
+            if heap and heap[0][0] < now:
+                return now - heap[0][0]
+            return 0.0
+
+    def next_expiry(self) -> Optional[float]:
+        with self._lock:
+            heap = self._expiry_heap
+            while heap and not self._is_indexed(heap[0][0], heap[0][2]):
+                heapq.heappop(heap)
+            return heap[0][0] if heap else None
+
+    def cleanup_expired_locks(self) -> int:
+        total = 0
+        while True:
+            reaped = self.reap_expired_locks()
+            total += reaped
+            if not reaped and not self.expiry_lag():
+                break
+        
+        if total:
+            logger.info(f"CLEANUP removed {total} expired locks")
+        
+        return total
+
+
+class ShardedKVStore:
+    def __init__(self, num_shards: int = 16, wal=None, metrics=None, writer_preference: bool = False,
+                 watch=None, replication=None, max_memory: Optional[int] = None, eviction_policy: str = 'lru'):
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1")
+        self.num_shards = num_shards
+        self._wal = wal
+        self._replication = replication
+        # Each shard enforces an equal share of the memory limit and evicts
+        # from its own keys only, so a write can be refused while other
+        # shards still have room; memory_stats reports every shard's share.
+        self._shards = [DistributedKVStore(wal=wal, metrics=metrics, writer_preference=writer_preference,
+                                           watch=watch, replication=replication,
+                                           max_memory=self._memory_share(max_memory, num_shards, index),
+                                           eviction_policy=eviction_policy)
+                        for index in range(num_shards)]
+        logger.info(f"ShardedKVStore initialized with {num_shards} shards")
+
+    @staticmethod
+    def _memory_share(max_memory: Optional[int], num_shards: int, index: int) -> Optional[int]:
+        if max_memory is None:
+            return None
+        return max_memory // num_shards + (1 if index < max_memory % num_shards else 0)
+
+    def attach_replication(self, replication):
+        # Every shard lock is held, so no batch spanning shards is half
+        # recorded.
+        with ExitStack() as stack:
+            for shard in self._shards:
+                stack.enter_context(shard._lock)
+            for shard in self._shards:
+                shard.attach_replication(replication)
+            self._replication = replication
+
+    def _shard_index(self, key: str) -> int:
+        # crc32 rather than hash(): str hashes are salted per process, so
+        # hash() would place a key differently in every run.
+        return zlib.crc32(key.encode('utf-8')) % self.num_shards
+
+    def _shard(self, key: str) -> DistributedKVStore:
+        return self._shards[self._shard_index(key)]
+
+    def _group(self, keys: Iterable[str]) -> Dict[int, List[str]]:
+        groups: Dict[int, List[str]] = {}
+        for key in keys:
+            groups.setdefault(self._shard_index(key), []).append(key)
+        return groups
+
+    def get(self, key: str) -> Optional[Any]:
+        return self._shard(key).get(key)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, token: Optional[int] = None) -> int:
+        return self._shard(key).set(key, value, ttl, token)
+
+    def get_with_version(self, key: str) -> Tuple[Optional[Any], int]:
+        return self._shard(key).get_with_version(key)
+
+    def cas(self, key: str, expected_version: int, value: Any, ttl: Optional[float] = None,
+            token: Optional[int] = None) -> Tuple[bool, int]:
+        return self._shard(key).cas(key, expected_version, value, ttl, token)
+
+    def delete(self, key: str, token: Optional[int] = None) -> bool:
+        return self._shard(key).delete(key, token)
+
+    def mget(self, keys: List[str]) -> Dict[str, Any]:
+        values: Dict[str, Any] = {}
+        for index, shard_keys in self._group(keys).items():
+            values.update(self._shards[index].mget(shard_keys))
+        return {key: values[key] for key in keys}
+
+    def mset(self, items: Dict[str, Any], ttl: Optional[float] = None) -> bool:
+        for index, shard_keys in self._group(items).items():
+            self._shards[index].mset({key: items[key] for key in shard_keys}, ttl)
+        return True
+
+    def mdelete(self, keys: List[str]) -> int:
+        return sum(self._shards[index].mdelete(shard_keys)
+                   for index, shard_keys in self._group(keys).items())
+
+    def expire(self, key: str, ttl: Optional[float]) -> bool:
+        return self._shard(key).expire(key, ttl)
+
+    def ttl(self, key: str) -> Optional[float]:
+        return self._shard(key).ttl(key)
+
+    def scan(self, prefix: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+             limit: int = 100, cursor: Optional[str] = None, values: bool = False) -> Tuple[List[Any], Optional[str]]:
+        # Each shard's page is taken under that shard's lock alone.
+        pages = [shard.scan(prefix, start, end, limit, cursor, values) for shard in self._shards]
+        return merge_pages(pages, limit, key=(lambda entry: entry[0]) if values else None)
+
+    def memory_stats(self) -> Dict[str, Any]:
+        per_shard = [shard.memory_stats() for shard in self._shards]
+        stats = {name: sum(shard[name] for shard in per_shard)
+                 for name in ('used_bytes', 'keys', 'keys_with_ttl', 'expired', 'evicted')}
+        limited = per_shard[0]['max_bytes'] is not None
+        stats['max_bytes'] = sum(shard['max_bytes'] for shard in per_shard) if limited else None
+        stats['policy'] = per_shard[0]['policy']
+        # The limit applies per shard, so the fullest shard refuses or evicts
+        # first; each shard's use against its own share shows which.
+        stats['shards'] = [{name: shard[name] for name in ('used_bytes', 'max_bytes', 'keys', 'evicted')}
+                           for shard in per_shard]
+        return stats
+
+    def acquire_lock(self, key: str, owner: str, lease_duration: float = 30.0,
+                     timeout: Optional[float] = None, shared: bool = False) -> Optional[int]:
+        return self._shard(key).acquire_lock(key, owner, lease_duration, timeout, shared)
+
+    def wait_for_lock(self, key: str, owner: str, lease_duration: float, timeout: float,
+                      callback: Optional[Callable[[LockWaiter], None]] = None,
+                      shared: bool = False) -> LockWaiter:
+        return self._shard(key).wait_for_lock(key, owner, lease_duration, timeout, callback, shared)
+
+    def poll_waiter(self, waiter: LockWaiter) -> Optional[float]:
+        return self._shard(waiter.key).poll_waiter(waiter)
+
+    def cancel_waiter(self, waiter: LockWaiter) -> bool:
+        return self._shard(waiter.key).cancel_waiter(waiter)
+
+    def acquire_locks(self, keys: List[str], owner: str, lease_duration: float = 30.0) -> Optional[int]:
+        acquired = self.acquire_locks_with_new(keys, owner, lease_duration)
+        return acquired[0] if acquired is not None else None
+
+    def acquire_locks_with_new(self, keys: List[str], owner: str,
+                               lease_duration: float = 30.0) -> Optional[Tuple[int, List[str]]]:
+        groups = self._group(keys)
+        # Hold every involved shard lock, always taken in index order so two
+        # overlapping batches cannot deadlock, to keep the batch all-or-nothing.
+        with ExitStack() as stack:
+            for index in sorted(groups):
+                stack.enter_context(self._shards[index]._lock)
             
-            if expired:
-                logger.info(f"CLEANUP removed {len(expired)} expired locks")
+            now = time.time()
+            for index, shard_keys in groups.items():
+                shard = self._shards[index]
+                for key in shard_keys:
+                    if not shard._lock_available(key, owner, now):
+                        logger.warning(f"LOCKS keys={len(keys)} owner='{owner}' failed - "
+                                       f"'{key}' held by {shard._holders(key)}")
+                        return None
             
-            return len(expired)
+            new = [key for key in dict.fromkeys(keys) if self._shard(key)._held_lease(key, owner) is None]
+            # One token for the batch, above every involved shard's counter.
+            token = max([self._shards[index]._last_version for index in groups], default=0) + 1
+            for index in groups:
+                self._shards[index]._seen_version(token)
+            granted = [key for index, shard_keys in groups.items() for key in shard_keys
+                       if self._shards[index]._restamp_lock(key, owner, lease_duration, now, token)]
+            lsn = None
+            if granted:
+                record = DistributedKVStore._leases_record(granted, owner, lease_duration, now, token)
+                if self._replication is not None:
+                    self._replication.append(record)
+                if self._wal is not None:
+                    lsn = self._wal.append(record)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"LOCKS ACQUIRED keys={len(keys)} owner='{owner}' duration={lease_duration}s "
+                             f"token={token}")
+        if lsn is not None:
+            self._wal.wait(lsn)
+        return token, new
+
+    def release_lock(self, key: str, owner: str) -> bool:
+        return self._shard(key).release_lock(key, owner)
+
+    def release_locks(self, keys: List[str], owner: str) -> int:
+        return sum(self._shards[index].release_locks(shard_keys, owner)
+                   for index, shard_keys in self._group(keys).items())
+
+    def renew_lease(self, key: str, owner: str, lease_duration: float = 30.0) -> bool:
+        return self._shard(key).renew_lease(key, owner, lease_duration)
+
+    def renew_leases(self, owner: str, keys: Optional[List[str]] = None,
+                     lease_duration: float = 30.0) -> Tuple[int, List[str]]:
+        if keys is None:
+            results = [shard.renew_leases(owner, None, lease_duration) for shard in self._shards]
+        else:
+            results = [self._shards[index].renew_leases(owner, shard_keys, lease_duration)
+                       for index, shard_keys in self._group(keys).items()]
+        return sum(renewed for renewed, _ in results), [key for _, lost in results for key in lost]
+
+    def get_lock_info(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._shard(key).get_lock_info(key)
+
+    def list_locks(self, prefix: Optional[str] = None, limit: int = 100,
+                   cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        pages = [shard.list_locks(prefix, limit, cursor) for shard in self._shards]
+        return merge_pages(pages, limit, key=lambda info: info['key'])
+
+    def is_locked(self, key: str) -> bool:
+        return self._shard(key).is_locked(key)
+
+    def partitions(self) -> List[DistributedKVStore]:
+        return list(self._shards)
+
+    def reset(self):
+        for shard in self._shards:
+            shard.reset()
+
+    def apply_record(self, record: Dict[str, Any]):
+        op = record['op']
+        if 'key' in record:
+            self._shard(record['key']).apply_record(record)
+        elif op in ('mset', 'expires'):
+            items = record['items']
+            for index, shard_keys in self._group(items).items():
+                self._shards[index].apply_record(dict(record, items={key: items[key] for key in shard_keys}))
+        elif op == 'versions':
+            # Keys may land on other shards than when the state was saved, so
+            # every shard takes the counter.
+            items = record['items']
+            groups = self._group(items)
+            for index, shard in enumerate(self._shards):
+                shard.apply_record(dict(record, items={key: items[key] for key in groups.get(index, ())}))
+        else:
+            for index, shard_keys in self._group(record['keys']).items():
+                self._shards[index].apply_record(dict(record, keys=shard_keys))
+
+    def reap_expired_locks(self, max_items: int = 1000) -> int:
+        per_shard = max(1, max_items // self.num_shards)
+        return sum(shard.reap_expired_locks(per_shard) for shard in self._shards)
+
+    def reap_expired_keys(self, max_items: int = 1000) -> int:
+        per_shard = max(1, max_items // self.num_shards)
+        return sum(shard.reap_expired_keys(per_shard) for shard in self._shards)
+
+    def next_key_expiry(self) -> Optional[float]:
+        expiries = [e for e in (shard.next_key_expiry() for shard in self._shards) if e is not None]
+        return min(expiries) if expiries else None
+
+    def expiry_lag(self) -> float:
+        return max(shard.expiry_lag() for shard in self._shards)
+
+    def next_expiry(self) -> Optional[float]:
+        expiries = [e for e in (shard.next_expiry() for shard in self._shards) if e is not None]
+        return min(expiries) if expiries else None
+
+    def cleanup_expired_locks(self) -> int:
+        # One shard at a time, so a sweep never blocks the whole store.
+        return sum(shard.cleanup_expired_locks() for shard in self._shards)
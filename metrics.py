@@ -0,0 +1,195 @@
+import math
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Histogram buckets grow by a factor of 2**(1/8) (about 9%), so a reported
+# percentile is the upper bound of its bucket and at most ~9% above the true
+# value. Buckets are created on first use, which keeps idle histograms empty.
+BUCKETS_PER_DOUBLING = 8
+QUANTILES = (0.5, 0.99, 0.999)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        # Caller holds the registry lock.
+        index = math.floor(math.log2(value) * BUCKETS_PER_DOUBLING) if value > 0 else -10 ** 6
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: 'Histogram'):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(2 ** ((index + 1) / BUCKETS_PER_DOUBLING), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        summary = {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+        }
+        for q in QUANTILES:
+            summary[_quantile_name(q)] = self.percentile(q)
+        return summary
+
+
+def _quantile_name(q: float) -> str:
+    # 0.5 -> p50, 0.99 -> p99, 0.999 -> p999
+    return 'p' + f"{q * 100:g}".replace('.', '')
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, str], int] = {}
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    def incr(self, name: str, label: str = '', amount: int = 1):
+        key = (name, label)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, label: str = ''):
+        key = (name, label)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def record_op(self, operation: str, seconds: float, success: bool):
+        # The request hot path: one lock round-trip for count, failures and latency.
+        with self._lock:
+            key = ('ops', operation)
+            self._counters[key] = self._counters.get(key, 0) + 1
+            if not success:
+                key = ('ops_failed', operation)
+                self._counters[key] = self._counters.get(key, 0) + 1
+            key = ('op_latency_seconds', operation)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def gauge(self, name: str, read: Callable[[], float]):
+        # Gauges are read on demand, so the value is never stale and costs
+        # nothing between scrapes.
+        self._gauges[name] = read
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: h.summary() for key, h in self._histograms.items()}
+        uptime = max(time.time() - self.started_at, 1e-9)
+
+        result: Dict[str, Any] = {'uptime': uptime, 'counters': {}, 'histograms': {}, 'gauges': {}}
+        for (name, label), value in sorted(counters.items()):
+            result['counters'].setdefault(name, {})[label or 'total'] = value
+        for (name, label), summary in sorted(histograms.items()):
+            result['histograms'].setdefault(name, {})[label or 'total'] = summary
+        for name, read in sorted(self._gauges.items()):
+            try:
+                result['gauges'][name] = read()
+            except Exception as e:
+                logger.error(f"Gauge {name} failed: {e}")
+        total_ops = sum(value for (name, _), value in counters.items() if name == 'ops')
+        result['ops_per_sec'] = total_ops / uptime
+        return result
+
+    def render_text(self, prefix: str = 'kv') -> str:
+        # Prometheus text exposition format; histograms are exported as summaries.
+        snapshot = self.snapshot()
+        lines: List[str] = [f"{prefix}_uptime_seconds {snapshot['uptime']:.3f}"]
+        for name, values in snapshot['counters'].items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for label, value in values.items():
+                lines.append(f"{prefix}_{name}_total{_labels(label)} {value}")
+        for name, values in snapshot['histograms'].items():
+            lines.append(f"# TYPE {prefix}_{name} summary")
+            for label, summary in values.items():
+                for q in QUANTILES:
+                    lines.append(f"{prefix}_{name}{_labels(label, quantile=q)} "
+                                 f"{summary[_quantile_name(q)]:.9f}")
+                lines.append(f"{prefix}_{name}_sum{_labels(label)} {summary['sum']:.9f}")
+                lines.append(f"{prefix}_{name}_count{_labels(label)} {summary['count']}")
+        for name, value in snapshot['gauges'].items():
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(label: str, quantile: Optional[float] = None) -> str:
+    parts = []
+    if label and label != 'total':
+        parts.append(f'op="{label}"')
+    if quantile is not None:
+        parts.append(f'quantile="{quantile}"')
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class MetricsHTTPServer:
+    # Serves the registry as plain text on GET /metrics for scrapers.
+    def __init__(self, registry: MetricsRegistry, host: str = '0.0.0.0', port: int = 9555):
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] not in ('/', '/metrics'):
+                    handler.send_error(404)
+                    return
+                body = registry.render_text().encode('utf-8')
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-http', daemon=True)
+        self._thread.start()
+        logger.info(f"Metrics endpoint listening on port {self.port}")
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
@@ -0,0 +1,110 @@
+import logging
+import threading
+import itertools
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class NearCache:
+    # Bounded LRU of values read by KVStoreClient.get, kept coherent by the
+    # server's invalidation stream. Entries are only trusted while that stream
+    # is online: going offline flushes the cache, and lookups miss until the
+    # stream is back, so a lost invalidation can never leave a stale hit.
+    def __init__(self, max_size: int = 1024, prefixes: Iterable[str] = ('',)):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self.prefixes = tuple(prefixes)
+        self.online = False
+        self._entries: 'OrderedDict[str, Any]' = OrderedDict()
+        # Reads in flight, by key. An invalidation that arrives while a read
+        # is in flight drops its marker, so the possibly stale result of that
+        # read is not cached.
+        self._fills: Dict[str, int] = {}
+        self._tokens = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'bypassed': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'flushes': 0,
+        }
+
+    def cacheable(self, key: str) -> bool:
+        return key.startswith(self.prefixes)
+
+    def lookup(self, key: str) -> Tuple[bool, Any]:
+        with self._lock:
+            if not self.online:
+                self._stats['bypassed'] += 1
+                return False, None
+            value = self._entries.get(key, _MISSING)
+            if value is _MISSING:
+                self._stats['misses'] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return True, value
+
+    def begin_fill(self, key: str) -> Optional[int]:
+        with self._lock:
+            if not self.online:
+                return None
+            token = next(self._tokens)
+            self._fills[key] = token
+            return token
+
+    def complete_fill(self, key: str, token: Optional[int], value: Any):
+        with self._lock:
+            if token is None or self._fills.get(key) != token:
+                return
+            del self._fills[key]
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def cancel_fill(self, key: str, token: Optional[int]):
+        with self._lock:
+            if token is not None and self._fills.get(key) == token:
+                del self._fills[key]
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._fills.pop(key, None)
+            if self._entries.pop(key, _MISSING) is not _MISSING:
+                self._stats['invalidations'] += 1
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._entries.clear()
+        self._fills.clear()
+        self._stats['flushes'] += 1
+
+    def set_online(self, online: bool):
+        with self._lock:
+            if self.online and not online:
+                self._flush()
+                logger.warning("Near cache flushed: invalidation stream offline")
+            self.online = online
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['max_size'] = self.max_size
+            stats['online'] = self.online
+        lookups = stats['hits'] + stats['misses'] + stats['bypassed']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,314 @@
+import socket
+import time
+import logging
+import threading
+import itertools
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional
+from codec import CODECS, JSON_CODEC
+from protocol import FrameReader, encode_frame, enable_nodelay
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class StaleConnection(ConnectionError):
+    # The server had already closed the connection: the write failed, or the
+    # first read hit EOF or a reset before any response byte arrived. Only
+    # then is it safe to send the requests again elsewhere.
+    pass
+
+
+class KVConnection:
+    def __init__(self, host: str, port: int, timeout: Optional[float] = None, codec: str = 'binary'):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec!r}; expected one of {list(CODECS)}")
+        self.host = host
+        self.port = port
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        enable_nodelay(self.sock)
+        self.codec = JSON_CODEC
+        self.reader = FrameReader(self.sock)
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self._ids = itertools.count(1)
+        if codec != JSON_CODEC.name:
+            try:
+                self.negotiate([codec, JSON_CODEC.name])
+            except BaseException:
+                self.close()
+                raise
+
+    def negotiate(self, codecs: List[str]):
+        # Servers that predate codec negotiation answer 'hello' with an error,
+        # in which case the connection simply stays on JSON.
+        response = self.request({'operation': 'hello', 'codecs': codecs})
+        if response.get('success') and response.get('codec') in CODECS:
+            self.codec = CODECS[response['codec']]
+            self.reader.codec = self.codec
+
+    def request_many(self, requests: List[dict]) -> List[dict]:
+        # Writes every request in one send and then collects the responses,
+        # matching them back to their requests by id.
+        ids = []
+        out = bytearray()
+        for request in requests:
+            request_id = next(self._ids)
+            ids.append(request_id)
+            out += encode_frame(dict(request, id=request_id), self.codec)
+        try:
+            self.sock.sendall(out)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise StaleConnection(f"Connection to {self.host}:{self.port} was closed: {e}") from e
+
+        pending = set(ids)
+        responses: Dict[int, dict] = {}
+        first_read = True
+        while pending:
+            try:
+                messages = self.reader.read_messages()
+            except ConnectionResetError as e:
+                if first_read and not self.reader._buffer:
+                    raise StaleConnection(f"Connection to {self.host}:{self.port} was reset: {e}") from e
+                raise
+            if messages is None:
+                if first_read:
+                    raise StaleConnection("Connection closed by server")
+                raise ConnectionError("Connection closed by server")
+            first_read = False
+            for message in messages:
+                request_id = message.pop('id', None)
+                if request_id in pending:
+                    pending.discard(request_id)
+                    responses[request_id] = message
+        self.last_used = time.monotonic()
+        return [responses[request_id] for request_id in ids]
+
+    def request(self, request: dict) -> dict:
+        return self.request_many([request])[0]
+
+    def is_alive(self) -> bool:
+        # An idle connection has nothing to read; EOF or an error here means
+        # the server closed it while it sat in the pool.
+        try:
+            data = self.sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        return bool(data)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    def __init__(self, host: str, port: int, min_size: int = 0, max_size: int = 8,
+                 timeout: Optional[float] = None, checkout_timeout: Optional[float] = None,
+                 max_idle_time: float = 60.0, health_check_interval: float = 5.0,
+                 reap_interval: float = 10.0, codec: str = 'binary'):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        if min_size > max_size:
+            raise ValueError("min_size cannot exceed max_size")
+
+        self.host = host
+        self.port = port
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.checkout_timeout = checkout_timeout
+        self.max_idle_time = max_idle_time
+        self.health_check_interval = health_check_interval
+        self.reap_interval = reap_interval
+        self.codec = codec
+
+        self._idle: Deque[KVConnection] = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'created': 0,
+            'closed': 0,
+            'reconnects': 0,
+            'health_check_failures': 0,
+            'reaped': 0,
+        }
+
+        self._stop_reaper = threading.Event()
+        self._reaper = threading.Thread(target=self._reap_loop, daemon=True)
+        self._reaper.start()
+        self.fill_min()
+        logger.info(f"ConnectionPool for {host}:{port} min={min_size} max={max_size}")
+
+    def _connect(self) -> KVConnection:
+        try:
+            connection = KVConnection(self.host, self.port, self.timeout, self.codec)
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['created'] += 1
+        return connection
+
+    def checkout(self) -> KVConnection:
+        deadline = None
+        if self.checkout_timeout is not None:
+            deadline = time.monotonic() + self.checkout_timeout
+
+        with self._cond:
+            waited_since = None
+            while True:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+
+                if self._idle:
+                    connection = self._idle.pop()
+                    if (time.monotonic() - connection.last_used > self.health_check_interval
+                            and not connection.is_alive()):
+                        self._stats['health_check_failures'] += 1
+                        self._discard_locked(connection)
+                        continue
+                    break
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    connection = None
+                    break
+
+                if waited_since is None:
+                    waited_since = time.monotonic()
+                    self._stats['waits'] += 1
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"No connection to {self.host}:{self.port} available "
+                                      f"within {self.checkout_timeout}s")
+                self._cond.wait(remaining)
+
+            if waited_since is not None:
+                self._stats['wait_time'] += time.monotonic() - waited_since
+            self._stats['checkouts'] += 1
+
+        if connection is None:
+            connection = self._connect()
+        return connection
+
+    def checkin(self, connection: KVConnection, broken: bool = False):
+        with self._cond:
+            if broken or self._closed:
+                self._discard_locked(connection)
+            else:
+                self._idle.append(connection)
+            self._cond.notify()
+
+    def _discard_locked(self, connection: KVConnection):
+        connection.close()
+        self._size -= 1
+        self._stats['closed'] += 1
+
+    @contextmanager
+    def connection(self) -> Iterator[KVConnection]:
+        connection = self.checkout()
+        try:
+            yield connection
+        except BaseException:
+            self.checkin(connection, broken=True)
+            raise
+        else:
+            self.checkin(connection)
+
+    def request_many(self, requests: List[dict]) -> List[dict]:
+        # A pooled connection may have been closed by the server since its last
+        # health check; replay once on a fresh connection in that case. Any
+        # other failure, a timeout included, may leave the requests executed,
+        # so it is raised for the caller to decide.
+        started = time.monotonic()
+        connection = self.checkout()
+        reused = connection.created_at < started
+        try:
+            responses = connection.request_many(requests)
+        except StaleConnection:
+            self.checkin(connection, broken=True)
+            if not reused:
+                raise
+            with self._cond:
+                self._stats['reconnects'] += 1
+                self._prune_dead_locked()
+            with self.connection() as fresh:
+                return fresh.request_many(requests)
+        except BaseException:
+            self.checkin(connection, broken=True)
+            raise
+        self.checkin(connection)
+        return responses
+
+    def _prune_dead_locked(self):
+        # When one pooled connection turns out dead the server has usually
+        # dropped the rest as well, so check them all before retrying.
+        for connection in list(self._idle):
+            if not connection.is_alive():
+                self._idle.remove(connection)
+                self._stats['health_check_failures'] += 1
+                self._discard_locked(connection)
+
+    def _reap_loop(self):
+        while not self._stop_reaper.wait(self.reap_interval):
+            self.reap_idle()
+            self.fill_min()
+
+    def reap_idle(self) -> int:
+        now = time.monotonic()
+        reaped = 0
+        with self._cond:
+            # Oldest idle connections sit at the left end of the deque.
+            while (self._idle and self._size > self.min_size
+                   and now - self._idle[0].last_used > self.max_idle_time):
+                self._discard_locked(self._idle.popleft())
+                reaped += 1
+            self._stats['reaped'] += reaped
+        return reaped
+
+    def fill_min(self):
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                connection = self._connect()
+            except OSError as e:
+                logger.warning(f"Could not pre-open connection to {self.host}:{self.port}: {e}")
+                return
+            self.checkin(connection)
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._size - len(self._idle)
+            stats['max_size'] = self.max_size
+            return stats
+
+    def close(self):
+        self._stop_reaper.set()
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._discard_locked(self._idle.pop())
+            self._cond.notify_all()
@@ -0,0 +1,120 @@
+import socket
+import struct
+from typing import Any, List, Optional
+from codec import DEFAULT_CODEC, json_dumps, json_loads
+
+# Every message on the wire is a 4-byte big-endian payload length followed by
+# the payload itself. Requests carry an 'id' field that the server echoes back
+# so a client can keep many requests in flight on one connection. Payloads are
+# JSON until a client negotiates another codec with a 'hello' request.
+HEADER = struct.Struct('>I')
+HEADER_SIZE = HEADER.size
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+RECV_BUFFER_SIZE = 64 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_payload(message: Any) -> bytes:
+    return json_dumps(message)
+
+
+def decode_payload(payload: bytes) -> Any:
+    return json_loads(payload)
+
+
+def encode_frame(message: Any, codec=DEFAULT_CODEC) -> bytes:
+    payload = codec.encode(message)
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {len(payload)} bytes exceeds limit of {MAX_FRAME_SIZE}")
+    return HEADER.pack(len(payload)) + payload
+
+
+def send_message(sock: socket.socket, message: Any, codec=DEFAULT_CODEC):
+    sock.sendall(encode_frame(message, codec))
+
+
+def enable_nodelay(sock: socket.socket):
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (OSError, AttributeError):
+        pass
+
+
+def peer_closed(sock: socket.socket) -> bool:
+    # Checks for EOF without consuming anything the peer has sent.
+    try:
+        data = sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+    return not data
+
+
+class FrameReader:
+    def __init__(self, sock: socket.socket, bufsize: int = RECV_BUFFER_SIZE, codec=DEFAULT_CODEC):
+        self.sock = sock
+        self.bufsize = bufsize
+        self.codec = codec
+        self._buffer = bytearray()
+
+    def _split_frames(self) -> List[bytes]:
+        frames = []
+        buffer = self._buffer
+        offset = 0
+        while len(buffer) - offset >= HEADER_SIZE:
+            (length,) = HEADER.unpack_from(buffer, offset)
+            if length > MAX_FRAME_SIZE:
+                raise ProtocolError(f"Frame of {length} bytes exceeds limit of {MAX_FRAME_SIZE}")
+            end = offset + HEADER_SIZE + length
+            if len(buffer) < end:
+                break
+            frames.append(bytes(buffer[offset + HEADER_SIZE:end]))
+            offset = end
+        if offset:
+            del buffer[:offset]
+        return frames
+
+    def read_frames(self) -> Optional[List[bytes]]:
+        # Blocks until at least one complete frame is buffered and returns every
+        # complete frame available, so requests coalesced by TCP are all served
+        # from a single recv. Returns None once the peer has closed.
+        while True:
+            frames = self._split_frames()
+            if frames:
+                return frames
+            data = self.sock.recv(self.bufsize)
+            if not data:
+                if self._buffer:
+                    raise ProtocolError("Connection closed mid-frame")
+                return None
+            self._buffer += data
+
+    def read_messages(self) -> Optional[List[Any]]:
+        frames = self.read_frames()
+        if frames is None:
+            return None
+        decode = self.codec.decode
+        return [decode(frame) for frame in frames]
+
+    def read_message(self) -> Optional[Any]:
+        # Returns one message, keeping any further buffered frames for later calls.
+        while True:
+            if len(self._buffer) >= HEADER_SIZE:
+                (length,) = HEADER.unpack_from(self._buffer, 0)
+                if length > MAX_FRAME_SIZE:
+                    raise ProtocolError(f"Frame of {length} bytes exceeds limit of {MAX_FRAME_SIZE}")
+                end = HEADER_SIZE + length
+                if len(self._buffer) >= end:
+                    payload = bytes(self._buffer[HEADER_SIZE:end])
+                    del self._buffer[:end]
+                    return self.codec.decode(payload)
+            data = self.sock.recv(self.bufsize)
+            if not data:
+                if self._buffer:
+                    raise ProtocolError("Connection closed mid-frame")
+                return None
+            self._buffer += data
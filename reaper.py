@@ -0,0 +1,93 @@
+import logging
+import threading
+import time
+from typing import Any, Dict
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class LeaseReaper:
+    # Expires leases and, since it already wakes at expiry times, keys whose
+    # TTL has run out.
+    def __init__(self, store, interval: float = 1.0, batch_size: int = 500):
+        self.store = store
+        self.interval = interval
+        self.batch_size = batch_size
+        self.reaped = 0
+        self.expired_keys = 0
+        self.sweeps = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='lease-reaper', daemon=True)
+        self._thread.start()
+        logger.info(f"LeaseReaper started (interval={self.interval}s, batch={self.batch_size})")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1.0)
+            self._thread = None
+
+    def sweep(self) -> int:
+        # Reaps in batches of batch_size, releasing the store lock between
+        # batches so waiting requests interleave with a large sweep.
+        lag = self.store.expiry_lag()
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+
+        total = 0
+        while not self._stop.is_set():
+            reaped = self.store.reap_expired_locks(self.batch_size)
+            total += reaped
+            if reaped < self.batch_size and not self.store.expiry_lag():
+                break
+            time.sleep(0)
+
+        expired = 0
+        while not self._stop.is_set():
+            count = self.store.reap_expired_keys(self.batch_size)
+            expired += count
+            if count < self.batch_size:
+                break
+            time.sleep(0)
+
+        self.sweeps += 1
+        self.reaped += total
+        self.expired_keys += expired
+        if total:
+            logger.info(f"REAPER removed {total} expired leases (lag={lag:.3f}s)")
+        if expired and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"REAPER removed {expired} expired keys")
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"REAPER sweep failed: {e}")
+
+            # Sleep until the next lease falls due, but no longer than interval.
+            delay = self.interval
+            expiries = [e for e in (self.store.next_expiry(), self.store.next_key_expiry()) if e is not None]
+            if expiries:
+                delay = min(delay, max(0.01, min(expiries) - time.time()))
+            self._stop.wait(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'reaped': self.reaped,
+            'expired_keys': self.expired_keys,
+            'sweeps': self.sweeps,
+            'lag': self.last_lag,
+            'max_lag': self.max_lag,
+            'current_lag': self.store.expiry_lag(),
+        }
@@ -0,0 +1,305 @@
+import time
+import uuid
+import socket
+import logging
+import itertools
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from eviction import estimate_size
+from pool import KVConnection
+from protocol import ProtocolError
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Records per 'replicate' response and entries per 'replicate_sync' chunk. A
+# chunk has to fit in one frame, so it is kept well below the frame limit
+# for values of a few kilobytes.
+REPLICATION_BATCH_SIZE = 1000
+SYNC_CHUNK_ENTRIES = 1000
+# Sync images a replica stopped paging through are dropped after this long.
+SYNC_IMAGE_TTL = 60.0
+
+
+class ReplicationError(Exception):
+    pass
+
+
+class ReplicationLog:
+    # The primary's mutation stream for replicas: the same records the
+    # write-ahead log gets, numbered and kept in memory for the last `backlog`
+    # mutations, and no more than about `max_bytes` of them by estimated size.
+    # The store appends while it holds the lock that ordered the mutation, so
+    # sequence order is apply order for every key.
+    def __init__(self, backlog: int = 100000, max_bytes: Optional[int] = None):
+        self.backlog = backlog
+        self.max_bytes = max_bytes
+        # Sequence numbers restart with the process; a replica presents the
+        # epoch it followed and starts over from a full sync on a mismatch.
+        self.epoch = uuid.uuid4().hex[:16]
+        self.seq = 0
+        self._records: Deque[Tuple[int, Dict[str, Any]]] = deque()
+        self._sizes: Deque[int] = deque()
+        self._bytes = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._waiting = 0
+        self._listeners: List[Callable[[], None]] = []
+
+    def append(self, record: Dict[str, Any]):
+        size = estimate_size(record) if self.max_bytes is not None else 0
+        with self._cond:
+            self.seq += 1
+            self._records.append((self.seq, record))
+            self._sizes.append(size)
+            self._bytes += size
+            # The newest record is always kept, however large.
+            while len(self._records) > self.backlog or (self.max_bytes is not None and self._bytes > self.max_bytes
+                                                        and len(self._records) > 1):
+                self._records.popleft()
+                self._bytes -= self._sizes.popleft()
+            if self._waiting:
+                self._cond.notify_all()
+            listeners = self._listeners
+            if listeners:
+                self._listeners = []
+        if listeners:
+            for listener in listeners:
+                try:
+                    listener()
+                except Exception as e:
+                    logger.error(f"Replication listener failed: {e}")
+
+    def read(self, since: int, epoch: Optional[str], limit: int = REPLICATION_BATCH_SIZE
+             ) -> Tuple[List[Dict[str, Any]], int]:
+        # Returns up to limit records after since and the newest sequence
+        # number. Raises ReplicationError when the caller has to resync.
+        with self._cond:
+            if epoch != self.epoch:
+                raise ReplicationError('Replication log was reset by a primary restart')
+            if since > self.seq:
+                raise ReplicationError(f"Sequence {since} is ahead of the primary ({self.seq})")
+            records = self._records
+            oldest = records[0][0] if records else self.seq + 1
+            if since + 1 < oldest:
+                raise ReplicationError(f"Records after {since} are no longer retained (oldest is {oldest})")
+            start = len(records) - (self.seq - since)
+            batch = [record for _, record in itertools.islice(records, start, start + limit)]
+            return batch, self.seq
+
+    def wait(self, since: int, timeout: float):
+        # Blocks until a record after since exists or the timeout passes.
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.seq <= since:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+    def notify_when(self, since: int, listener: Callable[[], None]) -> Callable[[], None]:
+        # Non-blocking variant of wait() for event-loop callers. The listener
+        # runs once, on the appending thread or immediately; the returned
+        # function withdraws it.
+        with self._cond:
+            ready = self.seq > since
+            if not ready:
+                self._listeners.append(listener)
+        if ready:
+            listener()
+
+        def cancel():
+            with self._cond:
+                if listener in self._listeners:
+                    self._listeners.remove(listener)
+        return cancel
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'epoch': self.epoch,
+                'seq': self.seq,
+                'retained': len(self._records),
+                'oldest': self._records[0][0] if self._records else self.seq + 1,
+                'backlog': self.backlog,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class SyncImage:
+    # A copy of the primary's state for a replica that starts over. The
+    # replication position is read before the first chunk is copied, so
+    # records after it may already be in the image; replaying them is
+    # harmless because records carry the resulting state.
+    def __init__(self, store, log: ReplicationLog):
+        self.id = uuid.uuid4().hex
+        self.epoch = log.epoch
+        self.seq = log.seq
+        self.last_used = time.monotonic()
+        self._chunks = self._generate(store)
+
+    def _generate(self, store) -> Iterator[Dict[str, Any]]:
+        # Partitions are copied a chunk of keys at a time, under their own
+        # lock, as the replica pages through the image.
+        for partition in store.partitions():
+            yield from partition.export_chunks(SYNC_CHUNK_ENTRIES)
+
+    def next_chunk(self) -> Optional[Dict[str, Any]]:
+        self.last_used = time.monotonic()
+        return next(self._chunks, None)
+
+
+class Replicator:
+    # Runs on a replica: follows the primary's replication log with long-poll
+    # 'replicate' requests and applies each record to the local store. When
+    # the primary no longer has the records the replica needs (restart or
+    # backlog exceeded), the store is cleared and reloaded from a sync image.
+    def __init__(self, store, primary: str, name: str = '', poll_wait: float = 1.0,
+                 timeout: float = 10.0, codec: str = 'binary'):
+        host, _, port = primary.rpartition(':')
+        self.store = store
+        self.primary = primary
+        self.host = host
+        self.port = int(port)
+        self.name = name
+        self.poll_wait = poll_wait
+        self.timeout = timeout
+        self.codec = codec
+        self.epoch: Optional[str] = None
+        self.applied = 0
+        self.head = 0
+        self.connected = False
+        self.syncing = True
+        self.synced_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._connection: Optional[KVConnection] = None
+        self.stats_counters = {'records': 0, 'batches': 0, 'full_syncs': 0, 'reconnects': 0}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='replicator', daemon=True)
+        self._thread.start()
+        logger.info(f"Replicating from {self.primary}")
+
+    def stop(self):
+        self._stop.set()
+        connection = self._connection
+        if connection is not None:
+            # Wakes a long-poll blocked in recv; close() alone would not.
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=self.timeout)
+            self._thread = None
+
+    def _run(self):
+        delay = 0.1
+        while not self._stop.is_set():
+            try:
+                self._connection = KVConnection(self.host, self.port, self.timeout + self.poll_wait, self.codec)
+                self.connected = True
+                delay = 0.1
+                self._follow(self._connection)
+            except (OSError, ConnectionError, ProtocolError, ReplicationError, ValueError) as e:
+                if self._stop.is_set():
+                    break
+                logger.warning(f"Replication from {self.primary} interrupted: {e}; retrying in {delay:.1f}s")
+            finally:
+                self.connected = False
+                if self._connection is not None:
+                    self._connection.close()
+                    self._connection = None
+            self.stats_counters['reconnects'] += 1
+            self._stop.wait(delay)
+            delay = min(delay * 2, 5.0)
+
+    def _follow(self, connection: KVConnection):
+        while not self._stop.is_set():
+            if self.syncing or self.epoch is None:
+                self._full_sync(connection)
+            response = connection.request({'operation': 'replicate', 'since': self.applied, 'epoch': self.epoch,
+                                           'max': REPLICATION_BATCH_SIZE, 'wait': self.poll_wait,
+                                           'replica': self.name})
+            if not response.get('success'):
+                if response.get('resync'):
+                    logger.warning(f"Replica must resync: {response.get('error')}")
+                    self.syncing = True
+                    continue
+                raise ReplicationError(response.get('error', 'replicate failed'))
+            records = response.get('records') or []
+            for record in records:
+                self.store.apply_record(record)
+            self.applied += len(records)
+            self.head = response.get('seq', self.applied)
+            if records:
+                self.stats_counters['records'] += len(records)
+                self.stats_counters['batches'] += 1
+            if self.applied >= self.head:
+                self.synced_at = time.time()
+
+    def _full_sync(self, connection: KVConnection):
+        started = time.time()
+        self.syncing = True
+        response = connection.request({'operation': 'replicate_sync', 'replica': self.name})
+        if not response.get('success'):
+            raise ReplicationError(response.get('error', 'replicate_sync failed'))
+        sync_id = response['sync_id']
+        self.store.reset()
+        entries = leases = 0
+        while True:
+            chunk = connection.request({'operation': 'replicate_sync', 'sync_id': sync_id})
+            if not chunk.get('success'):
+                raise ReplicationError(chunk.get('error', 'replicate_sync failed'))
+            if chunk.get('done'):
+                break
+            if 'kv' in chunk:
+                self.store.apply_record({'op': 'mset', 'items': dict(chunk['kv'])})
+                entries += len(chunk['kv'])
+            if 'expires' in chunk:
+                self.store.apply_record({'op': 'expires', 'items': dict(chunk['expires'])})
+            if 'versions' in chunk:
+                self.store.apply_record({'op': 'versions', 'items': dict(chunk['versions']),
+                                         'last_version': chunk['last_version']})
+            for record in chunk.get('leases') or []:
+                if record['expires_at'] > time.time():
+                    self.store.apply_record(record)
+                    leases += 1
+        self.epoch = response['epoch']
+        self.applied = self.head = response['seq']
+        self.syncing = False
+        self.stats_counters['full_syncs'] += 1
+        logger.info(f"Full sync from {self.primary}: {entries} keys and {leases} leases at seq "
+                    f"{self.applied} in {time.time() - started:.2f}s")
+
+    def lag(self) -> Dict[str, Any]:
+        # records: how many records the primary had that are not applied yet.
+        # seconds: 0 while connected and caught up, otherwise the time since
+        # the replica was last known to be caught up.
+        caught_up = self.connected and not self.syncing and self.applied >= self.head
+        return {
+            'records': max(self.head - self.applied, 0),
+            'seconds': 0.0 if caught_up else (time.time() - self.synced_at if self.synced_at else None),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self.stats_counters)
+        stats.update({
+            'primary': self.primary,
+            'epoch': self.epoch,
+            'applied': self.applied,
+            'head': self.head,
+            'connected': self.connected,
+            'syncing': self.syncing,
+            'lag': self.lag(),
+        })
+        return stats
@@ -1,78 +1,495 @@
+import os
+import time
 import socket
-import json
 import logging
+import argparse
 import threading
-from kv_store import DistributedKVStore
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional
+from eviction import EVICTION_POLICIES, MemoryLimitError, parse_size
+from kv_store import DistributedKVStore, FencingError, LockWaiter, ShardedKVStore
+from metrics import MetricsHTTPServer, MetricsRegistry
+from reaper import LeaseReaper
+from sharded_client import worker_for
+from replication import REPLICATION_BATCH_SIZE, SYNC_IMAGE_TTL, ReplicationError, ReplicationLog, Replicator, SyncImage
+from snapshot import load_latest_snapshot, write_snapshot
+from wal import SYNC_BATCH, SYNC_MODES, WALError, WriteAheadLog
+from watch import WatchError, WatchHub, Watcher
+from codec import CODECS, DEFAULT_CODEC, choose_codec
+from protocol import FrameReader, ProtocolError, encode_frame, enable_nodelay, peer_closed
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+TOO_MANY_CONNECTIONS = {'success': False, 'error': 'Too many connections'}
+OPERATIONS = frozenset([
+    'get', 'set', 'delete', 'mget', 'mset', 'mdelete', 'acquire_lock', 'acquire_locks',
+    'release_lock', 'release_locks', 'renew_lease', 'is_locked', 'get_lock_info',
+    'cleanup_expired_locks', 'snapshot', 'reaper_stats', 'stats', 'watch',
+    'replicate', 'replicate_sync', 'replication', 'promote', 'expire', 'ttl', 'memory',
+    'cas', 'get_with_version', 'renew_leases', 'topology', 'scan', 'list_locks',
+])
+LOCK_ACQUIRE_OPERATIONS = frozenset(['acquire_lock', 'acquire_locks'])
+# What a replica serves; everything else belongs to the primary. Reads of
+# store state are refused while a replica is loading a full sync.
+REPLICA_OPERATIONS = frozenset(['get', 'mget', 'ttl', 'get_with_version', 'is_locked', 'get_lock_info', 'stats',
+                                'reaper_stats', 'memory', 'replication', 'promote', 'topology', 'scan',
+                                'list_locks'])
+REPLICA_READS = frozenset(['get', 'mget', 'ttl', 'get_with_version', 'is_locked', 'get_lock_info', 'scan',
+                           'list_locks'])
+# Operations that cover the whole key space. A worker answers them for its
+# own keys only, so it serves them only when the request is marked 'local'.
+PARTITIONED_OPERATIONS = frozenset(['scan', 'list_locks'])
+# Largest page a 'scan' or 'list_locks' request may ask for.
+MAX_SCAN_PAGE = 1000
+# Longest a replica's 'replicate' long-poll may wait for new records.
+REPLICATION_MAX_WAIT = 10.0
+# Events per frame on a watch stream, how often an idle threaded stream
+# checks whether its client has gone away, and how often an idle stream sends
+# an empty batch so clients can tell a quiet stream from a dead one.
+WATCH_BATCH_SIZE = 1000
+WATCH_IDLE_CHECK = 1.0
+WATCH_HEARTBEAT = 5.0
+# How often a threaded connection parked in a lock's wait queue checks
+# whether its client has gone away.
+LOCK_WAIT_SLICE = 0.1
+
+
+class NothingPending:
+    # Stands in for the log's deferred-sync state when there is no log.
+    lsn = 0
+
+
+NOTHING_PENDING = NothingPending()
+
+
+class PendingResponse:
+    # Returned by dispatch for requests that complete later, such as a lock
+    # acquire parked in a wait queue on the async server. `future` resolves
+    # to the response dict and the LSN that must be durable before it is sent.
+    def __init__(self, future, operation: str):
+        self.future = future
+        self.operation = operation
+        self.started = time.perf_counter()
+        self.request_id = None
+        self.codec = DEFAULT_CODEC
+        self.cancel = lambda: None
+
+    def encode(self, response: dict) -> bytes:
+        if self.request_id is not None:
+            response['id'] = self.request_id
+        return encode_frame(response, self.codec)
+
+
+class ParkedAcquire(PendingResponse):
+    # Returned by dispatch on the threaded server for a lock acquire that has
+    # to wait. The connection sends the responses before it first, then waits
+    # on the waiter itself while watching the socket.
+    def __init__(self, waiter: LockWaiter):
+        super().__init__(None, 'acquire_lock')
+        self.waiter = waiter
+
+
+class WatchStream:
+    # Returned by dispatch for 'watch'. The connection stops serving requests
+    # and streams the watcher's events, tagged with the watch request's id,
+    # until the client disconnects.
+    def __init__(self, watcher: Watcher, ack: dict):
+        self.watcher = watcher
+        self.ack = ack
+        self.request_id = None
+        self.codec = DEFAULT_CODEC
+
+    def encode(self, message: dict) -> bytes:
+        if self.request_id is not None:
+            message['id'] = self.request_id
+        return encode_frame(message, self.codec)
+
+    def encode_events(self, events: List[dict]) -> bytes:
+        out = bytearray()
+        for start in range(0, len(events), WATCH_BATCH_SIZE):
+            out += self.encode({'success': True, 'events': events[start:start + WATCH_BATCH_SIZE]})
+        return bytes(out)
+
+    def heartbeat(self) -> bytes:
+        return self.encode({'success': True, 'events': []})
+
+    def overflow_error(self) -> dict:
+        # The client can reconnect and resume from the last event it received
+        # for as long as the history still holds it.
+        return {'success': False, 'error': 'Watcher fell too far behind',
+                'seq': self.watcher.last_seq, 'epoch': self.ack['epoch']}
+
+
+class ClientSession:
+    # Per-connection state. Every connection starts out speaking JSON and may
+    # switch codec with a 'hello' request.
+    def __init__(self, addr):
+        self.addr = addr
+        self.codec = DEFAULT_CODEC
+
 
 class KVStoreServer:
-    def __init__(self, host: str = '0.0.0.0', port: int = 5555):
+    def __init__(self, host: str = '0.0.0.0', port: int = 5555, backlog: int = 128,
+                 max_connections: Optional[int] = None, shards: int = 1,
+                 reap_interval: float = 1.0, data_dir: Optional[str] = None,
+                 durability: str = SYNC_BATCH, sync_interval_ms: float = 10.0,
+                 snapshot_interval: float = 0.0, metrics_port: Optional[int] = None,
+                 writer_preference: bool = False, watch_history: int = 10000,
+                 replica_of: Optional[str] = None, replication_backlog: int = 100000,
+                 replication_backlog_bytes: Optional[int] = 64 * 1024 * 1024, allow_promote: bool = False,
+                 max_memory: Optional[int] = None, eviction_policy: str = 'lru',
+                 worker_index: int = 0, workers: int = 1):
+        if replica_of is not None and data_dir is not None:
+            raise ValueError("A replica keeps no write-ahead log; it reloads from its primary")
         self.host = host
         self.port = port
-        self.store = DistributedKVStore()
+        # One of `workers` processes started by workers.py, listening on
+        # consecutive ports. It serves only the keys worker_for assigns it.
+        self.worker_index = worker_index
+        self.workers = workers
+        self.backlog = backlog
+        self.max_connections = max_connections
+        self.wal = None
+        self.snapshot_dir = None
+        self.snapshot_interval = snapshot_interval
+        self._snapshot_lock = threading.Lock()
+        self._stop_snapshots = threading.Event()
+        self._snapshot_thread = None
+        if data_dir is not None:
+            self.wal = WriteAheadLog(os.path.join(data_dir, 'wal'), sync_mode=durability,
+                                     sync_interval_ms=sync_interval_ms)
+            self.snapshot_dir = os.path.join(data_dir, 'snapshots')
+        self.metrics = MetricsRegistry()
+        self.watch_hub = WatchHub(history=watch_history) if watch_history > 0 else None
+        # Mutations are only recorded for replicas once the first one starts
+        # a full sync, which every replica does before following; a promoted
+        # replica can then serve replicas of its own the same way.
+        self.replication_backlog = replication_backlog
+        self.replication_backlog_bytes = replication_backlog_bytes
+        self.replication: Optional[ReplicationLog] = None
+        self.allow_promote = allow_promote
+        if shards > 1:
+            self.store = ShardedKVStore(shards, wal=self.wal, metrics=self.metrics,
+                                        writer_preference=writer_preference, watch=self.watch_hub,
+                                        max_memory=max_memory,
+                                        eviction_policy=eviction_policy)
+        else:
+            self.store = DistributedKVStore(wal=self.wal, metrics=self.metrics,
+                                            writer_preference=writer_preference, watch=self.watch_hub,
+                                            max_memory=max_memory,
+                                            eviction_policy=eviction_policy)
+        self.replicator = Replicator(self.store, replica_of, name=f"{host}:{port}") if replica_of else None
+        self._sync_images: Dict[str, SyncImage] = {}
+        self._replicas: Dict[str, Dict[str, float]] = {}
+        self._replication_lock = threading.Lock()
+        if self.wal is not None:
+            self.recover()
+        self.reaper = LeaseReaper(self.store, interval=reap_interval) if reap_interval > 0 else None
         self.server_socket = None
         self.running = False
+        self.connections = 0
+        self._connections_lock = threading.Lock()
+        self.metrics_port = metrics_port
+        self._metrics_server = None
+        self.metrics.gauge('connections', lambda: self.connections)
+        self.metrics.gauge('lease_expiry_lag_seconds', self.store.expiry_lag)
+        self.metrics.gauge('keys', lambda: self.store.memory_stats()['keys'])
+        self.metrics.gauge('memory_used_bytes', lambda: self.store.memory_stats()['used_bytes'])
+        if max_memory is not None:
+            self.metrics.gauge('memory_max_bytes', lambda: max_memory)
+        if self.watch_hub is not None:
+            self.metrics.gauge('watchers', lambda: self.watch_hub.stats()['watchers'])
+        if replication_backlog > 0:
+            self.metrics.gauge('replication_seq', lambda: self.replication.seq if self.replication is not None else 0)
+        if self.replicator is not None:
+            self.metrics.gauge('replication_lag_records', lambda: self.replicator.lag()['records'])
         logger.info(f"KVStoreServer initialized on {host}:{port}")
 
+    def recover(self):
+        start = time.time()
+        loaded = load_latest_snapshot(self.store, self.snapshot_dir)
+        from_lsn = loaded['lsn'] if loaded else 1
+        count = 0
+        for _, record in self.wal.replay(from_lsn):
+            self.store.apply_record(record)
+            count += 1
+        elapsed = time.time() - start
+        logger.info(f"Recovered {loaded['entries'] if loaded else 0} snapshot keys and "
+                    f"{count} log records in {elapsed:.2f}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._snapshot_lock:
+            return write_snapshot(self.store, self.snapshot_dir, wal=self.wal)
+
+    def snapshot_response(self):
+        # The connection's own thread writes the snapshot.
+        return {'success': True, 'snapshot': self.snapshot()}
+
+    def _snapshot_loop(self):
+        while not self._stop_snapshots.wait(self.snapshot_interval):
+            try:
+                self.snapshot()
+            except Exception as e:
+                logger.error(f"Snapshot failed: {e}")
+
+    def deferred_sync(self):
+        # Lets a batch of requests append to the log and then wait for a
+        # single fsync covering all of them before the responses go out.
+        if self.wal is None:
+            return nullcontext(NOTHING_PENDING)
+        return self.wal.deferred()
+
+    def wait_durable(self, pending):
+        if self.wal is not None and pending.lsn:
+            self.wal.wait(pending.lsn)
+
+    def _open_connection(self) -> bool:
+        with self._connections_lock:
+            if self.max_connections is not None and self.connections >= self.max_connections:
+                self.metrics.incr('connections_rejected')
+                return False
+            self.connections += 1
+        self.metrics.incr('connections_accepted')
+        return True
+
+    def _close_connection(self):
+        with self._connections_lock:
+            self.connections -= 1
+
     def handle_client(self, client_socket: socket.socket, addr):
+        if not self._open_connection():
+            logger.warning(f"Rejecting {addr}: connection limit {self.max_connections} reached")
+            try:
+                client_socket.sendall(encode_frame(TOO_MANY_CONNECTIONS))
+            except OSError:
+                pass
+            client_socket.close()
+            return
+        
+        try:
+            self._serve_client(client_socket, addr)
+        finally:
+            self._close_connection()
+
+    def _serve_client(self, client_socket: socket.socket, addr):
         logger.info(f"Client connected from {addr}")
+        enable_nodelay(client_socket)
+        reader = FrameReader(client_socket)
+        session = ClientSession(addr)
         
         try:
             while True:
-                data = client_socket.recv(4096)
-                if not data:
+                frames = reader.read_frames()
+                if frames is None:
                     break
                 
-                try:
-                    request = json.loads(data.decode('utf-8'))
-                    logger.info(f"Request from {addr}: {request.get('operation')}")
-                    
-                    response = self.process_request(request)
-                    
-                    client_socket.sendall(json.dumps(response).encode('utf-8'))
-                    
-                except json.JSONDecodeError as e:
-                    logger.error(f"Invalid JSON from {addr}: {e}")
-                    error_response = {'success': False, 'error': 'Invalid JSON'}
-                    client_socket.sendall(json.dumps(error_response).encode('utf-8'))
+                # Pipelined requests are answered in order with one send per
+                # batch. A parked lock acquire splits the batch: the responses
+                # before it go out before the connection waits for the lock.
+                remaining = iter(frames)
+                while True:
+                    out = bytearray()
+                    stream = parked = None
+                    with self.deferred_sync() as pending:
+                        for frame in remaining:
+                            response = self.handle_frame(frame, session)
+                            if isinstance(response, WatchStream):
+                                # A watch takes over the connection; requests
+                                # pipelined behind it are not served.
+                                stream = response
+                                break
+                            if isinstance(response, ParkedAcquire):
+                                parked = response
+                                break
+                            out += response
+                    self.wait_durable(pending)
+                    client_socket.sendall(out)
+                    if parked is None:
+                        break
+                    response = self.await_lock(client_socket, parked)
+                    if response is None:
+                        return
+                    client_socket.sendall(response)
+                if stream is not None:
+                    self.stream_watch(client_socket, stream)
+                    break
                     
+        except ProtocolError as e:
+            logger.error(f"Protocol error from {addr}: {e}")
+        except WALError as e:
+            # Never acknowledge writes that did not reach the log.
+            logger.error(f"Dropping client {addr}: {e}")
         except Exception as e:
             logger.error(f"Error handling client {addr}: {e}")
         finally:
             client_socket.close()
             logger.info(f"Client disconnected: {addr}")
 
+    def handle_frame(self, frame: bytes, session: ClientSession):
+        # Returns the encoded response frame. The response to 'hello' still
+        # goes out in the old codec; the new one applies from the next frame.
+        codec = session.codec
+        try:
+            request = codec.decode(frame)
+        except ValueError as e:
+            logger.error(f"Invalid {codec.name} payload from {session.addr}: {e}")
+            return encode_frame({'success': False, 'error': f"Invalid {codec.name} payload"}, codec)
+        
+        if not isinstance(request, dict):
+            return encode_frame({'success': False, 'error': 'Invalid request'}, codec)
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Request from {session.addr}: {request.get('operation')}")
+        if request.get('operation') == 'hello':
+            response = self.negotiate(request, session)
+        else:
+            response = self.process_request(request)
+        if isinstance(response, (PendingResponse, WatchStream)):
+            response.request_id = request.get('id')
+            response.codec = codec
+            return response
+        if 'id' in request:
+            response['id'] = request['id']
+        return encode_frame(response, codec)
+
+    def negotiate(self, request: dict, session: ClientSession) -> dict:
+        offered = request.get('codecs') or []
+        if not isinstance(offered, list):
+            return {'success': False, 'error': 'codecs must be a list'}
+        session.codec = choose_codec(offered)
+        logger.info(f"HELLO {session.addr} using codec {session.codec.name}")
+        return {'success': True, 'codec': session.codec.name, 'codecs': list(CODECS)}
+
     def process_request(self, request: dict) -> dict:
         operation = request.get('operation')
-        
+        start = time.perf_counter()
+        response = self.dispatch(operation, request)
+        if self.replicator is not None and isinstance(response, dict):
+            response['lag'] = self.replicator.lag()
+        if isinstance(response, WatchStream):
+            self.record_request(operation, time.perf_counter() - start, response.ack)
+        elif not isinstance(response, PendingResponse):
+            self.record_request(operation, time.perf_counter() - start, response)
+        return response
+
+    def record_request(self, operation: Optional[str], elapsed: float, response: dict):
+        success = bool(response.get('success'))
+        self.metrics.record_op(operation if operation in OPERATIONS else 'unknown', elapsed, success)
+        if operation in LOCK_ACQUIRE_OPERATIONS:
+            # A refusal without an error means another owner holds the lock.
+            if success:
+                self.metrics.incr('lock_acquired', operation)
+            elif 'error' not in response:
+                self.metrics.incr('lock_contended', operation)
+
+    def dispatch(self, operation: Optional[str], request: dict) -> dict:
+        replicator = self.replicator
+        if replicator is not None:
+            if operation not in REPLICA_OPERATIONS:
+                return {'success': False, 'error': 'Read-only replica', 'read_only': True,
+                        'primary': replicator.primary}
+            if replicator.syncing and operation in REPLICA_READS:
+                return {'success': False, 'error': 'Replica is syncing', 'syncing': True}
+        if self.workers > 1:
+            refusal = self.check_placement(request)
+            if refusal is not None:
+                return refusal
         try:
             if operation == 'get':
                 value = self.store.get(request['key'])
                 return {'success': True, 'value': value}
             
             elif operation == 'set':
-                success = self.store.set(request['key'], request['value'])
-                return {'success': success}
+                version = self.store.set(request['key'], request['value'], request.get('ttl'), request.get('token'))
+                return {'success': True, 'version': version}
             
             elif operation == 'delete':
-                success = self.store.delete(request['key'])
+                success = self.store.delete(request['key'], request.get('token'))
+                return {'success': success}
+            
+            elif operation == 'get_with_version':
+                value, version = self.store.get_with_version(request['key'])
+                return {'success': True, 'value': value, 'version': version}
+            
+            elif operation == 'cas':
+                # A conflict is a refusal without an error, like a contended
+                # lock; 'version' is then the key's current version.
+                written, version = self.store.cas(
+                    request['key'],
+                    int(request['expected_version']),
+                    request['value'],
+                    request.get('ttl'),
+                    request.get('token')
+                )
+                return {'success': written, 'version': version}
+            
+            elif operation == 'mget':
+                values = self.store.mget(request['keys'])
+                return {'success': True, 'values': values}
+            
+            elif operation == 'mset':
+                success = self.store.mset(request['items'], request.get('ttl'))
+                return {'success': success}
+            
+            elif operation == 'mdelete':
+                count = self.store.mdelete(request['keys'])
+                return {'success': True, 'deleted': count}
+            
+            elif operation == 'expire':
+                success = self.store.expire(request['key'], request.get('ttl'))
                 return {'success': success}
             
+            elif operation == 'ttl':
+                return {'success': True, 'ttl': self.store.ttl(request['key'])}
+            
+            elif operation == 'memory':
+                return {'success': True, 'memory': self.store.memory_stats()}
+            
+            elif operation == 'scan':
+                values = bool(request.get('values'))
+                entries, cursor = self.store.scan(request.get('prefix'), request.get('start'), request.get('end'),
+                                                  self.scan_limit(request), request.get('cursor'), values)
+                return {'success': True, 'items' if values else 'keys': entries, 'cursor': cursor}
+            
+            elif operation == 'acquire_lock' and request.get('timeout'):
+                return self.acquire_lock_blocking(
+                    request['key'],
+                    request['owner'],
+                    request.get('lease_duration', 30.0),
+                    float(request['timeout']),
+                    bool(request.get('shared', False))
+                )
+            
             elif operation == 'acquire_lock':
-                success = self.store.acquire_lock(
+                token = self.store.acquire_lock(
                     request['key'],
                     request['owner'],
-                    request.get('lease_duration', 30.0)
+                    request.get('lease_duration', 30.0),
+                    shared=bool(request.get('shared', False))
                 )
-                return {'success': success}
+                return {'success': token is not None, 'token': token}
             
             elif operation == 'release_lock':
                 success = self.store.release_lock(request['key'], request['owner'])
                 return {'success': success}
             
+            elif operation == 'acquire_locks':
+                acquired = self.store.acquire_locks_with_new(
+                    request['keys'],
+                    request['owner'],
+                    request.get('lease_duration', 30.0)
+                )
+                if acquired is None:
+                    return {'success': False, 'token': None}
+                # The keys the owner did not hold before, so a client undoing
+                # a batch spread over several servers releases only those.
+                return {'success': True, 'token': acquired[0], 'acquired': acquired[1]}
+            
+            elif operation == 'release_locks':
+                count = self.store.release_locks(request['keys'], request['owner'])
+                return {'success': True, 'released': count}
+            
             elif operation == 'renew_lease':
                 success = self.store.renew_lease(
                     request['key'],
@@ -81,6 +498,15 @@ class KVStoreServer:
                 )
                 return {'success': success}
             
+            elif operation == 'renew_leases':
+                keys = request.get('keys')
+                renewed, lost = self.store.renew_leases(
+                    request['owner'],
+                    list(keys) if keys is not None else None,
+                    request.get('lease_duration', 30.0)
+                )
+                return {'success': True, 'renewed': renewed, 'lost': lost}
+            
             elif operation == 'is_locked':
                 locked = self.store.is_locked(request['key'])
                 return {'success': True, 'locked': locked}
@@ -89,31 +515,310 @@ class KVStoreServer:
                 info = self.store.get_lock_info(request['key'])
                 return {'success': True, 'lock_info': info}
             
+            elif operation == 'list_locks':
+                locks, cursor = self.store.list_locks(request.get('prefix'), self.scan_limit(request),
+                                                      request.get('cursor'))
+                return {'success': True, 'locks': locks, 'cursor': cursor}
+            
             elif operation == 'cleanup_expired_locks':
                 count = self.store.cleanup_expired_locks()
                 return {'success': True, 'cleaned': count}
             
+            elif operation == 'snapshot':
+                if self.wal is None:
+                    return {'success': False, 'error': 'Snapshots require a data directory'}
+                return self.snapshot_response()
+            
+            elif operation == 'reaper_stats':
+                if self.reaper is None:
+                    return {'success': False, 'error': 'Lease reaper is disabled'}
+                return {'success': True, 'reaper': self.reaper.stats()}
+            
+            elif operation == 'stats':
+                return {'success': True, 'stats': self.metrics.snapshot()}
+            
+            elif operation == 'watch':
+                return self.watch(request)
+            
+            elif operation == 'replicate':
+                return self.replicate(request)
+            
+            elif operation == 'replicate_sync':
+                return self.replicate_sync(request)
+            
+            elif operation == 'replication':
+                return {'success': True, 'replication': self.replication_status()}
+            
+            elif operation == 'promote':
+                return self.promote()
+            
+            elif operation == 'topology':
+                return {'success': True, 'topology': self.topology()}
+            
             else:
                 return {'success': False, 'error': f'Unknown operation: {operation}'}
                 
         except KeyError as e:
             return {'success': False, 'error': f'Missing parameter: {e}'}
+        except MemoryLimitError as e:
+            return {'success': False, 'error': str(e), 'out_of_memory': True}
+        except FencingError as e:
+            return {'success': False, 'error': str(e), 'fenced': True}
         except Exception as e:
             logger.error(f"Error processing {operation}: {e}")
             return {'success': False, 'error': str(e)}
 
+    def check_placement(self, request: dict) -> Optional[dict]:
+        # Refuses requests naming a key another worker owns, so each key and
+        # its lock live in exactly one process whatever the client does.
+        operation = request.get('operation')
+        if operation == 'watch':
+            return self.check_watch_placement(request)
+        if operation in PARTITIONED_OPERATIONS and not request.get('local'):
+            return self.partition_refusal(operation)
+        keys = request.get('keys') or request.get('items') or ()
+        if 'key' in request:
+            keys = [request['key']]
+        for key in keys:
+            owner = worker_for(key, self.workers)
+            if owner != self.worker_index:
+                return self.moved(key, owner)
+        return None
+
+    def check_watch_placement(self, request: dict) -> Optional[dict]:
+        # A watch is one stream from one worker, so its keys must all live on
+        # one worker; a prefix watch sees only this worker's keys.
+        keys = request.get('keys') or []
+        if request.get('prefixes') and not request.get('local'):
+            return self.partition_refusal('watch on prefixes')
+        if not isinstance(keys, list):
+            return None
+        owners = {key: worker_for(key, self.workers) for key in keys}
+        if len(set(owners.values())) > 1:
+            self.metrics.incr('requests_misrouted')
+            return {'success': False, 'partitioned': True,
+                    'error': f"watch keys span workers {sorted(set(owners.values()))}; "
+                             f"watch each worker's keys on its own connection"}
+        for key, owner in owners.items():
+            if owner != self.worker_index:
+                return self.moved(key, owner)
+        return None
+
+    def moved(self, key: str, owner: int) -> dict:
+        self.metrics.incr('requests_misrouted')
+        return {'success': False, 'error': f"Key '{key}' belongs to worker {owner}", 'moved': True,
+                'worker': owner, 'port': self.port - self.worker_index + owner}
+
+    def partition_refusal(self, operation: str) -> dict:
+        self.metrics.incr('requests_misrouted')
+        return {'success': False, 'partitioned': True,
+                'error': f"{operation} on worker {self.worker_index} of {self.workers} would only cover "
+                         f"that worker's keys; use ShardedKVClient.for_workers, or set 'local' to "
+                         f"ask one worker for its own keys"}
+
+    @staticmethod
+    def scan_limit(request: dict) -> int:
+        limit = int(request.get('limit', 100))
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        return min(limit, MAX_SCAN_PAGE)
+
+    def topology(self) -> Dict[str, Any]:
+        base = self.port - self.worker_index
+        return {'workers': self.workers, 'worker': self.worker_index,
+                'ports': [base + index for index in range(self.workers)]}
+
+    def acquire_lock_blocking(self, key: str, owner: str, lease_duration: float, timeout: float,
+                              shared: bool = False):
+        # Parks a waiter in the key's wait queue; the connection's thread waits
+        # on it in await_lock. Requests pipelined behind this one wait for it,
+        # as responses go out in order.
+        waiter = self.store.wait_for_lock(key, owner, lease_duration, timeout, shared=shared)
+        if not waiter.done:
+            return ParkedAcquire(waiter)
+        if self.wal is not None and waiter.lsn:
+            self.wal.wait(waiter.lsn)
+        return {'success': waiter.granted, 'token': waiter.token}
+
+    def await_lock(self, client_socket: socket.socket, parked: ParkedAcquire) -> Optional[bytes]:
+        # Waits in short slices so a client that disconnects while parked is
+        # noticed and its waiter withdrawn; returns None in that case. A close
+        # is only seen once the client's pipelined requests have been read.
+        waiter = parked.waiter
+        while True:
+            wake_at = self.store.poll_waiter(waiter)
+            if wake_at is None:
+                break
+            waiter.event.wait(min(max(wake_at - time.time(), 0.0), LOCK_WAIT_SLICE))
+            if peer_closed(client_socket):
+                if not self.store.cancel_waiter(waiter) and waiter.granted:
+                    # The lock was handed over just as the client left.
+                    self.store.release_lock(waiter.key, waiter.owner)
+                logger.info(f"Withdrew lock waiter key='{waiter.key}' owner='{waiter.owner}' - client disconnected")
+                return None
+        
+        if self.wal is not None and waiter.lsn:
+            self.wal.wait(waiter.lsn)
+        response = {'success': waiter.granted, 'token': waiter.token}
+        self.record_request(parked.operation, time.perf_counter() - parked.started, response)
+        return parked.encode(response)
+
+    def watch(self, request: dict):
+        # Subscribes to changes of the listed keys and key prefixes. With
+        # 'since' (and the 'epoch' from an earlier stream) the events after
+        # that sequence number are replayed first, so a reconnecting client
+        # misses nothing while the history still covers the gap.
+        if self.watch_hub is None:
+            return {'success': False, 'error': 'Watches are disabled'}
+        keys = request.get('keys') or []
+        prefixes = request.get('prefixes') or []
+        if not isinstance(keys, list) or not isinstance(prefixes, list) or not (keys or prefixes):
+            return {'success': False, 'error': 'watch needs a list of keys or prefixes'}
+        try:
+            watcher = self.watch_hub.watch(keys, prefixes, request.get('since'), request.get('epoch'),
+                                           types=request.get('types'), values=request.get('values', True))
+        except WatchError as e:
+            # The client has to re-read current state before watching again.
+            return {'success': False, 'error': str(e), 'resync': True, 'epoch': self.watch_hub.epoch}
+        return WatchStream(watcher, {'success': True, 'epoch': self.watch_hub.epoch, 'seq': watcher.start_seq})
+
+    def replicate(self, request: dict):
+        # Long-poll for replicas: returns the records after 'since', first
+        # waiting up to 'wait' seconds for one if there are none yet.
+        if self.replication_backlog <= 0:
+            return {'success': False, 'error': 'Replication is disabled'}
+        if self.replication is None:
+            return {'success': False, 'error': 'No replication log yet; start with a full sync', 'resync': True,
+                    'epoch': None}
+        since = int(request.get('since') or 0)
+        epoch = request.get('epoch')
+        limit = max(1, min(int(request.get('max', REPLICATION_BATCH_SIZE)), REPLICATION_BATCH_SIZE))
+        wait = min(float(request.get('wait', 0.0)), REPLICATION_MAX_WAIT)
+        if request.get('replica'):
+            with self._replication_lock:
+                self._replicas[request['replica']] = {'acked': since, 'last_seen': time.time()}
+        response = self.replication_batch(since, epoch, limit)
+        if response.get('records') or not response.get('success') or wait <= 0:
+            return response
+        return self.wait_for_replication(since, epoch, limit, wait)
+
+    def replication_batch(self, since: int, epoch: Optional[str], limit: int) -> dict:
+        try:
+            records, head = self.replication.read(since, epoch, limit)
+        except ReplicationError as e:
+            return {'success': False, 'error': str(e), 'resync': True, 'epoch': self.replication.epoch}
+        return {'success': True, 'records': records, 'seq': head}
+
+    def wait_for_replication(self, since: int, epoch: Optional[str], limit: int, wait: float):
+        # The connection's thread parks until a record arrives; a replica's
+        # connection carries nothing else.
+        self.replication.wait(since, wait)
+        return self.replication_batch(since, epoch, limit)
+
+    def replicate_sync(self, request: dict) -> dict:
+        # Without 'sync_id' this starts a full sync and returns the position
+        # replication resumes from; each call with the id returns the next
+        # chunk of the image until 'done'.
+        if self.replication_backlog <= 0:
+            return {'success': False, 'error': 'Replication is disabled'}
+        sync_id = request.get('sync_id')
+        with self._replication_lock:
+            if sync_id is None:
+                now = time.monotonic()
+                for stale in [i for i, image in self._sync_images.items() if now - image.last_used > SYNC_IMAGE_TTL]:
+                    del self._sync_images[stale]
+                if self.replication is None:
+                    # Attached before the image is copied, so every mutation
+                    # is either in the image or in the log after image.seq.
+                    self.replication = ReplicationLog(self.replication_backlog, self.replication_backlog_bytes)
+                    self.store.attach_replication(self.replication)
+                    logger.info(f"Recording mutations for replicas (backlog {self.replication_backlog} records, "
+                                f"{self.replication_backlog_bytes} bytes)")
+                image = SyncImage(self.store, self.replication)
+                self._sync_images[image.id] = image
+                logger.info(f"Full sync for replica {request.get('replica')} at seq {image.seq}")
+                return {'success': True, 'sync_id': image.id, 'epoch': image.epoch, 'seq': image.seq}
+            image = self._sync_images.get(sync_id)
+        if image is None:
+            return {'success': False, 'error': 'Unknown or expired sync image'}
+        chunk = image.next_chunk()
+        if chunk is None:
+            with self._replication_lock:
+                self._sync_images.pop(sync_id, None)
+            return {'success': True, 'done': True}
+        chunk['success'] = True
+        return chunk
+
+    def replication_status(self) -> Dict[str, Any]:
+        if self.replicator is not None:
+            return dict(self.replicator.stats(), role='replica')
+        status: Dict[str, Any] = {'role': 'primary'}
+        if self.replication is not None:
+            status.update(self.replication.stats())
+            now = time.time()
+            with self._replication_lock:
+                status['replicas'] = {
+                    name: {'acked': seen['acked'], 'lag_records': max(status['seq'] - seen['acked'], 0),
+                           'last_seen_ago': now - seen['last_seen']}
+                    for name, seen in self._replicas.items()
+                }
+        return status
+
+    def promote(self) -> dict:
+        # Turns a replica into a writable primary, e.g. after losing the old
+        # primary. Replicas following the old primary must be pointed here
+        # and resync, since sequence numbers do not carry over.
+        replicator = self.replicator
+        if replicator is None:
+            return {'success': False, 'error': 'Not a replica'}
+        if not self.allow_promote:
+            return {'success': False, 'error': 'Promotion is disabled; start the replica with --allow-promote'}
+        self.replicator = None
+        replicator.stop()
+        logger.warning(f"Promoted to primary; stopped replicating from {replicator.primary} "
+                       f"at seq {replicator.applied}")
+        return {'success': True, 'applied': replicator.applied}
+
+    def stream_watch(self, client_socket: socket.socket, stream: WatchStream):
+        # Runs on the connection's thread until the client disconnects, the
+        # server stops or the watcher falls too far behind.
+        watcher = stream.watcher
+        try:
+            client_socket.sendall(stream.encode(stream.ack))
+            last_sent = time.monotonic()
+            while self.running and not watcher.closed:
+                events = watcher.wait(WATCH_IDLE_CHECK)
+                if events or time.monotonic() - last_sent >= WATCH_HEARTBEAT:
+                    client_socket.sendall(stream.encode_events(events) if events else stream.heartbeat())
+                    last_sent = time.monotonic()
+                if watcher.overflowed:
+                    client_socket.sendall(stream.encode(stream.overflow_error()))
+                    break
+                if not events and peer_closed(client_socket):
+                    break
+        except OSError:
+            pass
+        finally:
+            self.watch_hub.unwatch(watcher)
+
     def start(self):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
+        self.server_socket.listen(self.backlog)
         self.running = True
+        self.start_background_tasks()
         
         logger.info(f"Server listening on {self.host}:{self.port}")
         
         try:
             while self.running:
-                client_socket, addr = self.server_socket.accept()
+                try:
+                    client_socket, addr = self.server_socket.accept()
+                except OSError:
+                    if not self.running:
+                        break
+                    raise
                 client_thread = threading.Thread(
                     target=self.handle_client,
                     args=(client_socket, addr)
@@ -125,13 +830,120 @@ class KVStoreServer:
         finally:
             self.stop()
 
+    def start_background_tasks(self):
+        if self.reaper is not None:
+            self.reaper.start()
+        if self.replicator is not None:
+            self.replicator.start()
+        if self.watch_hub is not None:
+            self.watch_hub.start()
+        if self.metrics_port is not None and self._metrics_server is None:
+            self._metrics_server = MetricsHTTPServer(self.metrics, self.host, self.metrics_port)
+            self._metrics_server.start()
+        if self.wal is not None and self.snapshot_interval > 0 and self._snapshot_thread is None:
+            self._stop_snapshots.clear()
+            self._snapshot_thread = threading.Thread(target=self._snapshot_loop, name='snapshotter',
+                                                     daemon=True)
+            self._snapshot_thread.start()
+
+    def stop_background_tasks(self):
+        if self.reaper is not None:
+            self.reaper.stop()
+        if self.replicator is not None:
+            self.replicator.stop()
+        if self.watch_hub is not None:
+            self.watch_hub.stop()
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+            self._metrics_server = None
+        if self._snapshot_thread is not None:
+            self._stop_snapshots.set()
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+
     def stop(self):
         self.running = False
+        self.stop_background_tasks()
         if self.server_socket:
             self.server_socket.close()
+        self.close_storage()
         logger.info("Server stopped")
 
+    def close_storage(self):
+        if self.wal is not None:
+            self.wal.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distributed KV store server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--mode', choices=['threaded', 'async'], default='threaded',
+                        help='thread-per-connection or single asyncio event loop')
+    parser.add_argument('--backlog', type=int, default=128)
+    parser.add_argument('--max-connections', type=int, default=None)
+    parser.add_argument('--shards', type=int, default=1,
+                        help='number of independently locked store partitions')
+    parser.add_argument('--reap-interval', type=float, default=1.0,
+                        help='seconds between background lease reaper sweeps (0 disables)')
+    parser.add_argument('--data-dir', default=None,
+                        help='directory for the write-ahead log; in-memory only when omitted')
+    parser.add_argument('--durability', choices=SYNC_MODES, default=SYNC_BATCH,
+                        help='batch: fsync each group commit, interval: fsync every '
+                             '--sync-interval-ms, none: leave flushing to the OS')
+    parser.add_argument('--sync-interval-ms', type=float, default=10.0)
+    parser.add_argument('--snapshot-interval', type=float, default=0.0,
+                        help='seconds between snapshots that truncate the log (0 disables)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serve plain-text metrics over HTTP on this port')
+    parser.add_argument('--writer-preference', action='store_true',
+                        help='queued exclusive lock requests block new shared leases')
+    parser.add_argument('--watch-history', type=int, default=10000,
+                        help='change events kept for resuming watches (0 disables watches)')
+    parser.add_argument('--replica-of', default=None, metavar='HOST:PORT',
+                        help='run as a read-only replica of this primary')
+    parser.add_argument('--replication-backlog', type=int, default=100000,
+                        help='mutations kept for replicas to catch up from (0 disables serving replicas)')
+    parser.add_argument('--replication-backlog-bytes', type=parse_size, default=64 * 1024 * 1024, metavar='SIZE',
+                        help='estimated size the replication backlog is trimmed to, e.g. 64mb')
+    parser.add_argument('--allow-promote', action='store_true',
+                        help='let a promote request turn this replica into a writable primary')
+    parser.add_argument('--max-memory', type=parse_size, default=None, metavar='SIZE',
+                        help='evict keys (or refuse writes) beyond this estimated size, e.g. 512mb')
+    parser.add_argument('--eviction-policy', choices=EVICTION_POLICIES, default='lru',
+                        help='which keys --max-memory evicts; leased keys are never evicted')
+    parser.add_argument('--log-requests', action='store_true',
+                        help='log every request and store operation (DEBUG level)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes, each owning a key partition on ports --port, --port+1, ...')
+    args = parser.parse_args()
+    
+    if args.log_requests:
+        for name in (__name__, 'kv_store'):
+            logging.getLogger(name).setLevel(logging.DEBUG)
+    
+    options = dict(host=args.host, port=args.port, backlog=args.backlog,
+                   max_connections=args.max_connections, shards=args.shards,
+                   reap_interval=args.reap_interval, data_dir=args.data_dir,
+                   durability=args.durability, sync_interval_ms=args.sync_interval_ms,
+                   snapshot_interval=args.snapshot_interval, metrics_port=args.metrics_port,
+                   writer_preference=args.writer_preference, watch_history=args.watch_history,
+                   replica_of=args.replica_of, replication_backlog=args.replication_backlog,
+                   replication_backlog_bytes=args.replication_backlog_bytes, allow_promote=args.allow_promote,
+                   max_memory=args.max_memory, eviction_policy=args.eviction_policy)
+    if args.workers > 1:
+        from workers import run_workers
+        run_workers(args.mode, options, args.workers, log_requests=args.log_requests)
+        return
+    create_server(args.mode, options).start()
+
+
+def create_server(mode: str, options: Dict[str, Any]) -> KVStoreServer:
+    if mode == 'async':
+        from async_server import AsyncKVStoreServer
+        return AsyncKVStoreServer(**options)
+    return KVStoreServer(**options)
+
 
 if __name__ == "__main__":
-    server = KVStoreServer(host='0.0.0.0', port=5555)
-    server.start()
+    main()
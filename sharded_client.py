@@ -0,0 +1,443 @@
+import bisect
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from client import Endpoint, KVStoreClient, parse_endpoint
+from keepalive import LeaseKeepalive
+from keyindex import merge_pages
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def endpoint_name(endpoint: Endpoint) -> str:
+    host, port = parse_endpoint(endpoint)
+    return f"{host}:{port}"
+
+
+def hash_tag(key: str) -> str:
+    # Only the part between the first '{' and the next '}' is hashed when it is
+    # non-empty, so 'order:{42}:items' and 'order:{42}:lock' share a node.
+    start = key.find('{')
+    if start != -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def _position(name: str) -> int:
+    return int.from_bytes(hashlib.md5(name.encode('utf-8')).digest()[:8], 'big')
+
+
+def worker_for(key: str, workers: int) -> int:
+    # The worker process owning a key on a server started with --workers.
+    # Servers check it, so it must match on both sides.
+    return _position(hash_tag(key)) % workers
+
+
+class HashRing:
+    # Consistent hashing with virtual nodes: every node owns `vnodes` points on
+    # a 64-bit ring and a key belongs to the first point at or after its hash.
+    # Adding or removing a node only moves the keys on the arcs that node gains
+    # or loses, about 1/N of them, and the many points per node keep the split
+    # even.
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 160):
+        if vnodes < 1:
+            raise ValueError("vnodes must be at least 1")
+        self.vnodes = vnodes
+        self._nodes: List[str] = []
+        self._lock = threading.Lock()
+        # Lookups read this pair without the lock; changes build a new one.
+        self._ring: Tuple[List[int], List[str]] = ([], [])
+        for node in nodes:
+            self.add_node(node)
+
+    @property
+    def nodes(self) -> List[str]:
+        return list(self._nodes)
+
+    def add_node(self, node: str):
+        with self._lock:
+            if node in self._nodes:
+                raise ValueError(f"Node {node} is already on the ring")
+            self._nodes.append(node)
+            self._rebuild()
+
+    def remove_node(self, node: str):
+        with self._lock:
+            if node not in self._nodes:
+                raise ValueError(f"Node {node} is not on the ring")
+            self._nodes.remove(node)
+            self._rebuild()
+
+    def _rebuild(self):
+        # Caller holds self._lock.
+        points = sorted((_position(f"{node}#{i}"), node) for node in self._nodes for i in range(self.vnodes))
+        self._ring = ([position for position, _ in points], [node for _, node in points])
+
+    def node_for(self, key: str) -> str:
+        positions, owners = self._ring
+        if not positions:
+            raise LookupError("Hash ring has no nodes")
+        index = bisect.bisect_left(positions, _position(hash_tag(key)))
+        return owners[index if index < len(owners) else 0]
+
+    def group(self, keys: Iterable[str]) -> Dict[str, List[str]]:
+        groups: Dict[str, List[str]] = {}
+        for key in keys:
+            groups.setdefault(self.node_for(key), []).append(key)
+        return groups
+
+
+class WorkerRing:
+    # Placement for the worker processes of one server: worker i owns the
+    # keys worker_for assigns it. Nodes are added in worker order and the set
+    # is fixed once complete, since the workers enforce the placement.
+    def __init__(self, workers: int):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self._nodes: List[str] = []
+
+    @property
+    def nodes(self) -> List[str]:
+        return list(self._nodes)
+
+    def add_node(self, node: str):
+        if len(self._nodes) >= self.workers:
+            raise ValueError(f"All {self.workers} workers are already placed")
+        self._nodes.append(node)
+
+    def remove_node(self, node: str):
+        raise ValueError("Worker placement is fixed")
+
+    def node_for(self, key: str) -> str:
+        return self._nodes[worker_for(key, self.workers)]
+
+    def group(self, keys: Iterable[str]) -> Dict[str, List[str]]:
+        groups: Dict[str, List[str]] = {}
+        for key in keys:
+            groups.setdefault(self._nodes[worker_for(key, self.workers)], []).append(key)
+        return groups
+
+
+class ShardedKVClient:
+    # Spreads the key space over several servers. Every key, and every lock,
+    # lives on the node the ring assigns it; multi-key calls are split by node
+    # and the per-node parts run in parallel. Keys are not migrated when the
+    # ring changes, so after add_node/remove_node the keys that moved read as
+    # missing until rewritten.
+    def __init__(self, endpoints: Iterable[Endpoint], vnodes: int = 160, max_workers: int = 16,
+                 ring: Optional[Any] = None, **client_options):
+        self.client_options = client_options
+        self.clients: Dict[str, KVStoreClient] = {}
+        self.ring = ring if ring is not None else HashRing(vnodes=vnodes)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sharded-client')
+        for endpoint in endpoints:
+            self.add_node(endpoint)
+        if not self.clients:
+            raise ValueError("ShardedKVClient needs at least one endpoint")
+        logger.info(f"ShardedKVClient initialized for {len(self.clients)} nodes")
+
+    @classmethod
+    def for_workers(cls, endpoint: Endpoint, max_workers: int = 16, **client_options) -> 'ShardedKVClient':
+        # Connects to a server started with --workers and sends each key
+        # straight to the worker process that owns it, over one pool per
+        # worker port. Scans and lock listings go to every worker and are
+        # merged, so each worker is asked for its own keys only.
+        host, port = parse_endpoint(endpoint)
+        probe = KVStoreClient(host, port, **client_options)
+        try:
+            topology = probe.topology()
+        finally:
+            probe.close()
+        if topology is None:
+            raise ConnectionError(f"Could not read the worker topology from {host}:{port}")
+        return cls([(host, worker_port) for worker_port in topology['ports']], max_workers=max_workers,
+                   ring=WorkerRing(topology['workers']), worker_local=True, **client_options)
+
+    def add_node(self, endpoint: Endpoint):
+        name = endpoint_name(endpoint)
+        if name in self.clients:
+            raise ValueError(f"Node {name} is already configured")
+        host, _, port = name.rpartition(':')
+        self.clients[name] = KVStoreClient(host, int(port), **self.client_options)
+        self.ring.add_node(name)
+        logger.info(f"Node {name} added to the ring")
+
+    def remove_node(self, endpoint: Endpoint):
+        name = endpoint_name(endpoint)
+        self.ring.remove_node(name)
+        client = self.clients.pop(name)
+        client.close()
+        logger.info(f"Node {name} removed from the ring")
+
+    def node_for(self, key: str) -> str:
+        return self.ring.node_for(key)
+
+    def client_for(self, key: str) -> KVStoreClient:
+        return self.clients[self.ring.node_for(key)]
+
+    def _fan_out(self, calls: Dict[str, Callable[[KVStoreClient], Any]]) -> Dict[str, Any]:
+        # Runs one call per node, in parallel when there is more than one.
+        if len(calls) == 1:
+            (node, call), = calls.items()
+            return {node: call(self.clients[node])}
+        futures = {node: self._executor.submit(call, self.clients[node]) for node, call in calls.items()}
+        return {node: future.result() for node, future in futures.items()}
+
+    def _all_nodes(self, call: Callable[[KVStoreClient], Any]) -> Dict[str, Any]:
+        return self._fan_out({node: call for node in self.clients})
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for client in self.clients.values():
+            client.close()
+
+    def pipeline(self) -> 'ShardedPipeline':
+        return ShardedPipeline(self)
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.client_for(key).get(key)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, token: Optional[int] = None) -> bool:
+        return self.client_for(key).set(key, value, ttl, token)
+
+    def set_with_version(self, key: str, value: Any, ttl: Optional[float] = None,
+                         token: Optional[int] = None) -> Optional[int]:
+        return self.client_for(key).set_with_version(key, value, ttl, token)
+
+    def get_with_version(self, key: str) -> Tuple[Optional[Any], int]:
+        return self.client_for(key).get_with_version(key)
+
+    def cas(self, key: str, expected_version: int, value: Any, ttl: Optional[float] = None,
+            token: Optional[int] = None) -> Tuple[bool, int]:
+        return self.client_for(key).cas(key, expected_version, value, ttl, token)
+
+    def delete(self, key: str, token: Optional[int] = None) -> bool:
+        return self.client_for(key).delete(key, token)
+
+    def mget(self, keys: List[str]) -> Dict[str, Any]:
+        groups = self.ring.group(keys)
+        results = self._fan_out({node: (lambda client, k=node_keys: client.mget(k))
+                                 for node, node_keys in groups.items()})
+        values: Dict[str, Any] = {}
+        for node_values in results.values():
+            values.update(node_values)
+        return {key: values.get(key) for key in keys}
+
+    def mset(self, items: Dict[str, Any], ttl: Optional[float] = None) -> bool:
+        groups = self.ring.group(items)
+        results = self._fan_out({node: (lambda client, k=node_keys: client.mset({key: items[key] for key in k}, ttl))
+                                 for node, node_keys in groups.items()})
+        return all(results.values())
+
+    def mdelete(self, keys: List[str]) -> int:
+        groups = self.ring.group(keys)
+        results = self._fan_out({node: (lambda client, k=node_keys: client.mdelete(k))
+                                 for node, node_keys in groups.items()})
+        return sum(results.values())
+
+    def scan(self, prefix: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+             limit: int = 100, cursor: Optional[str] = None, values: bool = False) -> Optional[Dict[str, Any]]:
+        # Every node is asked for the same page in parallel and the pages are
+        # merged in key order, so the cursor works the same as on one server.
+        # None when any node fails, rather than a page with keys missing.
+        field = 'items' if values else 'keys'
+        pages = self._all_nodes(lambda client: client.scan(prefix, start, end, limit, cursor, values))
+        if any(page is None for page in pages.values()):
+            return None
+        entries, cursor = merge_pages([(page[field], page['cursor']) for page in pages.values()], limit,
+                                      key=(lambda item: item[0]) if values else None)
+        return {field: entries, 'cursor': cursor}
+
+    def scan_iter(self, prefix: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                  page_size: int = 100, values: bool = False) -> Iterator[Any]:
+        cursor = None
+        while True:
+            page = self.scan(prefix, start, end, page_size, cursor, values)
+            if page is None:
+                raise ConnectionError("scan failed on at least one node")
+            if values:
+                yield from (tuple(item) for item in page['items'])
+            else:
+                yield from page['keys']
+            cursor = page['cursor']
+            if cursor is None:
+                return
+
+    def expire(self, key: str, ttl: Optional[float]) -> bool:
+        return self.client_for(key).expire(key, ttl)
+
+    def ttl(self, key: str) -> Optional[float]:
+        return self.client_for(key).ttl(key)
+
+    def acquire_lock(self, key: str, owner: str, lease_duration: float = 30.0,
+                     timeout: Optional[float] = None, shared: bool = False) -> Optional[int]:
+        return self.client_for(key).acquire_lock(key, owner, lease_duration, timeout, shared)
+
+    def release_lock(self, key: str, owner: str) -> bool:
+        return self.client_for(key).release_lock(key, owner)
+
+    def acquire_locks(self, keys: List[str], owner: str, lease_duration: float = 30.0) -> Optional[Dict[str, int]]:
+        # All-or-nothing per node. When the keys span nodes, the keys this call
+        # newly acquired are released again if any node refuses, and other
+        # clients may briefly see part of the set held; locks the owner held
+        # before the call stay held. Keys sharing a hash tag stay on one node
+        # and keep the server's atomic batch. Each node issues its own fencing
+        # token, so the result maps every key to its token; None if the locks
+        # were not acquired.
+        groups = self.ring.group(keys)
+        results = self._fan_out({node: (lambda client, k=node_keys:
+                                        client.acquire_locks_with_new(k, owner, lease_duration))
+                                 for node, node_keys in groups.items()})
+        if all(result is not None for result in results.values()):
+            return {key: results[node][0] for node, node_keys in groups.items() for key in node_keys}
+        acquired = {node: result[1] for node, result in results.items() if result is not None and result[1]}
+        if acquired:
+            self._fan_out({node: (lambda client, k=node_keys: client.release_locks(k, owner))
+                           for node, node_keys in acquired.items()})
+            logger.warning(f"LOCKS rolled back on {len(acquired)} of {len(groups)} nodes owner='{owner}'")
+        return None
+
+    def release_locks(self, keys: List[str], owner: str) -> int:
+        groups = self.ring.group(keys)
+        results = self._fan_out({node: (lambda client, k=node_keys: client.release_locks(k, owner))
+                                 for node, node_keys in groups.items()})
+        return sum(results.values())
+
+    def renew_lease(self, key: str, owner: str, lease_duration: float = 30.0) -> bool:
+        return self.client_for(key).renew_lease(key, owner, lease_duration)
+
+    def renew_leases(self, owner: str, keys: Optional[List[str]] = None,
+                     lease_duration: float = 30.0) -> Dict[str, Any]:
+        # One request per node holding the keys, or to every node without
+        # keys. Keys on nodes whose request failed are listed under 'failed'.
+        groups: Dict[str, Optional[List[str]]] = {node: None for node in self.clients}
+        if keys is not None:
+            groups = dict(self.ring.group(keys))
+        results = self._fan_out({node: (lambda client, k=node_keys: client.renew_leases(owner, k, lease_duration))
+                                 for node, node_keys in groups.items()})
+        merged: Dict[str, Any] = {'renewed': 0, 'lost': [], 'failed': []}
+        for node, result in results.items():
+            if result is None:
+                merged['failed'].extend(groups[node] or [])
+            else:
+                merged['renewed'] += result['renewed']
+                merged['lost'].extend(result['lost'])
+        return merged
+
+    def keepalive(self, lease_duration: float = 30.0, interval: Optional[float] = None,
+                  on_lost: Optional[Callable[[str, List[str]], None]] = None) -> LeaseKeepalive:
+        return LeaseKeepalive(self, lease_duration, interval, on_lost).start()
+
+    def is_locked(self, key: str) -> bool:
+        return self.client_for(key).is_locked(key)
+
+    def get_lock_info(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.client_for(key).get_lock_info(key)
+
+    def list_locks(self, prefix: Optional[str] = None, limit: int = 100,
+                   cursor: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        pages = self._all_nodes(lambda client: client.list_locks(prefix, limit, cursor))
+        if any(page is None for page in pages.values()):
+            return None
+        locks, cursor = merge_pages([(page['locks'], page['cursor']) for page in pages.values()], limit,
+                                    key=lambda info: info['key'])
+        return {'locks': locks, 'cursor': cursor}
+
+    def iter_locks(self, prefix: Optional[str] = None, page_size: int = 100) -> Iterator[Dict[str, Any]]:
+        cursor = None
+        while True:
+            page = self.list_locks(prefix, page_size, cursor)
+            if page is None:
+                raise ConnectionError("list_locks failed on at least one node")
+            yield from page['locks']
+            cursor = page['cursor']
+            if cursor is None:
+                return
+
+    def cleanup_expired_locks(self) -> int:
+        return sum(self._all_nodes(lambda client: client.cleanup_expired_locks()).values())
+
+    def snapshot(self) -> Dict[str, Optional[Dict[str, Any]]]:
+        return self._all_nodes(lambda client: client.snapshot())
+
+    def reaper_stats(self) -> Dict[str, Optional[Dict[str, Any]]]:
+        return self._all_nodes(lambda client: client.reaper_stats())
+
+    def stats(self) -> Dict[str, Optional[Dict[str, Any]]]:
+        return self._all_nodes(lambda client: client.stats())
+
+    def memory(self) -> Dict[str, Optional[Dict[str, Any]]]:
+        return self._all_nodes(lambda client: client.memory())
+
+    def pool_stats(self) -> Dict[str, Dict[str, float]]:
+        return {node: client.pool_stats() for node, client in self.clients.items()}
+
+
+class ShardedPipeline:
+    # Queues requests like Pipeline, then sends each node its share in one
+    # pipelined write, all nodes in parallel, and returns results in call order.
+    def __init__(self, client: ShardedKVClient):
+        self._client = client
+        self._pipelines: Dict[str, Any] = {}
+        self._order: List[Tuple[str, int]] = []
+
+    def _queue(self, key: str, method: str, *args) -> 'ShardedPipeline':
+        node = self._client.node_for(key)
+        pipeline = self._pipelines.get(node)
+        if pipeline is None:
+            pipeline = self._pipelines[node] = self._client.clients[node].pipeline()
+        self._order.append((node, len(pipeline._requests)))
+        getattr(pipeline, method)(key, *args)
+        return self
+
+    def get(self, key: str) -> 'ShardedPipeline':
+        return self._queue(key, 'get')
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None,
+            token: Optional[int] = None) -> 'ShardedPipeline':
+        return self._queue(key, 'set', value, ttl, token)
+
+    def set_with_version(self, key: str, value: Any, ttl: Optional[float] = None,
+                         token: Optional[int] = None) -> 'ShardedPipeline':
+        return self._queue(key, 'set_with_version', value, ttl, token)
+
+    def get_with_version(self, key: str) -> 'ShardedPipeline':
+        return self._queue(key, 'get_with_version')
+
+    def cas(self, key: str, expected_version: int, value: Any, ttl: Optional[float] = None,
+            token: Optional[int] = None) -> 'ShardedPipeline':
+        return self._queue(key, 'cas', expected_version, value, ttl, token)
+
+    def delete(self, key: str, token: Optional[int] = None) -> 'ShardedPipeline':
+        return self._queue(key, 'delete', token)
+
+    def acquire_lock(self, key: str, owner: str, lease_duration: float = 30.0,
+                     shared: bool = False) -> 'ShardedPipeline':
+        return self._queue(key, 'acquire_lock', owner, lease_duration, shared)
+
+    def release_lock(self, key: str, owner: str) -> 'ShardedPipeline':
+        return self._queue(key, 'release_lock', owner)
+
+    def renew_lease(self, key: str, owner: str, lease_duration: float = 30.0) -> 'ShardedPipeline':
+        return self._queue(key, 'renew_lease', owner, lease_duration)
+
+    def is_locked(self, key: str) -> 'ShardedPipeline':
+        return self._queue(key, 'is_locked')
+
+    def get_lock_info(self, key: str) -> 'ShardedPipeline':
+        return self._queue(key, 'get_lock_info')
+
+    def execute(self) -> List[Any]:
+        if not self._order:
+            return []
+        pipelines, order = self._pipelines, self._order
+        self._pipelines, self._order = {}, []
+        results = self._client._fan_out({node: (lambda client, p=pipeline: p.execute())
+                                         for node, pipeline in pipelines.items()})
+        return [results[node][index] for node, index in order]
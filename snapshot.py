@@ -0,0 +1,172 @@
+import os
+import mmap
+import time
+import zlib
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from codec import json_dumps, json_loads
+from wal import RECORD_HEADER
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# A snapshot is the magic bytes followed by CRC-framed JSON chunks, using the
+# same framing as log records: one header chunk, any number of 'kv',
+# 'expires', 'versions' and 'leases' chunks, and an 'end' chunk. The
+# 'expires' and 'versions' chunks for a set of keys follow the 'kv' chunk
+# holding them, and every partition ends with a 'versions' chunk carrying its
+# version counter. A file without its end chunk is incomplete and is never
+# loaded.
+SNAPSHOT_MAGIC = b'KVSNAP01'
+SNAPSHOT_PREFIX = 'snapshot-'
+SNAPSHOT_SUFFIX = '.snap'
+CHUNK_ENTRIES = 10000
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def snapshot_name(lsn: int) -> str:
+    return f"{SNAPSHOT_PREFIX}{lsn:020d}{SNAPSHOT_SUFFIX}"
+
+
+def list_snapshots(directory: str) -> List[Tuple[int, str]]:
+    if not os.path.isdir(directory):
+        return []
+    snapshots = []
+    for name in os.listdir(directory):
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX):
+            lsn = int(name[len(SNAPSHOT_PREFIX):-len(SNAPSHOT_SUFFIX)])
+            snapshots.append((lsn, os.path.join(directory, name)))
+    snapshots.sort()
+    return snapshots
+
+
+def _chunk(payload: Dict[str, Any]) -> bytes:
+    data = json_dumps(payload)
+    return RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data
+
+
+def _throughput(nbytes: int, entries: int, elapsed: float) -> Dict[str, float]:
+    elapsed = max(elapsed, 1e-9)
+    return {
+        'bytes': nbytes,
+        'entries': entries,
+        'seconds': elapsed,
+        'mb_per_sec': nbytes / elapsed / (1024 * 1024),
+        'entries_per_sec': entries / elapsed,
+    }
+
+
+def write_snapshot(store, directory: str, wal=None, keep: int = 1) -> Dict[str, Any]:
+    # Partitions are copied a chunk of keys at a time under their own lock and
+    # written out after the lock is released, so the store lock is only held
+    # for an in-memory copy of one chunk, never for serialization or I/O.
+    # The log position is read before the first copy; records after it may
+    # already be in the image, which is fine because replaying them is
+    # idempotent.
+    os.makedirs(directory, exist_ok=True)
+    start = time.time()
+    if wal is not None:
+        wal.roll_segment()
+    lsn = wal.next_lsn if wal is not None else 0
+
+    final_path = os.path.join(directory, snapshot_name(lsn))
+    tmp_path = final_path + '.tmp'
+    entries = 0
+    leases = 0
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(_chunk({'header': {'lsn': lsn, 'created_at': start}}))
+
+        for partition in store.partitions():
+            for chunk in partition.export_chunks(CHUNK_ENTRIES):
+                f.write(_chunk(chunk))
+                if 'kv' in chunk:
+                    entries += len(chunk['kv'])
+                elif 'leases' in chunk:
+                    leases += len(chunk['leases'])
+
+        f.write(_chunk({'end': {'entries': entries, 'leases': leases}}))
+        f.flush()
+        os.fsync(f.fileno())
+        nbytes = f.tell()
+    os.replace(tmp_path, final_path)
+
+    for old_lsn, old_path in list_snapshots(directory)[:-keep]:
+        os.remove(old_path)
+    truncated = wal.truncate_before(lsn) if wal is not None else 0
+
+    stats = _throughput(nbytes, entries, time.time() - start)
+    stats.update({'lsn': lsn, 'leases': leases, 'path': final_path, 'truncated_segments': truncated})
+    logger.info(f"SNAPSHOT wrote {entries} keys and {leases} leases at LSN {lsn} "
+                f"({nbytes / (1024 * 1024):.1f} MB in {stats['seconds']:.2f}s, "
+                f"{stats['mb_per_sec']:.1f} MB/s); truncated {truncated} log segments")
+    return stats
+
+
+def load_snapshot(store, path: str) -> Dict[str, Any]:
+    # The file is memory-mapped and decoded one chunk at a time, so loading
+    # never needs a second copy of the whole image in memory.
+    start = time.time()
+    now = time.time()
+    entries = 0
+    leases = 0
+    lsn = None
+    complete = False
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(SNAPSHOT_MAGIC):
+            raise SnapshotError(f"Snapshot {path} is truncated")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise SnapshotError(f"{path} is not a snapshot file")
+            offset = len(SNAPSHOT_MAGIC)
+            while offset + RECORD_HEADER.size <= size:
+                length, crc = RECORD_HEADER.unpack_from(mm, offset)
+                begin = offset + RECORD_HEADER.size
+                end = begin + length
+                if end > size:
+                    break
+                data = mm[begin:end]
+                if zlib.crc32(data) != crc:
+                    raise SnapshotError(f"Snapshot {path} is corrupt at byte {offset}")
+                chunk = json_loads(data)
+                offset = end
+
+                if 'kv' in chunk:
+                    store.apply_record({'op': 'mset', 'items': dict(chunk['kv'])})
+                    entries += len(chunk['kv'])
+                elif 'expires' in chunk:
+                    store.apply_record({'op': 'expires', 'items': dict(chunk['expires'])})
+                elif 'versions' in chunk:
+                    store.apply_record({'op': 'versions', 'items': dict(chunk['versions']),
+                                        'last_version': chunk['last_version']})
+                elif 'leases' in chunk:
+                    for record in chunk['leases']:
+                        if record['expires_at'] > now:
+                            store.apply_record(record)
+                            leases += 1
+                elif 'header' in chunk:
+                    lsn = chunk['header']['lsn']
+                elif 'end' in chunk:
+                    complete = True
+                    break
+
+    if not complete or lsn is None:
+        raise SnapshotError(f"Snapshot {path} is incomplete")
+
+    stats = _throughput(size, entries, time.time() - start)
+    stats.update({'lsn': lsn, 'leases': leases, 'path': path})
+    logger.info(f"SNAPSHOT loaded {entries} keys and {leases} leases from LSN {lsn} "
+                f"({size / (1024 * 1024):.1f} MB in {stats['seconds']:.2f}s, "
+                f"{stats['mb_per_sec']:.1f} MB/s)")
+    return stats
+
+
+def load_latest_snapshot(store, directory: str) -> Optional[Dict[str, Any]]:
+    snapshots = list_snapshots(directory)
+    if not snapshots:
+        return None
+    return load_snapshot(store, snapshots[-1][1])
@@ -0,0 +1,33 @@
+import unittest
+from codec import BINARY_CODEC, JSON_CODEC, json_dumps, json_loads
+
+
+class RoundTripTest(unittest.TestCase):
+    VALUES = [
+        b'\x00\xffraw',
+        {'$bytes': 'not base64!'},
+        {'$bytes': 'aGk='},
+        {'$dict': [['a', 1]]},
+        {'$dict': {'$bytes': 'x'}},
+        {'$bytes': 'x', 'other': 1},
+        [{'$bytes': b'nested'}, b'', {'inner': {'$dict': None}}],
+        {'plain': [1, 2.5, None, True, 'text']},
+    ]
+
+    def test_values_round_trip_through_both_codecs(self):
+        for codec in (JSON_CODEC, BINARY_CODEC):
+            for value in self.VALUES:
+                message = {'operation': 'set', 'key': 'k', 'value': value}
+                self.assertEqual(codec.decode(codec.encode(message)), message, (codec.name, value))
+
+    def test_log_records_round_trip(self):
+        for value in self.VALUES:
+            record = {'op': 'set', 'key': 'k', 'value': value, 'version': 3}
+            self.assertEqual(json_loads(json_dumps(record)), record)
+
+    def test_bytes_keep_their_compact_form(self):
+        self.assertEqual(json_dumps({'value': b'hi'}), b'{"value":{"$bytes":"aGk="}}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from eviction import MemoryLimitError, entry_size, parse_size
+from kv_store import DistributedKVStore, ShardedKVStore
+
+VALUE = 'x' * 100
+
+
+def room_for(count: int) -> int:
+    return entry_size('key-0', VALUE) * count
+
+
+class EvictionTest(unittest.TestCase):
+    def test_lru_evicts_the_least_recently_used_key(self):
+        store = DistributedKVStore(max_memory=room_for(3), eviction_policy='lru')
+        for key in ('key-0', 'key-1', 'key-2'):
+            store.set(key, VALUE)
+        store.get('key-0')
+        store.set('key-3', VALUE)
+        values = store.mget(['key-0', 'key-1', 'key-2', 'key-3'])
+        self.assertEqual(sorted(key for key, value in values.items() if value is not None),
+                         ['key-0', 'key-2', 'key-3'])
+        self.assertEqual(store.memory_stats()['evicted'], 1)
+
+    def test_lfu_evicts_the_least_often_used_key(self):
+        store = DistributedKVStore(max_memory=room_for(3), eviction_policy='lfu')
+        for key in ('key-0', 'key-1', 'key-2'):
+            store.set(key, VALUE)
+        for key in ('key-0', 'key-0', 'key-2', 'key-2', 'key-1'):
+            store.get(key)
+        store.set('key-3', VALUE)
+        self.assertIsNone(store.get('key-1'))
+
+    def test_ttl_evicts_the_soonest_to_expire(self):
+        store = DistributedKVStore(max_memory=room_for(3), eviction_policy='ttl')
+        store.set('key-0', VALUE, ttl=300)
+        store.set('key-1', VALUE, ttl=100)
+        store.set('key-2', VALUE)
+        store.set('key-3', VALUE)
+        self.assertIsNone(store.get('key-1'))
+        self.assertEqual(store.get('key-0'), VALUE)
+
+    def test_leased_keys_are_never_evicted(self):
+        store = DistributedKVStore(max_memory=room_for(2), eviction_policy='lru')
+        store.set('key-0', VALUE)
+        store.set('key-1', VALUE)
+        store.acquire_lock('key-0', 'owner')
+        store.set('key-2', VALUE)
+        self.assertEqual(store.get('key-0'), VALUE)
+        self.assertIsNone(store.get('key-1'))
+        store.acquire_lock('key-2', 'owner')
+        with self.assertRaises(MemoryLimitError):
+            store.set('key-3', VALUE)
+
+    def test_noeviction_refuses_the_write_and_changes_nothing(self):
+        store = DistributedKVStore(max_memory=room_for(2), eviction_policy='noeviction')
+        store.set('key-0', VALUE)
+        store.set('key-1', VALUE)
+        used = store.memory_stats()['used_bytes']
+        with self.assertRaises(MemoryLimitError):
+            store.mset({'key-2': VALUE, 'key-3': VALUE})
+        self.assertEqual(store.memory_stats()['used_bytes'], used)
+        self.assertEqual(store.mget(['key-2', 'key-3']), {'key-2': None, 'key-3': None})
+
+    def test_sharded_limit_is_split_and_reported_per_shard(self):
+        store = ShardedKVStore(4, max_memory=1003)
+        stats = store.memory_stats()
+        self.assertEqual(stats['max_bytes'], 1003)
+        self.assertEqual([shard['max_bytes'] for shard in stats['shards']], [251, 251, 251, 250])
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size('512mb'), 512 * 1024 ** 2)
+        self.assertEqual(parse_size('100'), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
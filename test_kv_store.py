@@ -0,0 +1,92 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from kv_store import DistributedKVStore, ShardedKVStore
+from wal import WriteAheadLog
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def replayed(self) -> DistributedKVStore:
+        wal = WriteAheadLog(self.directory)
+        store = DistributedKVStore()
+        for _, record in wal.replay():
+            store.apply_record(record)
+        wal.close()
+        return store
+
+    def test_released_shared_lease_stays_released_over_expired_exclusive(self):
+        wal = WriteAheadLog(self.directory)
+        store = DistributedKVStore(wal=wal)
+        self.assertIsNotNone(store.acquire_lock('k', 'a', lease_duration=0.05))
+        time.sleep(0.1)
+        self.assertIsNotNone(store.acquire_lock('k', 'b', lease_duration=30.0, shared=True))
+        self.assertTrue(store.release_lock('k', 'b'))
+        wal.close()
+
+        replayed = self.replayed()
+        self.assertFalse(replayed.is_locked('k'))
+        self.assertIsNone(replayed.get_lock_info('k'))
+        self.assertIsNotNone(replayed.acquire_lock('k', 'writer', lease_duration=30.0))
+
+    def test_renewed_shared_lease_over_expired_exclusive(self):
+        wal = WriteAheadLog(self.directory)
+        store = DistributedKVStore(wal=wal)
+        store.acquire_lock('k', 'a', lease_duration=0.05)
+        time.sleep(0.1)
+        store.acquire_lock('k', 'b', lease_duration=0.5, shared=True)
+        self.assertEqual(store.renew_leases('b', ['k'], lease_duration=30.0), (1, []))
+        wal.close()
+
+        info = self.replayed().get_lock_info('k')
+        self.assertEqual(info['mode'], 'shared')
+        self.assertEqual([holder['owner'] for holder in info['holders']], ['b'])
+        self.assertGreater(info['holders'][0]['time_remaining'], 10.0)
+
+    def test_batch_token_covers_held_keys_after_replay(self):
+        wal = WriteAheadLog(self.directory)
+        store = DistributedKVStore(wal=wal)
+        store.acquire_lock('a', 'owner')
+        token = store.acquire_locks(['a', 'b'], 'owner')
+        wal.close()
+
+        replayed = self.replayed()
+        self.assertEqual(replayed.get_lock_info('a')['token'], token)
+        replayed.set('a', 1, token=token)
+
+
+class BatchTokenTest(unittest.TestCase):
+    def test_batch_token_fences_keys_already_held(self):
+        for store in (DistributedKVStore(), ShardedKVStore(4)):
+            first = store.acquire_lock('a', 'owner')
+            token = store.acquire_locks(['a', 'b'], 'owner')
+            self.assertGreater(token, first)
+            store.set('a', 1, token=token)
+            store.set('b', 2, token=token)
+            self.assertEqual(store.get_lock_info('a')['token'], token)
+
+
+class ShardPlacementTest(unittest.TestCase):
+    def test_placement_is_the_same_in_every_process(self):
+        script = ("from kv_store import ShardedKVStore; store = ShardedKVStore(16); "
+                  "print([store._shard_index(f'key-{i}') for i in range(100)])")
+        placements = set()
+        for seed in ('1', '2'):
+            env = dict(os.environ, PYTHONHASHSEED=seed)
+            placements.add(subprocess.run([sys.executable, '-c', script], env=env, check=True,
+                                          capture_output=True, text=True,
+                                          cwd=os.path.dirname(os.path.abspath(__file__))).stdout)
+        self.assertEqual(len(placements), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
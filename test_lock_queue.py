@@ -0,0 +1,86 @@
+import socket
+import threading
+import time
+import unittest
+from client import KVStoreClient
+from codec import DEFAULT_CODEC
+from kv_store import DistributedKVStore
+from protocol import FrameReader, encode_frame
+from test_sharded_client import start_server
+
+
+class HandoffTest(unittest.TestCase):
+    def test_waiters_get_the_lock_in_arrival_order(self):
+        store = DistributedKVStore()
+        self.assertIsNotNone(store.acquire_lock('key', 'holder'))
+        granted = []
+        threads = []
+        for owner in ['first', 'second', 'third']:
+            thread = threading.Thread(target=lambda owner=owner: store.acquire_lock('key', owner, timeout=5.0)
+                                      and granted.append(owner))
+            thread.start()
+            threads.append(thread)
+            # Let each waiter join the queue before the next one.
+            while len(store._waiters.get('key', ())) < len(threads):
+                time.sleep(0.01)
+
+        for count, holder in enumerate(['holder', 'first', 'second'], 1):
+            store.release_lock('key', holder)
+            while len(granted) < count:
+                time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(granted, ['first', 'second', 'third'])
+
+
+class BlockingAcquireTest(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server()
+        self.client = KVStoreClient('127.0.0.1', self.server.port)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def connect(self) -> socket.socket:
+        sock = socket.create_connection(('127.0.0.1', self.server.port))
+        sock.settimeout(5.0)
+        return sock
+
+    def wait_for_waiters(self, count: int):
+        deadline = time.time() + 5.0
+        while len(self.server.store._waiters.get('key', ())) != count:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_earlier_pipelined_responses_are_sent_before_waiting(self):
+        self.assertIsNotNone(self.client.acquire_lock('key', 'holder'))
+        sock = self.connect()
+        try:
+            sock.sendall(encode_frame({'operation': 'set', 'key': 'a', 'value': 1, 'id': 1}) +
+                         encode_frame({'operation': 'acquire_lock', 'key': 'key', 'owner': 'waiter',
+                                       'timeout': 5.0, 'id': 2}))
+            frames = FrameReader(sock).read_frames()
+            self.assertEqual([DEFAULT_CODEC.decode(frame)['id'] for frame in frames], [1])
+
+            self.client.release_lock('key', 'holder')
+            response = DEFAULT_CODEC.decode(FrameReader(sock).read_frames()[0])
+            self.assertEqual(response['id'], 2)
+            self.assertTrue(response['success'])
+        finally:
+            sock.close()
+
+    def test_disconnected_waiter_does_not_get_the_lock(self):
+        self.assertIsNotNone(self.client.acquire_lock('key', 'holder'))
+        sock = self.connect()
+        sock.sendall(encode_frame({'operation': 'acquire_lock', 'key': 'key', 'owner': 'gone', 'timeout': 30.0}))
+        self.wait_for_waiters(1)
+        sock.close()
+        self.wait_for_waiters(0)
+
+        self.assertTrue(self.client.release_lock('key', 'holder'))
+        self.assertFalse(self.client.is_locked('key'))
+
+
+if __name__ == '__main__':
+    unittest.main()
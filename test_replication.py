@@ -0,0 +1,61 @@
+import time
+import unittest
+from client import KVStoreClient
+from replication import ReplicationError, ReplicationLog
+from test_sharded_client import start_server
+
+
+def wait_until(condition, timeout: float = 5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.02)
+
+
+class ReplicationLogTest(unittest.TestCase):
+    def test_backlog_is_bounded_by_count_and_bytes(self):
+        log = ReplicationLog(backlog=5, max_bytes=None)
+        for i in range(8):
+            log.append({'op': 'set', 'key': f'k{i}', 'value': i})
+        self.assertEqual(log.stats()['retained'], 5)
+        records, head = log.read(3, log.epoch)
+        self.assertEqual([record['key'] for record in records], ['k3', 'k4', 'k5', 'k6', 'k7'])
+        with self.assertRaises(ReplicationError):
+            log.read(2, log.epoch)
+
+        log = ReplicationLog(backlog=1000, max_bytes=2000)
+        for i in range(10):
+            log.append({'op': 'set', 'key': f'k{i}', 'value': 'x' * 500})
+        stats = log.stats()
+        self.assertLessEqual(stats['bytes'], 2000)
+        self.assertLess(stats['retained'], 10)
+        log.append({'op': 'set', 'key': 'big', 'value': 'x' * 5000})
+        self.assertEqual(log.stats()['retained'], 1)
+
+
+class ReplicaTest(unittest.TestCase):
+    def test_log_starts_with_the_first_replica_and_promote_is_gated(self):
+        primary = start_server()
+        client = KVStoreClient('127.0.0.1', primary.port)
+        replicas = []
+        try:
+            client.set('before', 1)
+            self.assertIsNone(primary.replication)
+            for allow_promote in (False, True):
+                replicas.append(start_server(replica_of=f'127.0.0.1:{primary.port}', allow_promote=allow_promote))
+            wait_until(lambda: primary.replication is not None)
+            client.set('after', 2)
+            for replica in replicas:
+                wait_until(lambda: replica.store.get('after') == 2)
+                self.assertEqual(replica.store.get('before'), 1)
+            self.assertFalse(replicas[0].promote()['success'])
+            self.assertTrue(replicas[1].promote()['success'])
+        finally:
+            client.close()
+            for server in replicas + [primary]:
+                server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import random
+import time
+import unittest
+from keyindex import SortedKeyIndex, merge_pages
+from kv_store import DistributedKVStore, ShardedKVStore
+
+
+def make_stores():
+    return [DistributedKVStore(), ShardedKVStore(4)]
+
+
+def scan_all(store, page_size: int, cursor=None, **bounds):
+    keys, pages = [], 0
+    while True:
+        page, cursor = store.scan(limit=page_size, cursor=cursor, **bounds)
+        keys += page
+        pages += 1
+        if cursor is None:
+            return keys, pages
+
+
+class SortedKeyIndexTest(unittest.TestCase):
+    def test_irange_follows_adds_and_discards(self):
+        keys = [f'key-{i:05d}' for i in range(5000)]
+        shuffled = list(keys)
+        random.Random(7).shuffle(shuffled)
+        index = SortedKeyIndex()
+        for key in shuffled:
+            self.assertTrue(index.add(key))
+        self.assertFalse(index.add(keys[0]))
+        for key in keys[::3]:
+            self.assertTrue(index.discard(key))
+        live = [key for i, key in enumerate(keys) if i % 3]
+
+        self.assertEqual(len(index), len(live))
+        self.assertEqual(list(index.irange()), live)
+        self.assertEqual(list(index.irange('key-02500')), [key for key in live if key >= 'key-02500'])
+        self.assertEqual(list(index.irange('key-02501', inclusive=False)),
+                         [key for key in live if key > 'key-02501'])
+
+
+class ScanPagingTest(unittest.TestCase):
+    def test_pages_cover_the_prefix_once_in_order(self):
+        expected = sorted(f'user:{i}' for i in range(500))
+        for store in make_stores():
+            for key in expected + ['other:1', 'users', 'zzz']:
+                store.set(key, 1)
+            keys, pages = scan_all(store, 37, prefix='user:')
+            self.assertEqual(keys, expected)
+            self.assertGreaterEqual(pages, 500 // 37)
+
+    def test_range_bounds_and_values(self):
+        for store in make_stores():
+            for i in range(100):
+                store.set(f'k{i:03d}', i)
+            keys, _ = scan_all(store, 7, start='k010', end='k020')
+            self.assertEqual(keys, [f'k{i:03d}' for i in range(10, 20)])
+            items, cursor = store.scan(start='k098', values=True)
+            self.assertEqual(items, [['k098', 98], ['k099', 99]])
+            self.assertIsNone(cursor)
+
+    def test_keys_written_during_a_scan(self):
+        for store in make_stores():
+            for i in range(100):
+                store.set(f'k{i:03d}', i)
+            page, cursor = store.scan(limit=50)
+            store.delete('k010')
+            store.delete('k090')
+            store.set('k000a', 'behind the cursor')
+            store.set('k095a', 'ahead of the cursor')
+            rest, _ = scan_all(store, 50, cursor=cursor)
+            keys = page + rest
+            self.assertEqual(len(keys), len(set(keys)))
+            self.assertIn('k010', keys)
+            self.assertNotIn('k090', keys)
+            self.assertNotIn('k000a', keys)
+            self.assertIn('k095a', keys)
+
+    def test_expired_keys_are_skipped(self):
+        for store in make_stores():
+            store.set('a', 1)
+            store.set('b', 2, ttl=0.01)
+            store.set('c', 3)
+            time.sleep(0.02)
+            self.assertEqual(scan_all(store, 1)[0], ['a', 'c'])
+
+    def test_list_locks_pages(self):
+        for store in make_stores():
+            for i in range(30):
+                store.acquire_lock(f'lock:{i:02d}', f'owner-{i}')
+            store.acquire_lock('other', 'owner')
+            locks, cursor = [], None
+            while True:
+                page, cursor = store.list_locks('lock:', 4, cursor)
+                locks += page
+                if cursor is None:
+                    break
+            self.assertEqual([lock['key'] for lock in locks], [f'lock:{i:02d}' for i in range(30)])
+            self.assertEqual(locks[5]['owner'], 'owner-5')
+
+
+class MergePagesTest(unittest.TestCase):
+    def test_merged_page_stops_at_the_smallest_cursor(self):
+        page, cursor = merge_pages([(['a', 'c', 'e'], 'e'), (['b', 'f'], None), (['d'], 'd')], 10)
+        self.assertEqual((page, cursor), (['a', 'b', 'c', 'd'], 'd'))
+
+    def test_merged_page_respects_the_limit(self):
+        page, cursor = merge_pages([(['a', 'c'], None), (['b', 'd'], None)], 3)
+        self.assertEqual((page, cursor), (['a', 'b', 'c'], 'c'))
+        page, cursor = merge_pages([(['a'], None), (['b'], None)], 3)
+        self.assertEqual((page, cursor), (['a', 'b'], None))
+
+
+if __name__ == '__main__':
+    unittest.main()
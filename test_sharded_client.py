@@ -0,0 +1,50 @@
+import threading
+import unittest
+from benchmark import free_port, wait_for_port
+from server import KVStoreServer
+from sharded_client import ShardedKVClient
+
+
+def start_server(port: int = 0, **options) -> KVStoreServer:
+    server = KVStoreServer(host='127.0.0.1', port=port or free_port(), **options)
+    threading.Thread(target=server.start, daemon=True).start()
+    wait_for_port('127.0.0.1', server.port)
+    return server
+
+
+class ShardedLocksTest(unittest.TestCase):
+    def setUp(self):
+        self.servers = [start_server(), start_server()]
+        self.client = ShardedKVClient([('127.0.0.1', server.port) for server in self.servers])
+
+    def tearDown(self):
+        self.client.close()
+        for server in self.servers:
+            server.stop()
+
+    def keys_on(self, node: str, count: int):
+        keys = (f'key-{i}' for i in range(1000))
+        return [key for key in keys if self.client.node_for(key) == node][:count]
+
+    def test_rollback_keeps_locks_held_before_the_call(self):
+        first, second = self.client.ring.nodes
+        held, new = self.keys_on(first, 2)
+        refused, = self.keys_on(second, 1)
+        self.assertIsNotNone(self.client.acquire_lock(held, 'owner'))
+        self.assertIsNotNone(self.client.acquire_lock(refused, 'other'))
+
+        self.assertIsNone(self.client.acquire_locks([held, new, refused], 'owner'))
+        self.assertEqual(self.client.get_lock_info(held)['owner'], 'owner')
+        self.assertFalse(self.client.is_locked(new))
+        self.assertEqual(self.client.get_lock_info(refused)['owner'], 'other')
+
+    def test_batch_across_nodes(self):
+        first, second = self.client.ring.nodes
+        keys = self.keys_on(first, 2) + self.keys_on(second, 2)
+        tokens = self.client.acquire_locks(keys, 'owner')
+        self.assertEqual(sorted(tokens), sorted(keys))
+        self.assertEqual(self.client.release_locks(keys, 'owner'), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from kv_store import DistributedKVStore, ShardedKVStore
+from snapshot import list_snapshots, load_latest_snapshot, write_snapshot
+from wal import WriteAheadLog
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.wal_dir = os.path.join(self.directory, 'wal')
+        self.snapshot_dir = os.path.join(self.directory, 'snapshots')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def recovered(self, store):
+        loaded = load_latest_snapshot(store, self.snapshot_dir)
+        wal = WriteAheadLog(self.wal_dir)
+        for _, record in wal.replay(loaded['lsn'] if loaded else 1):
+            store.apply_record(record)
+        wal.close()
+        return store
+
+    def test_snapshot_restores_state_and_truncates_the_log(self):
+        for make in (DistributedKVStore, lambda **options: ShardedKVStore(4, **options)):
+            shutil.rmtree(self.directory, ignore_errors=True)
+            wal = WriteAheadLog(self.wal_dir, segment_size=4096)
+            store = make(wal=wal)
+            for i in range(200):
+                store.set(f'key-{i:03d}', {'n': i})
+            store.set('ttl', 'x', ttl=300)
+            token = store.acquire_lock('locked', 'owner')
+            segments = len(wal.segments())
+            stats = write_snapshot(store, self.snapshot_dir, wal=wal)
+            self.assertEqual(stats['entries'], 201)
+            self.assertEqual(stats['leases'], 1)
+            self.assertGreater(stats['truncated_segments'], 0)
+            self.assertLess(len(wal.segments()), segments)
+            store.set('after', 1)
+            store.delete('key-000')
+            version = store.set('key-001', 'new')
+            wal.close()
+
+            restored = self.recovered(make())
+            self.assertIsNone(restored.get('key-000'))
+            self.assertEqual(restored.get_with_version('key-001'), ('new', version))
+            self.assertEqual(restored.get('key-199'), {'n': 199})
+            self.assertEqual(restored.get('after'), 1)
+            self.assertGreater(restored.ttl('ttl'), 200)
+            self.assertEqual(restored.get_lock_info('locked')['token'], token)
+            self.assertGreater(restored.set('fresh', 1), version)
+
+    def test_only_the_newest_snapshot_is_kept(self):
+        wal = WriteAheadLog(self.wal_dir)
+        store = DistributedKVStore(wal=wal)
+        store.set('a', 1)
+        write_snapshot(store, self.snapshot_dir, wal=wal)
+        store.set('b', 2)
+        write_snapshot(store, self.snapshot_dir, wal=wal)
+        wal.close()
+        self.assertEqual(len(list_snapshots(self.snapshot_dir)), 1)
+        self.assertEqual(self.recovered(DistributedKVStore()).mget(['a', 'b']), {'a': 1, 'b': 2})
+
+    def test_export_releases_the_lock_between_chunks(self):
+        store = DistributedKVStore()
+        for i in range(10):
+            store.set(f'key-{i}', i)
+        chunks = store.export_chunks(chunk_size=4)
+        self.assertEqual([key for key, _ in next(chunks)['kv']], ['key-0', 'key-1', 'key-2', 'key-3'])
+        writer = threading.Thread(target=store.set, args=('key-9', 'written'))
+        writer.start()
+        writer.join(timeout=2.0)
+        self.assertFalse(writer.is_alive())
+        exported = dict(item for chunk in chunks if 'kv' in chunk for item in chunk['kv'])
+        self.assertEqual(len(exported), 6)
+        self.assertEqual(exported['key-9'], 'written')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import time
+import unittest
+from client import KVStoreClient
+from kv_store import DistributedKVStore, FencingError, ShardedKVStore
+from test_sharded_client import start_server
+from watch import WatchHub
+
+
+class CasTest(unittest.TestCase):
+    def test_cas_writes_only_at_the_expected_version(self):
+        for store in (DistributedKVStore(), ShardedKVStore(4)):
+            self.assertEqual(store.cas('k', 1, 'x'), (False, 0))
+            created, version = store.cas('k', 0, 'a')
+            self.assertTrue(created)
+            self.assertEqual(store.cas('k', 0, 'b'), (False, version))
+            updated, newer = store.cas('k', version, 'b')
+            self.assertTrue(updated)
+            self.assertGreater(newer, version)
+            self.assertEqual(store.get_with_version('k'), ('b', newer))
+
+
+class FencingTest(unittest.TestCase):
+    def test_stale_token_is_refused_after_expiry(self):
+        for store in (DistributedKVStore(), ShardedKVStore(4)):
+            stale = store.acquire_lock('k', 'a', lease_duration=0.05)
+            store.set('k', 1, token=stale)
+            time.sleep(0.1)
+            current = store.acquire_lock('k', 'b')
+            self.assertGreater(current, stale)
+            with self.assertRaises(FencingError):
+                store.set('k', 2, token=stale)
+            with self.assertRaises(FencingError):
+                store.delete('k', token=stale)
+            store.set('k', 3, token=current)
+            self.assertEqual(store.get('k'), 3)
+
+    def test_batch_reports_the_replaced_lease_released(self):
+        hub = WatchHub()
+        store = DistributedKVStore(watch=hub)
+        watcher = hub.watch(keys=['a'])
+        store.acquire_lock('a', 'owner')
+        store.acquire_locks(['a', 'b'], 'owner')
+        hub.dispatch()
+        self.assertEqual([event['type'] for event in watcher.drain()],
+                         ['lock_acquired', 'lock_released', 'lock_acquired'])
+
+
+class ClientVersionTest(unittest.TestCase):
+    def test_set_with_version_feeds_cas(self):
+        server = start_server()
+        client = KVStoreClient('127.0.0.1', server.port)
+        try:
+            version = client.set_with_version('k', 'a')
+            self.assertEqual(client.get_with_version('k'), ('a', version))
+            self.assertEqual(client.cas('k', version, 'b')[0], True)
+            self.assertTrue(client.set('k', 'c'))
+        finally:
+            client.close()
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
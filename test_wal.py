@@ -0,0 +1,142 @@
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from kv_store import DistributedKVStore
+from wal import WALError, WriteAheadLog
+
+
+class WriteFailureTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_log_stops_after_a_failed_write(self):
+        wal = WriteAheadLog(self.directory)
+        wal.wait(wal.append({'op': 'set', 'key': 'a', 'value': 1}))
+
+        def fail(batch, last_lsn):
+            raise OSError("disk full")
+
+        wal._write = fail
+        lsn = wal.append({'op': 'set', 'key': 'b', 'value': 2})
+        with self.assertRaises(WALError):
+            wal.wait(lsn)
+        with self.assertRaises(WALError):
+            wal.append({'op': 'set', 'key': 'c', 'value': 3})
+        with self.assertRaises(WALError):
+            wal.wait(1)
+        errors = []
+        wal.when_durable(1, errors.append)
+        self.assertIsInstance(errors[0], WALError)
+        wal.close()
+
+        wal = WriteAheadLog(self.directory)
+        self.assertEqual([record['key'] for _, record in wal.replay()], ['a'])
+        self.assertEqual(wal.next_lsn, 2)
+        wal.close()
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_store_state_survives_a_restart(self):
+        wal = WriteAheadLog(self.directory, segment_size=1024)
+        store = DistributedKVStore(wal=wal)
+        for i in range(50):
+            store.set(f'key-{i}', {'n': i})
+        store.delete('key-0')
+        store.mset({'a': b'raw', 'b': [1, 2]})
+        version = store.set('key-1', 'new', ttl=300)
+        token = store.acquire_lock('job', 'owner')
+        self.assertGreater(len(wal.segments()), 1)
+        wal.close()
+
+        wal = WriteAheadLog(self.directory, segment_size=1024)
+        restored = DistributedKVStore()
+        for _, record in wal.replay():
+            restored.apply_record(record)
+        self.assertIsNone(restored.get('key-0'))
+        self.assertEqual(restored.get('key-49'), {'n': 49})
+        self.assertEqual(restored.get('a'), b'raw')
+        self.assertEqual(restored.get_with_version('key-1'), ('new', version))
+        self.assertGreater(restored.ttl('key-1'), 0)
+        self.assertEqual(restored.get_lock_info('job')['owner'], 'owner')
+        self.assertEqual(restored.get_lock_info('job')['token'], token)
+        wal.close()
+
+    def test_torn_tail_is_dropped(self):
+        wal = WriteAheadLog(self.directory)
+        for i in range(3):
+            wal.wait(wal.append({'op': 'set', 'key': f'key-{i}', 'value': i}))
+        wal.close()
+        (_, path), = wal.segments()
+        with open(path, 'ab') as f:
+            f.write(b'\x00\x00\x01\x00partial')
+
+        wal = WriteAheadLog(self.directory)
+        self.assertEqual([lsn for lsn, _ in wal.replay()], [1, 2, 3])
+        self.assertEqual(wal.append({'op': 'set', 'key': 'next', 'value': 0}), 4)
+        wal.close()
+
+        wal = WriteAheadLog(self.directory)
+        self.assertEqual([lsn for lsn, _ in wal.replay()], [1, 2, 3, 4])
+        wal.close()
+
+
+class GroupCommitTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_concurrent_writers_share_fsyncs(self):
+        wal = WriteAheadLog(self.directory)
+        write = wal._write
+
+        def slow_write(batch, last_lsn):
+            # Records appended while one batch is being written join the next.
+            time.sleep(0.01)
+            write(batch, last_lsn)
+
+        wal._write = slow_write
+
+        def writer(n: int):
+            for i in range(10):
+                wal.wait(wal.append({'op': 'set', 'key': f'key-{n}-{i}', 'value': i}))
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(wal.durable_lsn, 80)
+        self.assertEqual(wal.stats['records'], 80)
+        self.assertLess(wal.stats['fsyncs'], 40)
+        wal.close()
+
+        wal = WriteAheadLog(self.directory)
+        self.assertEqual(len(list(wal.replay())), 80)
+        wal.close()
+
+    def test_deferred_batch_waits_once(self):
+        wal = WriteAheadLog(self.directory)
+        with wal.deferred() as pending:
+            for i in range(20):
+                wal.wait(wal.append({'op': 'set', 'key': f'key-{i}', 'value': i}))
+        self.assertEqual(pending.lsn, 20)
+        wal.wait(pending.lsn)
+        self.assertEqual(wal.durable_lsn, 20)
+        wal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
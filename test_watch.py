@@ -0,0 +1,61 @@
+import socket
+import unittest
+from client import KVStoreClient
+from test_sharded_client import start_server
+from watch import WatchError, WatchHub
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.hub = WatchHub(history=5)
+
+    def publish(self, *keys: str):
+        for key in keys:
+            self.hub.publish('set', key, key.upper())
+        self.hub.dispatch()
+
+    def test_resume_replays_matching_events_after_since(self):
+        self.publish('a', 'b', 'a')
+        watcher = self.hub.watch(keys=['a'], since=1, epoch=self.hub.epoch)
+        self.publish('a')
+        self.assertEqual([event['seq'] for event in watcher.drain()], [3, 4])
+        self.assertEqual(watcher.start_seq, 1)
+
+    def test_resume_fails_when_the_gap_is_lost(self):
+        self.publish('a', 'b', 'c', 'd', 'e', 'f', 'g')
+        with self.assertRaises(WatchError):
+            self.hub.watch(keys=['a'], since=1)
+        with self.assertRaises(WatchError):
+            self.hub.watch(keys=['a'], since=8)
+        with self.assertRaises(WatchError):
+            self.hub.watch(keys=['a'], since=7, epoch='earlier')
+        self.assertEqual(self.hub.watch(keys=['a'], since=2).drain(), [])
+
+
+class ReconnectTest(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server()
+        self.client = KVStoreClient('127.0.0.1', self.server.port)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+
+    def test_dropped_stream_resumes_after_the_last_event(self):
+        watch = self.client.watch(keys=['a'])
+        try:
+            events = iter(watch)
+            self.client.set('a', 1)
+            self.assertEqual(next(events)['value'], 1)
+
+            watch._connection.sock.shutdown(socket.SHUT_RDWR)
+            self.client.set('a', 2)
+            self.client.set('a', 3)
+            self.assertEqual([next(events)['value'] for _ in range(2)], [2, 3])
+            self.assertEqual(watch.reconnects, 1)
+        finally:
+            watch.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
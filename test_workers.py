@@ -0,0 +1,59 @@
+import unittest
+from benchmark import free_port
+from client import KVStoreClient
+from sharded_client import ShardedKVClient, worker_for
+from test_sharded_client import start_server
+from watch import WatchError
+
+
+class WorkerPlacementTest(unittest.TestCase):
+    def setUp(self):
+        port = free_port()
+        self.servers = [start_server(port + index, worker_index=index, workers=2) for index in range(2)]
+        self.client = KVStoreClient('127.0.0.1', port)
+        self.cluster = ShardedKVClient.for_workers(f'127.0.0.1:{port}')
+
+    def tearDown(self):
+        self.client.close()
+        self.cluster.close()
+        for server in self.servers:
+            server.stop()
+
+    def keys_on(self, worker: int, count: int):
+        keys = (f'key-{i}' for i in range(1000))
+        return [key for key in keys if worker_for(key, 2) == worker][:count]
+
+    def test_scan_and_list_locks_need_every_worker(self):
+        keys = sorted(self.keys_on(0, 2) + self.keys_on(1, 2))
+        for key in keys:
+            self.assertTrue(self.cluster.set(key, 1))
+            self.assertIsNotNone(self.cluster.acquire_lock(key, 'owner'))
+
+        for operation in ['scan', 'list_locks']:
+            response = self.client._send_request({'operation': operation})
+            self.assertFalse(response['success'])
+            self.assertTrue(response['partitioned'])
+        self.assertEqual(self.cluster.scan(limit=10)['keys'], keys)
+        self.assertEqual([lock['key'] for lock in self.cluster.list_locks(limit=10)['locks']], keys)
+
+    def test_watch_keys_on_several_workers_are_refused(self):
+        response = self.client._send_request({'operation': 'watch', 'keys': self.keys_on(0, 1) + self.keys_on(1, 1)})
+        self.assertTrue(response['partitioned'])
+        self.assertNotIn('moved', response)
+
+        response = self.client._send_request({'operation': 'watch', 'keys': self.keys_on(1, 2)})
+        self.assertTrue(response['moved'])
+        self.assertEqual(response['worker'], 1)
+
+    def test_prefix_watch_must_be_local(self):
+        with self.assertRaises(WatchError):
+            self.client.watch(prefixes=['key-'])
+        local = KVStoreClient('127.0.0.1', self.servers[0].port, worker_local=True)
+        try:
+            local.watch(prefixes=['key-']).close()
+        finally:
+            local.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
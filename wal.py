@@ -0,0 +1,337 @@
+import os
+import zlib
+import struct
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from codec import json_dumps, json_loads
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Each record is a 4-byte payload length and a 4-byte CRC32 of the payload,
+# followed by the JSON payload, with raw byte values stored base64-tagged.
+# Segment files are named after the LSN of their first record, so a record's
+# LSN is implied by its position.
+RECORD_HEADER = struct.Struct('>II')
+SEGMENT_PREFIX = 'wal-'
+SEGMENT_SUFFIX = '.log'
+
+SYNC_BATCH = 'batch'
+SYNC_INTERVAL = 'interval'
+SYNC_NONE = 'none'
+SYNC_MODES = (SYNC_BATCH, SYNC_INTERVAL, SYNC_NONE)
+
+
+class WALError(Exception):
+    pass
+
+
+def segment_name(first_lsn: int) -> str:
+    return f"{SEGMENT_PREFIX}{first_lsn:020d}{SEGMENT_SUFFIX}"
+
+
+def encode_record(record: Dict[str, Any]) -> bytes:
+    payload = json_dumps(record)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_records(data: bytes) -> Tuple[List[Dict[str, Any]], int]:
+    # Returns the records that decoded cleanly and the byte offset just past
+    # the last one; anything after that offset is a torn or corrupt tail.
+    records = []
+    offset = 0
+    size = len(data)
+    while size - offset >= RECORD_HEADER.size:
+        length, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        end = start + length
+        if end > size:
+            break
+        payload = data[start:end]
+        if zlib.crc32(payload) != crc:
+            break
+        try:
+            records.append(json_loads(payload))
+        except ValueError:
+            break
+        offset = end
+    return records, offset
+
+
+class _DeferredSync(threading.local):
+    depth = 0
+    lsn = 0
+
+
+class WriteAheadLog:
+    def __init__(self, directory: str, sync_mode: str = SYNC_BATCH, sync_interval_ms: float = 10.0,
+                 segment_size: int = 64 * 1024 * 1024):
+        if sync_mode not in SYNC_MODES:
+            raise ValueError(f"sync_mode must be one of {SYNC_MODES}")
+        self.directory = directory
+        self.sync_mode = sync_mode
+        self.sync_interval = sync_interval_ms / 1000.0
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+
+        self._cond = threading.Condition()
+        self._pending = bytearray()
+        self._pending_count = 0
+        self._callbacks: List[Tuple[int, Callable[[Optional[Exception]], None]]] = []
+        self._error: Optional[Exception] = None
+        self._closed = False
+        self._deferred = _DeferredSync()
+
+        self.stats = {'records': 0, 'bytes': 0, 'flushes': 0, 'fsyncs': 0}
+
+        self._segment_first_lsn, self._next_lsn = self._recover_tail()
+        self._written_lsn = self._next_lsn - 1
+        self._durable_lsn = self._next_lsn - 1
+        self._file = open(self._segment_path(self._segment_first_lsn), 'ab')
+        self._segment_bytes = self._file.tell()
+        # Guards the segment file; held by the flusher while writing and by
+        # roll_segment, never together with self._cond.
+        self._io_lock = threading.Lock()
+        self._file_next_lsn = self._next_lsn
+
+        self._flusher = threading.Thread(target=self._flush_loop, name='wal-flusher', daemon=True)
+        self._flusher.start()
+        logger.info(f"WriteAheadLog opened at {directory} (sync_mode={sync_mode}, next_lsn={self._next_lsn})")
+
+    def _segment_path(self, first_lsn: int) -> str:
+        return os.path.join(self.directory, segment_name(first_lsn))
+
+    def segments(self) -> List[Tuple[int, str]]:
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                first_lsn = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+                segments.append((first_lsn, os.path.join(self.directory, name)))
+        segments.sort()
+        return segments
+
+    def _recover_tail(self) -> Tuple[int, int]:
+        segments = self.segments()
+        if not segments:
+            return 1, 1
+
+        first_lsn, path = segments[-1]
+        with open(path, 'rb') as f:
+            data = f.read()
+        records, valid = decode_records(data)
+        if valid < len(data):
+            logger.warning(f"WAL segment {path} has a torn tail; truncating {len(data) - valid} bytes")
+            with open(path, 'r+b') as f:
+                f.truncate(valid)
+        return first_lsn, first_lsn + len(records)
+
+    @property
+    def next_lsn(self) -> int:
+        with self._cond:
+            return self._next_lsn
+
+    @property
+    def durable_lsn(self) -> int:
+        with self._cond:
+            return self._durable_lsn
+
+    def append(self, record: Dict[str, Any]) -> int:
+        # Callers append while holding the lock that orders the mutation, so
+        # log order always matches the order mutations were applied in.
+        data = encode_record(record)
+        with self._cond:
+            if self._closed:
+                raise WALError("Write-ahead log is closed")
+            if self._error is not None:
+                raise WALError(f"Write-ahead log failed: {self._error}")
+            lsn = self._next_lsn
+            self._next_lsn += 1
+            self._pending += data
+            self._pending_count += 1
+            if self.sync_mode != SYNC_INTERVAL:
+                self._cond.notify_all()
+            return lsn
+
+    def wait(self, lsn: Optional[int]):
+        # Blocks until lsn is on disk. Only fsync-per-batch mode makes writers
+        # wait; the other modes acknowledge as soon as the record is queued.
+        if lsn is None or self.sync_mode != SYNC_BATCH:
+            return
+        deferred = self._deferred
+        if deferred.depth:
+            deferred.lsn = max(deferred.lsn, lsn)
+            return
+        with self._cond:
+            while self._durable_lsn < lsn and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise WALError(f"Write-ahead log failed: {self._error}")
+
+    def when_durable(self, lsn: Optional[int], callback: Callable[[Optional[Exception]], None]):
+        # Non-blocking variant of wait() for event-loop callers. The callback
+        # runs on the flusher thread, or immediately if nothing needs waiting.
+        if lsn is None or self.sync_mode != SYNC_BATCH:
+            callback(None)
+            return
+        with self._cond:
+            if self._error is not None:
+                ready, error = True, WALError(f"Write-ahead log failed: {self._error}")
+            elif self._durable_lsn >= lsn:
+                ready, error = True, None
+            else:
+                self._callbacks.append((lsn, callback))
+                ready, error = False, None
+        if ready:
+            callback(error)
+
+    @contextmanager
+    def deferred(self) -> Iterator[_DeferredSync]:
+        # Collects the highest LSN written by this thread instead of waiting on
+        # each record, so a batch of pipelined requests waits for one fsync.
+        deferred = self._deferred
+        if deferred.depth == 0:
+            deferred.lsn = 0
+        deferred.depth += 1
+        try:
+            yield deferred
+        finally:
+            deferred.depth -= 1
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                if self.sync_mode == SYNC_INTERVAL:
+                    self._cond.wait(self.sync_interval)
+                else:
+                    while not self._pending and not self._closed:
+                        self._cond.wait()
+                if not self._pending:
+                    if self._closed:
+                        return
+                    continue
+                batch = self._pending
+                count = self._pending_count
+                self._pending = bytearray()
+                self._pending_count = 0
+                last_lsn = self._written_lsn + count
+
+            error = None
+            try:
+                self._write(batch, last_lsn)
+            except Exception as e:
+                error = e
+                logger.error(f"WAL flush failed: {e}")
+
+            with self._cond:
+                if error is not None:
+                    # Nothing is written after a failed batch: the file may end
+                    # in part of it, and later records would sit past a hole.
+                    # Appends and waits fail from here on.
+                    self._error = error
+                    self._pending = bytearray()
+                    self._pending_count = 0
+                else:
+                    self._written_lsn = last_lsn
+                    self._durable_lsn = last_lsn
+                    self.stats['records'] += count
+                    self.stats['bytes'] += len(batch)
+                    self.stats['flushes'] += 1
+                ready = [cb for lsn, cb in self._callbacks if lsn <= self._durable_lsn or error]
+                self._callbacks = [(lsn, cb) for lsn, cb in self._callbacks
+                                   if lsn > self._durable_lsn and not error]
+                self._cond.notify_all()
+
+            for callback in ready:
+                try:
+                    callback(WALError(f"Write-ahead log failed: {error}") if error else None)
+                except Exception as e:
+                    logger.error(f"WAL durability callback failed: {e}")
+            if error is not None:
+                return
+
+    def _write(self, batch: bytes, last_lsn: int):
+        with self._io_lock:
+            self._file.write(batch)
+            self._file.flush()
+            if self.sync_mode != SYNC_NONE:
+                os.fsync(self._file.fileno())
+                self.stats['fsyncs'] += 1
+            self._segment_bytes += len(batch)
+            self._file_next_lsn = last_lsn + 1
+            if self._segment_bytes >= self.segment_size:
+                self._rotate(last_lsn + 1)
+
+    def _rotate(self, first_lsn: int):
+        if self.sync_mode != SYNC_NONE:
+            os.fsync(self._file.fileno())
+        self._file.close()
+        self._segment_first_lsn = first_lsn
+        self._file = open(self._segment_path(first_lsn), 'ab')
+        self._segment_bytes = 0
+        logger.info(f"WAL rotated to segment starting at LSN {first_lsn}")
+
+    def roll_segment(self):
+        # Starts a new segment so everything written so far sits in closed
+        # segments that truncate_before can remove once a snapshot covers them.
+        with self._io_lock:
+            if self._segment_bytes:
+                self._rotate(self._file_next_lsn)
+
+    def truncate_before(self, lsn: int) -> int:
+        # Removes segments whose records all precede lsn. The newest segment is
+        # always kept since it is the one being appended to.
+        segments = self.segments()
+        removed = 0
+        for (first_lsn, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first > lsn:
+                break
+            os.remove(path)
+            removed += 1
+        if removed:
+            logger.info(f"WAL truncated {removed} segments before LSN {lsn}")
+        return removed
+
+    def replay(self, from_lsn: int = 1) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        segments = self.segments()
+        for i, (first_lsn, path) in enumerate(segments):
+            next_first = segments[i + 1][0] if i + 1 < len(segments) else None
+            if next_first is not None and next_first <= from_lsn:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            records, valid = decode_records(data)
+            if valid < len(data) and next_first is not None:
+                raise WALError(f"WAL segment {path} is corrupt at byte {valid}")
+            for offset, record in enumerate(records):
+                lsn = first_lsn + offset
+                if lsn >= from_lsn:
+                    yield lsn, record
+
+    def sync(self):
+        # Waits for everything appended so far to reach the file.
+        with self._cond:
+            target = self._next_lsn - 1
+            self._cond.notify_all()
+            while self._written_lsn < target and self._error is None:
+                self._cond.wait(0.05)
+                self._cond.notify_all()
+
+    def close(self):
+        self.sync()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join(timeout=5.0)
+        with self._io_lock:
+            if self._error is None:
+                if self.sync_mode != SYNC_NONE:
+                    os.fsync(self._file.fileno())
+                self._file.close()
+            else:
+                try:
+                    self._file.close()
+                except OSError as e:
+                    logger.error(f"WAL close failed: {e}")
+        logger.info(f"WriteAheadLog closed at LSN {self._durable_lsn}")
@@ -0,0 +1,251 @@
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class WatchError(Exception):
+    pass
+
+
+class Watcher:
+    # One subscription: exact keys and/or key prefixes, optionally limited to
+    # some event types and without values (enough for cache invalidation).
+    # Matching events are queued here by the hub's dispatcher thread and
+    # drained by the connection that streams them. A watcher that falls
+    # max_pending events behind is dropped instead of buffering without bound.
+    def __init__(self, keys: Iterable[str] = (), prefixes: Iterable[str] = (), max_pending: int = 10000,
+                 types: Optional[Iterable[str]] = None, values: bool = True):
+        self.keys = frozenset(keys)
+        self.prefixes = tuple(prefixes)
+        self.types = frozenset(types) if types is not None else None
+        self.values = values
+        self.max_pending = max_pending
+        self.start_seq = 0
+        self.last_seq = 0
+        self.overflowed = False
+        self.closed = False
+        self.notify: Optional[Callable[[], None]] = None
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._event = threading.Event()
+        self._signalled = False
+
+    def matches(self, key: str) -> bool:
+        return key in self.keys or any(key.startswith(prefix) for prefix in self.prefixes)
+
+    def _deliver(self, event: Dict[str, Any]) -> bool:
+        # Caller holds the hub lock. Returns False once the watcher overflows.
+        if self.types is not None and event['type'] not in self.types:
+            return True
+        if len(self._queue) >= self.max_pending:
+            self.overflowed = True
+            return False
+        if not self.values and 'value' in event:
+            event = {name: field for name, field in event.items() if name != 'value'}
+        self._queue.append(event)
+        return True
+
+    def _wake(self):
+        # Signals once per drain, so a busy stream costs one wake-up per batch
+        # rather than one per event.
+        if self._signalled:
+            return
+        self._signalled = True
+        self._event.set()
+        if self.notify is not None:
+            try:
+                self.notify()
+            except Exception as e:
+                logger.error(f"Watcher notify failed: {e}")
+
+    def drain(self) -> List[Dict[str, Any]]:
+        self._signalled = False
+        self._event.clear()
+        events = []
+        queue = self._queue
+        while queue:
+            events.append(queue.popleft())
+        if events:
+            self.last_seq = events[-1]['seq']
+        return events
+
+    def wait(self, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        if not self._queue and not self.overflowed and not self.closed:
+            self._event.wait(timeout)
+        return self.drain()
+
+
+class WatchHub:
+    # Change feed for watch subscriptions. The store calls publish() while it
+    # holds its own lock, so events for one key are queued in the order they
+    # were applied. publish() only appends to a deque; numbering, history and
+    # fan-out to watchers happen on the dispatcher thread, which keeps the cost
+    # of many watchers off the write path.
+    def __init__(self, history: int = 10000, max_pending: int = 10000):
+        self.history_size = history
+        self.max_pending = max_pending
+        # Sequence numbers restart with the process; clients resuming a
+        # stream must present the epoch they saw it under.
+        self.epoch = uuid.uuid4().hex[:16]
+        self.seq = 0
+        self._pending: Deque[Tuple[Any, ...]] = deque()
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=history)
+        self._by_key: Dict[str, Set[Watcher]] = {}
+        self._by_prefix: Dict[str, Set[Watcher]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.published = 0
+        self.dropped_watchers = 0
+
+    def publish(self, event_type: str, key: str, value: Any = None, owner: Optional[str] = None,
+                shared: bool = False):
+        self._pending.append((event_type, key, value, owner, shared, time.time()))
+        if not self._wake.is_set():
+            self._wake.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='watch-dispatcher', daemon=True)
+        self._thread.start()
+        logger.info(f"WatchHub started (history={self.history_size}, epoch={self.epoch})")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        self.dispatch()
+        with self._lock:
+            watchers = self._all_watchers()
+            self._by_key.clear()
+            self._by_prefix.clear()
+        for watcher in watchers:
+            watcher.closed = True
+            watcher._wake()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.dispatch()
+            except Exception as e:
+                logger.error(f"Watch dispatch failed: {e}")
+
+    def dispatch(self):
+        pending = self._pending
+        if not pending:
+            return
+        woken: Set[Watcher] = set()
+        with self._lock:
+            while pending:
+                event_type, key, value, owner, shared, at = pending.popleft()
+                self.seq += 1
+                event = {'seq': self.seq, 'type': event_type, 'key': key, 'time': at}
+                if event_type == 'set':
+                    event['value'] = value
+                elif owner is not None:
+                    event['owner'] = owner
+                    if shared:
+                        event['shared'] = True
+                self._history.append(event)
+                self.published += 1
+                if not self._by_key and not self._by_prefix:
+                    continue
+                for watcher in self._matching(key):
+                    if watcher._deliver(event):
+                        woken.add(watcher)
+                    else:
+                        self._remove(watcher)
+                        self.dropped_watchers += 1
+                        woken.add(watcher)
+                        logger.warning(f"Dropping watcher {watcher.keys or watcher.prefixes}: "
+                                       f"{watcher.max_pending} events behind")
+        for watcher in woken:
+            watcher._wake()
+
+    def _matching(self, key: str) -> Iterable[Watcher]:
+        # Caller holds self._lock. Returns a copy, as overflowing watchers are
+        # unregistered while the caller iterates.
+        watchers = self._by_key.get(key)
+        if not self._by_prefix:
+            return tuple(watchers) if watchers else ()
+        matched = set(watchers) if watchers else set()
+        for prefix, prefixed in self._by_prefix.items():
+            if key.startswith(prefix):
+                matched |= prefixed
+        return matched
+
+    def watch(self, keys: Iterable[str] = (), prefixes: Iterable[str] = (), since: Optional[int] = None,
+              epoch: Optional[str] = None, types: Optional[Iterable[str]] = None,
+              values: bool = True) -> Watcher:
+        # With since, events after that sequence number are replayed from the
+        # history first. Registration and replay happen under the dispatcher's
+        # lock, so the stream has no gap and no duplicate between the two.
+        watcher = Watcher(keys, prefixes, self.max_pending, types, values)
+        if not watcher.keys and not watcher.prefixes:
+            raise WatchError('watch needs at least one key or prefix')
+        with self._lock:
+            if since is not None:
+                if epoch is not None and epoch != self.epoch:
+                    raise WatchError('Event history was reset by a server restart')
+                oldest = self._history[0]['seq'] if self._history else self.seq + 1
+                if since > self.seq:
+                    raise WatchError(f"Sequence {since} is ahead of the server ({self.seq})")
+                if since + 1 < oldest:
+                    raise WatchError(f"Events after {since} are no longer retained (oldest is {oldest})")
+                for event in self._history:
+                    if event['seq'] > since and watcher.matches(event['key']):
+                        if not watcher._deliver(event):
+                            raise WatchError(f"More than {watcher.max_pending} events to replay")
+            watcher.start_seq = since if since is not None else self.seq
+            watcher.last_seq = watcher.start_seq
+            for key in watcher.keys:
+                self._by_key.setdefault(key, set()).add(watcher)
+            for prefix in watcher.prefixes:
+                self._by_prefix.setdefault(prefix, set()).add(watcher)
+        return watcher
+
+    def unwatch(self, watcher: Watcher):
+        with self._lock:
+            self._remove(watcher)
+        watcher.closed = True
+        watcher._wake()
+
+    def _remove(self, watcher: Watcher):
+        # Caller holds self._lock.
+        for index, names in ((self._by_key, watcher.keys), (self._by_prefix, watcher.prefixes)):
+            for name in names:
+                watchers = index.get(name)
+                if watchers is not None:
+                    watchers.discard(watcher)
+                    if not watchers:
+                        del index[name]
+
+    def _all_watchers(self) -> Set[Watcher]:
+        watchers: Set[Watcher] = set()
+        for index in (self._by_key, self._by_prefix):
+            for group in index.values():
+                watchers |= group
+        return watchers
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'epoch': self.epoch,
+                'seq': self.seq,
+                'published': self.published,
+                'watchers': len(self._all_watchers()),
+                'dropped_watchers': self.dropped_watchers,
+                'history': len(self._history),
+                'backlog': len(self._pending),
+            }
@@ -0,0 +1,86 @@
+import os
+import time
+import signal
+import logging
+import multiprocessing
+from typing import Any, Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# A worker that dies sooner than this after starting is not restarted again
+# straight away, so a worker that cannot start does not spin.
+RESTART_BACKOFF = 1.0
+
+
+def worker_options(options: Dict[str, Any], index: int, count: int) -> Dict[str, Any]:
+    # Worker `index` listens on port + index and keeps its own log and
+    # snapshots; a replica's worker follows the primary's worker of the same
+    # index.
+    options = dict(options, port=options['port'] + index, worker_index=index, workers=count)
+    if options.get('data_dir') is not None:
+        options['data_dir'] = os.path.join(options['data_dir'], f'worker-{index}')
+    if options.get('metrics_port') is not None:
+        options['metrics_port'] = options['metrics_port'] + index
+    if options.get('replica_of') is not None:
+        host, _, port = options['replica_of'].rpartition(':')
+        options['replica_of'] = f"{host}:{int(port) + index}"
+    return options
+
+
+def _run_worker(mode: str, options: Dict[str, Any], log_requests: bool):
+    from server import create_server
+    if log_requests:
+        for name in ('server', 'kv_store'):
+            logging.getLogger(name).setLevel(logging.DEBUG)
+    # Terminate means shut down cleanly, flushing the log.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    create_server(mode, options).start()
+
+
+def _spawn(mode: str, options: Dict[str, Any], index: int, count: int,
+           log_requests: bool) -> multiprocessing.Process:
+    process = multiprocessing.Process(target=_run_worker, name=f'kv-worker-{index}',
+                                      args=(mode, worker_options(options, index, count), log_requests))
+    process.start()
+    logger.info(f"Worker {index} started (pid {process.pid}, port {options['port'] + index})")
+    return process
+
+
+def run_workers(mode: str, options: Dict[str, Any], count: int, log_requests: bool = False):
+    # Runs `count` server processes, one per key partition, each with its own
+    # interpreter, store and event loop. Workers that exit are restarted until
+    # this process is terminated or interrupted.
+    stopping = False
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    processes: List[Optional[multiprocessing.Process]] = [None] * count
+    started = [0.0] * count
+    try:
+        while not stopping:
+            for index in range(count):
+                process = processes[index]
+                if stopping or (process is not None and process.is_alive()):
+                    continue
+                if process is not None:
+                    if time.time() - started[index] < RESTART_BACKOFF:
+                        continue
+                    logger.warning(f"Worker {index} exited with code {process.exitcode}; restarting")
+                processes[index] = _spawn(mode, options, index, count, log_requests)
+                started[index] = time.time()
+            time.sleep(0.2)
+    finally:
+        logger.info("Stopping workers...")
+        for process in processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in processes:
+            if process is not None:
+                process.join()
+        logger.info("Workers stopped")